@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Compares creating users one by one with :meth:`UserService.set_password`
+and ``persist()`` against :meth:`UserService.bulk_create`, run with::
+
+    python benchmarks/bench_bulk_create.py [number_of_users]
+"""
+from __future__ import print_function, unicode_literals
+
+import sys
+import timeit
+
+from common import make_session
+
+from ziggurat_foundations.hashing import PasswordHasher
+from ziggurat_foundations.models.services.user import UserService
+from ziggurat_foundations.tests.conftest import User
+
+
+def make_rows(prefix, count, passwords=True):
+    rows = []
+    for i in range(count):
+        row = {"user_name": "%s_%s" % (prefix, i), "email": "%s_%s" % (prefix, i)}
+        if passwords:
+            row["password"] = "password_%s" % i
+        rows.append(row)
+    return rows
+
+
+def main(count=2000):
+    db_session = make_session()
+
+    def per_object(prefix="object", passwords=True):
+        for row in make_rows(prefix, count, passwords):
+            password = row.pop("password", None)
+            user = User(**row)
+            if password is not None:
+                UserService.set_password(user, password)
+            else:
+                UserService.regenerate_security_code(user)
+            user.persist(db_session=db_session)
+            db_session.flush()
+
+    def per_object_no_passwords():
+        per_object("object_np", passwords=False)
+
+    def bulk_no_passwords():
+        rows = make_rows("bulk_np", count, passwords=False)
+        UserService.bulk_create(rows, db_session=db_session)
+
+    def bulk_threads():
+        hasher = PasswordHasher()
+        UserService.bulk_create(
+            make_rows("threads", count), hasher=hasher, db_session=db_session
+        )
+        hasher.shutdown()
+
+    def bulk_processes():
+        UserService.bulk_create(make_rows("processes", count), db_session=db_session)
+
+    for label, func in (
+        ("persist (no passwords)", per_object_no_passwords),
+        ("bulk_create (no passwords)", bulk_no_passwords),
+        ("set_password + persist", per_object),
+        ("bulk_create (thread pool)", bulk_threads),
+        ("bulk_create (process pool)", bulk_processes),
+    ):
+        elapsed = timeit.timeit(func, number=1)
+        print("{:<50} {:>10.1f} users/s".format(label, count / elapsed))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Compares OFFSET and keyset pagination of
+:meth:`UserService.resources_with_perms`, run with::
+
+    python benchmarks/bench_pagination.py
+"""
+from __future__ import print_function, unicode_literals
+
+from common import bench, make_session, populate
+
+from ziggurat_foundations.models.services.user import UserService
+from ziggurat_foundations.tests.conftest import User
+
+
+def main():
+    db_session = make_session()
+    populate(db_session, resources=20000)
+    user = db_session.query(User).get(1)
+    page_size = 50
+    query = UserService.resources_with_perms(user, ["view"], db_session=db_session)
+    pages = query.count() // page_size
+    # find key of last row before deepest page
+    last = UserService.resources_with_perms_page(
+        user, ["view"], limit=(pages - 1) * page_size, db_session=db_session
+    )[-1]
+    after = (last.resource_name, last.resource_id)
+
+    def offset_first():
+        query.limit(page_size).all()
+
+    def offset_deep():
+        query.limit(page_size).offset((pages - 1) * page_size).all()
+
+    def keyset_first():
+        UserService.resources_with_perms_page(
+            user, ["view"], limit=page_size, db_session=db_session
+        )
+
+    def keyset_deep():
+        UserService.resources_with_perms_page(
+            user, ["view"], limit=page_size, after=after, db_session=db_session
+        )
+
+    def stream():
+        for _ in UserService.iter_resources_with_perms(
+            user, ["view"], db_session=db_session
+        ):
+            pass
+
+    bench("offset - first page", offset_first, number=50)
+    bench("offset - page %s" % pages, offset_deep, number=50)
+    bench("keyset - first page", keyset_first, number=50)
+    bench("keyset - page %s" % pages, keyset_deep, number=50)
+    bench("iter_resources_with_perms - all rows", stream, number=5)
+
+
+if __name__ == "__main__":
+    main()
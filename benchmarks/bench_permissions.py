@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Compares ``Query`` based implementation of
+:func:`resource_permissions_for_users` (kept in test helpers as reference)
+against :class:`PermissionResolver` that the function uses now, run with::
+
+    python benchmarks/bench_permissions.py
+"""
+from __future__ import print_function, unicode_literals
+
+from common import bench, make_session, populate
+
+from ziggurat_foundations.models.services.user import UserService
+from ziggurat_foundations.permissions import ANY_PERMISSION, PermissionResolver
+from ziggurat_foundations.tests import legacy_resource_permissions_for_users
+
+
+def main():
+    db_session = make_session()
+    populate(db_session)
+    models_proxy = UserService.models_proxy
+    resolver = PermissionResolver.for_models_proxy(models_proxy)
+
+    def legacy():
+        legacy_resource_permissions_for_users(
+            models_proxy, ["view"], resource_ids=[5], db_session=db_session
+        )
+
+    def compiled():
+        resolver.resource_permissions_for_users(
+            ["view"], resource_ids=[5], db_session=db_session
+        )
+
+    def legacy_any():
+        legacy_resource_permissions_for_users(
+            models_proxy, ANY_PERMISSION, user_ids=[3], db_session=db_session
+        )
+
+    def compiled_any():
+        resolver.resource_permissions_for_users(
+            ANY_PERMISSION, user_ids=[3], db_session=db_session
+        )
+
+    bench("Query resource_permissions_for_users(resource_ids)", legacy)
+    bench("PermissionResolver(resource_ids)", compiled)
+    bench("Query resource_permissions_for_users(user_ids)", legacy_any)
+    bench("PermissionResolver(user_ids)", compiled_any)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Compares legacy ``Query`` based lookups with cached ``select()`` statements
+used by services, run with::
+
+    python benchmarks/bench_services.py
+"""
+from __future__ import print_function, unicode_literals
+
+import sqlalchemy as sa
+from common import bench, make_session, populate
+
+from ziggurat_foundations.models.services.resource import ResourceService
+from ziggurat_foundations.models.services.user import UserService
+from ziggurat_foundations.tests.conftest import (
+    GroupResourcePermission,
+    User,
+    UserResourcePermission,
+)
+
+
+def main():
+    db_session = make_session()
+    populate(db_session)
+    user = UserService.get(3, db_session=db_session)
+    resource = ResourceService.get(5, db_session=db_session)
+    group_ids = [g.id for g in user.groups]
+
+    def legacy_by_id():
+        query = db_session.query(User).filter(User.id == 3)
+        query.options(sa.orm.joinedload(User.groups)).first()
+
+    def legacy_by_user_name():
+        query = db_session.query(User)
+        query = query.filter(sa.func.lower(User.user_name) == "user_3")
+        query.options(sa.orm.joinedload(User.groups)).first()
+
+    def legacy_perms_for_user():
+        query = db_session.query(
+            GroupResourcePermission.group_id.label("owner_id"),
+            GroupResourcePermission.perm_name,
+            sa.literal("group").label("type"),
+        )
+        query = query.filter(GroupResourcePermission.group_id.in_(group_ids))
+        query = query.filter(
+            GroupResourcePermission.resource_id == resource.resource_id
+        )
+        query2 = db_session.query(
+            UserResourcePermission.user_id.label("owner_id"),
+            UserResourcePermission.perm_name,
+            sa.literal("user").label("type"),
+        )
+        query2 = query2.filter(UserResourcePermission.user_id == user.id)
+        query2 = query2.filter(
+            UserResourcePermission.resource_id == resource.resource_id
+        )
+        query.union(query2).all()
+
+    def by_id():
+        UserService.by_id(3, db_session=db_session)
+
+    def by_user_name():
+        UserService.by_user_name("user_3", db_session=db_session)
+
+    def perms_for_user():
+        ResourceService.perms_for_user(resource, user, db_session=db_session)
+
+    bench("Query by_id", legacy_by_id)
+    bench("UserService.by_id", by_id)
+    bench("Query by_user_name", legacy_by_user_name)
+    bench("UserService.by_user_name", by_user_name)
+    bench("Query perms_for_user", legacy_perms_for_user)
+    bench("ResourceService.perms_for_user", perms_for_user)
+
+
+if __name__ == "__main__":
+    main()
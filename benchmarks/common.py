@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Shared fixtures for benchmark scripts - builds in-memory (or ``DB_STRING``)
+database populated with models used by the test suite.
+"""
+from __future__ import print_function, unicode_literals
+
+import os
+import timeit
+
+import sqlalchemy as sa
+from sqlalchemy.orm import sessionmaker
+
+from ziggurat_foundations.tests.conftest import (
+    Base,
+    Group,
+    GroupResourcePermission,
+    ResourceTestObj,
+    User,
+    UserGroup,
+    UserResourcePermission,
+)
+
+
+def make_session():
+    engine = sa.create_engine(os.environ.get("DB_STRING", "sqlite://"))
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)()
+
+
+def populate(db_session, users=50, groups=10, resources=100):
+    ResourceTestObj.__possible_permissions__ = ["view", "edit"]
+    for i in range(1, groups + 1):
+        db_session.add(Group(id=i, group_name="group_%s" % i))
+    for i in range(1, users + 1):
+        db_session.add(
+            User(id=i, user_name="user_%s" % i, email="user_%s@example.com" % i)
+        )
+    db_session.flush()
+    for i in range(1, users + 1):
+        db_session.add(UserGroup(user_id=i, group_id=i % groups + 1))
+    for i in range(1, resources + 1):
+        db_session.add(
+            ResourceTestObj(
+                resource_id=i,
+                resource_name="resource_%s" % i,
+                owner_user_id=i % users + 1,
+            )
+        )
+    db_session.flush()
+    for i in range(1, resources + 1):
+        db_session.add(
+            GroupResourcePermission(
+                group_id=i % groups + 1, resource_id=i, perm_name="view"
+            )
+        )
+        db_session.add(
+            UserResourcePermission(
+                user_id=i % users + 1, resource_id=i, perm_name="edit"
+            )
+        )
+    db_session.flush()
+
+
+def bench(label, func, number=500, repeat=5):
+    best = min(timeit.repeat(func, number=number, repeat=repeat))
+    print("{:<50} {:>10.1f} us/call".format(label, best / number * 1e6))
+    return best
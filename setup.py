@@ -17,6 +17,7 @@ test_deps = [
     "pyramid",
     "webtest",
     "pyramid_jinja2",
+    "aiosqlite",
 ]
 
 setup(
@@ -45,7 +46,7 @@ setup(
     test_suite="ziggurat_foundations.tests",
     tests_require=test_deps,
     install_requires=[
-        "sqlalchemy",
+        "sqlalchemy>=1.4",
         "passlib>=1.6.1",
         "paginate",
         "paginate_sqlalchemy",
@@ -56,6 +57,7 @@ setup(
     setup_requires=["pytest-runner"],
     extras_require={
         "test": test_deps,
+        "asyncio": ["sqlalchemy[asyncio]>=1.4.18"],
         "lint": ["black", "pylint", "rstcheck", "flake8"],
     },
 )
@@ -24,20 +24,62 @@ def import_model_service_mappings():
     )  # noqa
     from ziggurat_foundations.models.services.resource import ResourceService
     from ziggurat_foundations.models.services.resource_tree import ResourceTreeService
+    from ziggurat_foundations.models.services.resource_tree_gap import (
+        ResourceTreeServiceGapOrdering,
+    )
+    from ziggurat_foundations.models.services.resource_tree_closure import (
+        ResourceTreeServiceClosure,
+    )
+    from ziggurat_foundations.models.services.resource_tree_path import (
+        ResourceTreeServiceMaterializedPath,
+    )
+    from ziggurat_foundations.models.services.resource_tree_cte import (
+        ResourceTreeServiceCTE,
+    )
     from ziggurat_foundations.models.services.external_identity import (
         ExternalIdentityService,
     )
+    from ziggurat_foundations.models.services.effective_permission import (
+        EffectivePermissionService,
+    )
 
-    return {
+    mappings = {
         "User": [UserService],
         "Group": [GroupService],
         "GroupPermission": [GroupPermissionService],
         "UserPermission": [UserPermissionService],
         "UserResourcePermission": [UserResourcePermissionService],
         "GroupResourcePermission": [GroupResourcePermissionService],
-        "Resource": [ResourceService, ResourceTreeService],
+        "Resource": [
+            ResourceService,
+            ResourceTreeService,
+            ResourceTreeServiceGapOrdering,
+            ResourceTreeServiceClosure,
+            ResourceTreeServiceMaterializedPath,
+            ResourceTreeServiceCTE,
+        ],
         "ExternalIdentity": [ExternalIdentityService],
+        "EffectivePermission": [EffectivePermissionService],
     }
+    try:
+        from ziggurat_foundations.models.services.aio.user import AsyncUserService
+        from ziggurat_foundations.models.services.aio.group import AsyncGroupService
+        from ziggurat_foundations.models.services.aio.resource import (
+            AsyncResourceService,
+        )
+        from ziggurat_foundations.models.services.aio.resource_tree_postgres import (
+            AsyncResourceTreeServicePostgreSQL,
+        )
+    except ImportError:
+        # asyncio services need ziggurat_foundations[asyncio] extra
+        return mappings
+
+    mappings["User"].append(AsyncUserService)
+    mappings["Group"].append(AsyncGroupService)
+    mappings["Resource"].extend(
+        [AsyncResourceService, AsyncResourceTreeServicePostgreSQL]
+    )
+    return mappings
 
 
 def make_passwordmanager(schemes=None):
@@ -68,6 +110,8 @@ def ziggurat_model_init(
     group_resource_permission=None,
     resource=None,
     external_identity=None,
+    effective_permission=None,
+    resource_closure=None,
     *args,
     **kwargs
 ):
@@ -76,6 +120,10 @@ def ziggurat_model_init(
     as `_ziggurat_service`, Also attached a proxy object holding all model
     definitions that services might use
 
+    :param effective_permission: optional model for materialized effective
+            permissions table
+    :param resource_closure: optional model for closure table used by
+            ResourceTreeServiceClosure
     :param args:
     :param kwargs:
     :param passwordmanager, the password manager to override default one
@@ -93,6 +141,8 @@ def ziggurat_model_init(
     models.GroupResourcePermission = group_resource_permission
     models.Resource = resource
     models.ExternalIdentity = external_identity
+    models.EffectivePermission = effective_permission
+    models.ResourceClosure = resource_closure
 
     model_service_mapping = import_model_service_mappings()
 
@@ -109,3 +159,7 @@ def ziggurat_model_init(
         for service in services:
             setattr(service, "model", cls)
             setattr(service, "models_proxy", models)
+
+    from ziggurat_foundations.models.services.user import UserService
+
+    UserService.register_group_ids_listeners()
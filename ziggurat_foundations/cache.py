@@ -0,0 +1,593 @@
+# -*- coding: utf-8 -*-
+"""
+Process level caches for permission and user lookups.
+"""
+from __future__ import unicode_literals
+
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from ziggurat_foundations.models.base import get_db_session
+from ziggurat_foundations.models.services.resource import ResourceService
+from ziggurat_foundations.models.services.user import UserService
+from ziggurat_foundations.permissions import (
+    ANY_PERMISSION,
+    resource_permissions_for_users,
+)
+
+__all__ = ["CacheBackend", "MemoryCacheBackend", "PermissionCache", "UserCache"]
+
+
+class CacheBackend(object):
+    """
+    Interface for cache storage used by :class:`PermissionCache`,
+    implementations can keep data in local dictionaries, shared memory or
+    external key value stores.
+
+    Counters are used for generation tracking - they need to be atomic
+    across all processes sharing the backend and must never be evicted,
+    otherwise stale entries could be served again.
+    """
+
+    def get(self, key):
+        """
+        returns value stored under key or None if it is missing or expired
+
+        :param key:
+        :return:
+        """
+        raise NotImplementedError()
+
+    def set(self, key, value):
+        """
+        stores value under key
+
+        :param key:
+        :param value:
+        """
+        raise NotImplementedError()
+
+    def delete(self, key):
+        """
+        removes value stored under key
+
+        :param key:
+        """
+        raise NotImplementedError()
+
+    def clear(self):
+        """
+        removes all stored values (counters are kept)
+        """
+        raise NotImplementedError()
+
+    def counter(self, key):
+        """
+        returns current value of counter, 0 if counter was never incremented
+
+        :param key:
+        :return: int
+        """
+        raise NotImplementedError()
+
+    def incr(self, key):
+        """
+        increments counter and returns its new value
+
+        :param key:
+        :return: int
+        """
+        raise NotImplementedError()
+
+
+class MemoryCacheBackend(CacheBackend):
+    """
+    Thread safe in-process backend with LRU eviction and optional TTL
+
+    :param max_size: maximum number of cached values
+    :param ttl: number of seconds after which value expires, None disables
+        expiration
+    :param timer: callable returning current time in seconds
+    """
+
+    def __init__(self, max_size=10000, ttl=None, timer=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.timer = timer
+        self._items = OrderedDict()
+        self._counters = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires is not None and expires <= self.timer():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires = self.timer() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._items[key] = (expires, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def counter(self, key):
+        return self._counters.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            value = self._counters.get(key, 0) + 1
+            self._counters[key] = value
+            return value
+
+
+class _SessionInvalidated(object):
+    """
+    Base for caches invalidated by session listeners. Entries depending on
+    changed rows are invalidated right after flush, so the flushing session
+    does not read its own stale entries, and again when the transaction
+    commits or rolls back - until then other sessions still read old rows
+    and could cache them under already incremented generation.
+    """
+
+    def register(self, target=Session):
+        """
+        attaches ``after_flush``, ``after_commit`` and ``after_soft_rollback``
+        listeners to session, sessionmaker or session class
+
+        :param target:
+        """
+        sa.event.listen(target, "after_flush", self._after_flush)
+        sa.event.listen(target, "after_commit", self._after_commit)
+        sa.event.listen(target, "after_soft_rollback", self._after_soft_rollback)
+
+    def unregister(self, target=Session):
+        """
+        detaches listeners attached by :meth:`register`
+
+        :param target:
+        """
+        sa.event.remove(target, "after_flush", self._after_flush)
+        sa.event.remove(target, "after_commit", self._after_commit)
+        sa.event.remove(target, "after_soft_rollback", self._after_soft_rollback)
+
+    @property
+    def _pending_key(self):
+        return ("pending_invalidations", id(self))
+
+    def _changed_keys(self, instances):
+        raise NotImplementedError()
+
+    def _invalidate_keys(self, keys):
+        raise NotImplementedError()
+
+    def _after_flush(self, db_session, flush_context):
+        keys = self._changed_keys(
+            itertools.chain(db_session.new, db_session.dirty, db_session.deleted)
+        )
+        self._invalidate_until_finished(db_session, keys)
+
+    def _invalidate_until_finished(self, db_session, keys):
+        if keys:
+            self._invalidate_keys(keys)
+            db_session.info.setdefault(self._pending_key, set()).update(keys)
+
+    def _after_commit(self, db_session):
+        # released savepoint does not make changes visible to other sessions
+        finished = not db_session.in_nested_transaction()
+        self._invalidate_pending(db_session, finished)
+
+    def _after_soft_rollback(self, db_session, previous_transaction):
+        finished = previous_transaction.parent is None
+        self._invalidate_pending(db_session, finished)
+
+    def _invalidate_pending(self, db_session, finished):
+        if finished:
+            keys = db_session.info.pop(self._pending_key, None)
+        else:
+            keys = db_session.info.get(self._pending_key)
+        if keys:
+            self._invalidate_keys(keys)
+
+
+class PermissionCache(_SessionInvalidated):
+    """
+    Caches results of :meth:`UserService.permissions`,
+    :meth:`ResourceService.perms_for_user` and
+    :func:`resource_permissions_for_users` across requests.
+
+    Cached values are lists of
+    :class:`~ziggurat_foundations.permissions.PermissionIdTuple` so they
+    never reference ORM instances bound to a session. Every user, group and
+    resource has a generation counter that is part of the cache key, counters
+    are incremented by :meth:`register`-ed session listeners when permission
+    related rows are flushed or written by bulk ``grant``/``revoke`` and again
+    when the transaction ends, so stale entries are never served.
+
+    :param backend: :class:`CacheBackend` instance,
+        defaults to :class:`MemoryCacheBackend`
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else MemoryCacheBackend()
+
+    @property
+    def models_proxy(self):
+        return ResourceService.models_proxy
+
+    def generation(self, kind, obj_id):
+        """
+        returns current generation of user, group or resource
+
+        :param kind: one of "user", "group", "resource" or "global"
+        :param obj_id:
+        :return: int
+        """
+        return self.backend.counter(("generation", kind, obj_id))
+
+    def bump(self, kind, obj_id):
+        """
+        increments generation of user, group or resource invalidating all
+        cached entries depending on it
+
+        :param kind: one of "user", "group", "resource" or "global"
+        :param obj_id:
+        """
+        return self.backend.incr(("generation", kind, obj_id))
+
+    def user_permissions(self, instance, db_session=None):
+        """
+        cached version of :meth:`UserService.permissions`
+
+        :param instance:
+        :param db_session:
+        :return: list of PermissionIdTuple
+        """
+        key = ("user_permissions", instance.id) + self._user_generations(instance)
+        return self._get(
+            key,
+            lambda: UserService.permissions(
+                instance, db_session=db_session, ids_only=True
+            ),
+        )
+
+    def perms_for_user(self, instance, user, db_session=None):
+        """
+        cached version of :meth:`ResourceService.perms_for_user`
+
+        :param instance:
+        :param user:
+        :param db_session:
+        :return: list of PermissionIdTuple
+        """
+        key = (
+            "perms_for_user",
+            instance.resource_id,
+            user.id,
+            self.generation("resource", instance.resource_id),
+        ) + self._user_generations(user)
+        return self._get(
+            key,
+            lambda: ResourceService.perms_for_user(
+                instance, user, db_session=db_session, ids_only=True
+            ),
+        )
+
+    def resource_permissions_for_users(
+        self,
+        perm_names,
+        resource_ids=None,
+        user_ids=None,
+        group_ids=None,
+        resource_types=None,
+        limit_group_permissions=False,
+        skip_user_perms=False,
+        skip_group_perms=False,
+        db_session=None,
+    ):
+        """
+        cached version of :func:`resource_permissions_for_users`,
+        those entries depend on global generation that changes on every
+        permission related flush
+
+        :return: list of PermissionIdTuple
+        """
+        if perm_names in ([ANY_PERMISSION], ANY_PERMISSION):
+            perm_key = "__any_permission__"
+        else:
+            perm_key = tuple(perm_names or ())
+        key = (
+            "resource_permissions_for_users",
+            perm_key,
+            tuple(resource_ids or ()),
+            tuple(user_ids or ()),
+            tuple(group_ids or ()),
+            tuple(resource_types or ()),
+            bool(limit_group_permissions),
+            bool(skip_user_perms),
+            bool(skip_group_perms),
+            self.generation("global", None),
+        )
+        return self._get(
+            key,
+            lambda: resource_permissions_for_users(
+                self.models_proxy,
+                perm_names,
+                resource_ids=resource_ids,
+                user_ids=user_ids,
+                group_ids=group_ids,
+                resource_types=resource_types,
+                limit_group_permissions=limit_group_permissions,
+                skip_user_perms=skip_user_perms,
+                skip_group_perms=skip_group_perms,
+                db_session=db_session,
+                ids_only=True,
+            ),
+        )
+
+    def register(self, target=Session):
+        """
+        attaches session listeners and
+        :meth:`ResourceService.register_permission_write_listener` to
+        session, sessionmaker or session class
+
+        :param target:
+        """
+        super(PermissionCache, self).register(target)
+        ResourceService.register_permission_write_listener(
+            target, self._after_permission_write
+        )
+
+    def unregister(self, target=Session):
+        """
+        detaches listeners attached by :meth:`register`
+
+        :param target:
+        """
+        super(PermissionCache, self).unregister(target)
+        ResourceService.remove_permission_write_listener(
+            target, self._after_permission_write
+        )
+
+    def invalidate_instance(self, instance):
+        """
+        increments generations of users, groups and resources that are
+        referenced by passed model instance
+
+        :param instance:
+        :return: True if instance is permission related
+        """
+        keys = self._changed_keys([instance])
+        self._invalidate_keys(keys)
+        return bool(keys)
+
+    def _affected(self, instance):
+        models_proxy = self.models_proxy
+        if isinstance(instance, models_proxy.UserResourcePermission):
+            return [("user", instance.user_id), ("resource", instance.resource_id)]
+        elif isinstance(instance, models_proxy.GroupResourcePermission):
+            return [("group", instance.group_id), ("resource", instance.resource_id)]
+        elif isinstance(instance, models_proxy.UserGroup):
+            return [("user", instance.user_id), ("group", instance.group_id)]
+        elif isinstance(instance, models_proxy.UserPermission):
+            return [("user", instance.user_id)]
+        elif isinstance(instance, models_proxy.GroupPermission):
+            return [("group", instance.group_id)]
+        # ownership changes and memberships changed through relationships
+        elif isinstance(instance, models_proxy.Resource):
+            return [("resource", instance.resource_id)]
+        elif isinstance(instance, models_proxy.User):
+            return [("user", instance.id)]
+        elif isinstance(instance, models_proxy.Group):
+            return [("group", instance.id)]
+        return []
+
+    def _user_generations(self, user):
+        group_ids = sorted(UserService.group_ids(user))
+        return (self.generation("user", user.id),) + tuple(
+            (group_id, self.generation("group", group_id)) for group_id in group_ids
+        )
+
+    def _get(self, key, creator):
+        value = self.backend.get(key)
+        if value is None:
+            value = creator()
+            self.backend.set(key, value)
+        return list(value)
+
+    def _changed_keys(self, instances):
+        return set(
+            (kind, obj_id)
+            for instance in instances
+            for kind, obj_id in self._affected(instance)
+            if obj_id is not None
+        )
+
+    def _invalidate_keys(self, keys):
+        for kind, obj_id in keys:
+            self.bump(kind, obj_id)
+        if keys:
+            self.bump("global", None)
+
+    def _after_permission_write(self, db_session, user_ids, group_ids):
+        keys = set(("user", user_id) for user_id in user_ids)
+        keys.update(("group", group_id) for group_id in group_ids)
+        self._invalidate_until_finished(db_session, keys)
+
+
+class UserCache(_SessionInvalidated):
+    """
+    Caches users loaded by :meth:`UserService.by_id` across requests,
+    intended for ``request.user`` lookups.
+
+    Cached values are snapshots of user columns and group ids, on hit they
+    are merged into passed session without issuing any query (group ids
+    are restored into :meth:`UserService.group_ids` cache, ``groups``
+    relationship is loaded lazily on access). Cache key contains user
+    generation that is incremented by :meth:`register`-ed session listeners
+    when user or its memberships are flushed and again when the transaction
+    ends, and current value of ``stamp_attr`` column, so changes made by
+    other processes are picked up too.
+
+    Reading the stamp costs one primary key lookup of single column on every
+    :meth:`by_id` call, cache hit saves the user and groups queries but not
+    the round trip to the database. Applications where every writer
+    registers the cache can pass ``stamp_attr=None`` to serve hits without
+    any query.
+
+    :param backend: :class:`CacheBackend` instance, defaults to
+        :class:`MemoryCacheBackend` with passed ``max_size`` and ``ttl``
+    :param max_size: maximum number of cached users
+    :param ttl: number of seconds after which cached user expires
+    :param stamp_attr: name of user column that changes with the user,
+        ``security_code`` is regenerated on every password change,
+        None skips the stamp query - changes made outside of sessions this
+        cache is registered on are then picked up only after ``ttl``
+    """
+
+    def __init__(
+        self, backend=None, max_size=1000, ttl=300, stamp_attr="security_code"
+    ):
+        if backend is None:
+            backend = MemoryCacheBackend(max_size=max_size, ttl=ttl)
+        self.backend = backend
+        self.stamp_attr = stamp_attr
+
+    @property
+    def models_proxy(self):
+        return UserService.models_proxy
+
+    def by_id(self, user_id, db_session=None):
+        """
+        cached version of :meth:`UserService.by_id`
+
+        :param user_id:
+        :param db_session:
+        :return: user instance attached to db_session or None
+        """
+        db_session = get_db_session(db_session)
+        user_id = self._user_id(user_id)
+        if user_id is None:
+            return None
+        key = (
+            "user",
+            user_id,
+            self.backend.counter(("user_generation", user_id)),
+            self.backend.counter(("user_generation", None)),
+        )
+        if self.stamp_attr:
+            user = self.models_proxy.User
+            statement = sa.select(getattr(user, self.stamp_attr)).where(
+                user.id == user_id
+            )
+            row = db_session.execute(statement).first()
+            if row is None:
+                return None
+            key += (row[0],)
+        snapshot = self.backend.get(key)
+        if snapshot is None:
+            instance = UserService.by_id(user_id, db_session=db_session)
+            if instance is None:
+                return None
+            self.backend.set(key, self._snapshot(instance))
+            return instance
+        return self._restore(snapshot, db_session)
+
+    def group_ids(self, user_id, db_session=None):
+        """
+        cached version of :meth:`UserService.group_ids_by_user_id`
+
+        :param user_id:
+        :param db_session:
+        :return: frozenset
+        """
+        user_id = self._user_id(user_id)
+        if user_id is None:
+            return frozenset()
+        key = (
+            "group_ids",
+            user_id,
+            self.backend.counter(("user_generation", user_id)),
+            self.backend.counter(("user_generation", None)),
+        )
+        group_ids = self.backend.get(key)
+        if group_ids is None:
+            group_ids = UserService.group_ids_by_user_id(user_id, db_session=db_session)
+            self.backend.set(key, group_ids)
+        return group_ids
+
+    @classmethod
+    def _user_id(cls, user_id):
+        # userids that are not integers do not resolve to any user, same as
+        # unknown ids
+        try:
+            return int(user_id)
+        except (TypeError, ValueError):
+            return None
+
+    def invalidate(self, user_id=None):
+        """
+        drops cached entries of the user, passing None drops all users
+
+        :param user_id:
+        """
+        self.backend.incr(("user_generation", user_id))
+
+    def _snapshot(self, instance):
+        mapper = sa.inspect(self.models_proxy.User)
+        values = dict(
+            [(attr.key, getattr(instance, attr.key)) for attr in mapper.column_attrs]
+        )
+        return values, UserService.group_ids(instance)
+
+    def _restore(self, snapshot, db_session):
+        values, group_ids = snapshot
+        instance = sa.inspect(self.models_proxy.User).class_manager.new_instance()
+        for key, value in values.items():
+            setattr(instance, key, value)
+        sa.orm.make_transient_to_detached(instance)
+        instance = db_session.merge(instance, load=False)
+        state = sa.inspect(instance)
+        if "groups" not in state.dict:
+            state.info[UserService._group_ids_key] = group_ids
+        return instance
+
+    def _changed_keys(self, instances):
+        models_proxy = self.models_proxy
+        user_ids = set()
+        for instance in instances:
+            if isinstance(instance, models_proxy.User):
+                user_ids.add(instance.id)
+            elif isinstance(instance, models_proxy.UserGroup):
+                user_ids.add(instance.user_id)
+            # cached group ids may point to removed groups
+            elif isinstance(instance, models_proxy.Group):
+                user_ids.add(None)
+        return user_ids
+
+    def _invalidate_keys(self, keys):
+        for user_id in keys:
+            self.invalidate(user_id)
@@ -4,6 +4,9 @@ from __future__ import unicode_literals
 import importlib
 import logging
 
+from pyramid.settings import asbool
+
+from ziggurat_foundations.cache import UserCache
 from ziggurat_foundations.models.base import get_db_session
 from ziggurat_foundations.models.services.user import UserService
 
@@ -33,6 +36,19 @@ def includeme(config):
             _tmp = importlib.import_module(parts[0])
             session_provider_callable = getattr(_tmp, parts[1])
 
+    user_cache = None
+    if asbool(settings.get("%s.user_cache" % CONFIG_KEY, False)):
+        user_cache = UserCache(
+            max_size=int(settings.get("%s.user_cache.max_size" % CONFIG_KEY, 1000)),
+            ttl=float(settings.get("%s.user_cache.ttl" % CONFIG_KEY, 300)),
+            stamp_attr=settings.get(
+                "%s.user_cache.stamp_attr" % CONFIG_KEY, "security_code"
+            )
+            or None,
+        )
+        user_cache.register()
+    config.registry.ziggurat_user_cache = user_cache
+
     # This function is bundled into the request, so for each request you can
     # do request.user
     def get_user(request):
@@ -44,7 +60,29 @@ def includeme(config):
             # Else assign the request.session
             db_session = session_provider_callable(request)
         if userid is not None:
+            if user_cache is not None:
+                return user_cache.by_id(userid, db_session=db_session)
             return UserService.by_id(userid, db_session=db_session)
 
     # add in request.user function
     config.add_request_method(get_user, "user", reify=True, property=True)
+
+    # ids of groups of authenticated user, resolved without loading the user
+    def get_group_ids(request):
+        userid = request.unauthenticated_userid
+        if userid is None:
+            return frozenset()
+        # request.user was already loaded - reuse its groups
+        if "user" in request.__dict__ and request.user is not None:
+            return UserService.group_ids(request.user)
+        if try_global_session:
+            db_session = None
+        else:
+            db_session = session_provider_callable(request)
+        if user_cache is not None:
+            return user_cache.group_ids(userid, db_session=db_session)
+        return UserService.group_ids_by_user_id(userid, db_session=db_session)
+
+    config.add_request_method(
+        get_group_ids, "ziggurat_group_ids", reify=True, property=True
+    )
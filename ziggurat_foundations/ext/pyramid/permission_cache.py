@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import itertools
+import logging
+
+import sqlalchemy as sa
+
+from ziggurat_foundations.models.services.resource import ResourceService
+
+log = logging.getLogger(__name__)
+
+__all__ = ["RequestPermissionCache"]
+
+
+class RequestPermissionCache(object):
+    """
+    Memoizes permission lookups of :class:`ResourceService` for a single
+    request, cached entries are dropped whenever session used by the cached
+    resources flushes changes to users, groups, memberships, resources or
+    permission rows, or writes permission rows with bulk ``grant``/``revoke``
+    """
+
+    watched_models = (
+        "User",
+        "Group",
+        "UserGroup",
+        "Resource",
+        "UserResourcePermission",
+        "GroupResourcePermission",
+    )
+
+    def __init__(self, service=ResourceService):
+        self.service = service
+        self._cache = {}
+        self._sessions = set()
+
+    def perms_for_user(self, instance, user, **kwargs):
+        """
+        cached version of :meth:`ResourceService.perms_for_user`
+
+        :param instance:
+        :param user:
+        :return:
+        """
+        return self._get(
+            "perms_for_user", self.service.perms_for_user, instance, user, kwargs
+        )
+
+    def direct_perms_for_user(self, instance, user, **kwargs):
+        """
+        cached version of :meth:`ResourceService.direct_perms_for_user`
+
+        :param instance:
+        :param user:
+        :return:
+        """
+        return self._get(
+            "direct_perms_for_user",
+            self.service.direct_perms_for_user,
+            instance,
+            user,
+            kwargs,
+        )
+
+    def group_perms_for_user(self, instance, user, **kwargs):
+        """
+        cached version of :meth:`ResourceService.group_perms_for_user`
+
+        :param instance:
+        :param user:
+        :return:
+        """
+        return self._get(
+            "group_perms_for_user",
+            self.service.group_perms_for_user,
+            instance,
+            user,
+            kwargs,
+        )
+
+    def invalidate(self):
+        """
+        drops all cached permissions
+        """
+        self._cache.clear()
+
+    def close(self, request=None):
+        """
+        drops cached permissions and detaches session event listeners,
+        called automatically when request finishes
+
+        :param request:
+        """
+        for db_session in self._sessions:
+            sa.event.remove(db_session, "after_flush", self._after_flush)
+            ResourceService.remove_permission_write_listener(
+                db_session, self._after_permission_write
+            )
+        self._sessions.clear()
+        self.invalidate()
+
+    def _get(self, name, func, instance, user, kwargs):
+        key = (name, instance.resource_id, user.id, tuple(sorted(kwargs.items())))
+        if key not in self._cache:
+            db_session = sa.orm.object_session(instance)
+            if db_session is not None and db_session not in self._sessions:
+                sa.event.listen(db_session, "after_flush", self._after_flush)
+                ResourceService.register_permission_write_listener(
+                    db_session, self._after_permission_write
+                )
+                self._sessions.add(db_session)
+            self._cache[key] = func(instance, user, **kwargs)
+        return list(self._cache[key])
+
+    def _after_flush(self, db_session, flush_context):
+        models_proxy = self.service.models_proxy
+        watched = tuple(
+            models_proxy[name]
+            for name in self.watched_models
+            if models_proxy.get(name) is not None
+        )
+        for obj in itertools.chain(
+            db_session.new, db_session.dirty, db_session.deleted
+        ):
+            if isinstance(obj, watched):
+                log.debug("permission rows changed, invalidating cache")
+                self.invalidate()
+                return
+
+    def _after_permission_write(self, db_session, user_ids, group_ids):
+        log.debug("permission rows written, invalidating cache")
+        self.invalidate()
+
+
+def includeme(config):
+    # This function is bundled into the request, so for each request you can
+    # do request.ziggurat_perms.perms_for_user(resource, user)
+    def get_ziggurat_perms(request):
+        cache = RequestPermissionCache()
+        request.add_finished_callback(cache.close)
+        return cache
+
+    config.add_request_method(get_ziggurat_perms, "ziggurat_perms", reify=True)
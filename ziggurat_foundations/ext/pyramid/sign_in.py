@@ -5,9 +5,12 @@ import importlib
 import logging
 
 from pyramid.security import remember, forget
+from pyramid.settings import asbool
 
+from ziggurat_foundations.hashing import PasswordHasher
 from ziggurat_foundations.models.base import get_db_session
 from ziggurat_foundations.models.services.user import UserService
+from ziggurat_foundations.throttle import LoginThrottle
 
 CONFIG_KEY = "ziggurat_foundations"
 log = logging.getLogger(__name__)
@@ -32,6 +35,13 @@ class ZigguratSignInBadAuth(object):
         self.came_from = came_from
 
 
+class ZigguratSignInThrottled(ZigguratSignInBadAuth):
+    """
+    returned instead of bad auth context when attempt was rejected by
+    throttle before checking the credentials
+    """
+
+
 class ZigguratSignOut(object):
     def __contains__(self, other):
         return True
@@ -70,12 +80,67 @@ def includeme(config):
             _tmp = importlib.import_module(parts[0])
             session_provider_callable = getattr(_tmp, parts[1])
 
+    password_hasher = settings.get("%s.sign_in.password_hasher" % CONFIG_KEY)
+    max_workers = settings.get("%s.sign_in.password_hasher.max_workers" % CONFIG_KEY)
+    max_workers = int(max_workers) if max_workers else None
+    if password_hasher in ("thread", "process"):
+        password_hasher = PasswordHasher(
+            max_workers=max_workers, use_processes=password_hasher == "process"
+        )
+    elif password_hasher == "":
+        password_hasher = None
+    elif isinstance(password_hasher, str):
+        parts = password_hasher.split(":")
+        _tmp = importlib.import_module(parts[0])
+        password_hasher = getattr(_tmp, parts[1])
+
+    # dotted path to HashMigrationQueue instance
+    hash_migration_queue = settings.get("%s.sign_in.hash_migration_queue" % CONFIG_KEY)
+    if hash_migration_queue == "":
+        hash_migration_queue = None
+    elif isinstance(hash_migration_queue, str):
+        parts = hash_migration_queue.split(":")
+        _tmp = importlib.import_module(parts[0])
+        hash_migration_queue = getattr(_tmp, parts[1])
+
+    # "memory" or dotted path to LoginThrottle instance
+    throttle = settings.get("%s.sign_in.throttle" % CONFIG_KEY)
+    if throttle == "memory":
+        throttle_options = {}
+        for option in (
+            "user_capacity",
+            "user_refill_rate",
+            "ip_capacity",
+            "ip_refill_rate",
+        ):
+            value = settings.get("%s.sign_in.throttle.%s" % (CONFIG_KEY, option))
+            if value is not None:
+                throttle_options[option] = float(value)
+        throttle = LoginThrottle(**throttle_options)
+    elif throttle == "":
+        throttle = None
+    elif isinstance(throttle, str):
+        parts = throttle.split(":")
+        _tmp = importlib.import_module(parts[0])
+        throttle = getattr(_tmp, parts[1])
+    max_password_length = int(
+        settings.get("%s.sign_in.max_password_length" % CONFIG_KEY, 4096)
+    )
+    use_client_addr = asbool(
+        settings.get("%s.sign_in.throttle.use_client_addr" % CONFIG_KEY, True)
+    )
+
     endpoint = ZigguratSignInProvider(
         settings=settings,
         session_getter=session_provider_callable,
         signin_came_from_key=signin_came_from_key,
         signin_username_key=signin_username_key,
         signin_password_key=signin_password_key,
+        password_hasher=password_hasher,
+        hash_migration_queue=hash_migration_queue,
+        throttle=throttle,
+        max_password_length=max_password_length,
+        use_client_addr=use_client_addr,
     )
 
     config.add_route(
@@ -93,29 +158,47 @@ def includeme(config):
 
 
 class ZigguratSignInProvider(object):
+    password_hasher = None
+    hash_migration_queue = None
+    throttle = None
+    max_password_length = 4096
+    use_client_addr = True
+
     def __init__(self, *args, **kwargs):
         for k, v in kwargs.items():
             setattr(self, k, v)
 
     def sign_in(self, request):
         came_from = request.params.get(self.signin_came_from_key, "/")
-        db_session = self.session_getter(request)
+        user_name = request.params.get(self.signin_username_key)
+        password = request.params.get(self.signin_password_key)
+        if self.throttle is not None:
+            client_addr = request.client_addr if self.use_client_addr else None
+            if not self.throttle.allow(user_name, client_addr):
+                headers = forget(request)
+                return ZigguratSignInThrottled(headers=headers, came_from=came_from)
+        # bound hashing cost of oversized passwords
+        if not user_name or not password or len(password) > self.max_password_length:
+            headers = forget(request)
+            return ZigguratSignInBadAuth(headers=headers, came_from=came_from)
 
-        user = UserService.by_user_name(
-            request.params.get(self.signin_username_key), db_session=db_session
-        )
+        db_session = self.session_getter(request)
+        user = UserService.by_user_name_or_email(user_name, db_session=db_session)
         if user is None:
-            # if no result, test to see if email exists
-            user = UserService.by_email(
-                request.params.get(self.signin_username_key), db_session=db_session
+            # verify against dummy hash so unknown users take the same time
+            UserService.dummy_check_password(password, hasher=self.password_hasher)
+        elif UserService.check_password(
+            user,
+            password,
+            hasher=self.password_hasher,
+            migration_queue=self.hash_migration_queue,
+        ):
+            if self.throttle is not None:
+                self.throttle.succeeded(user_name)
+            headers = remember(request, user.id)
+            return ZigguratSignInSuccess(
+                headers=headers, came_from=came_from, user=user
             )
-        if user:
-            password = request.params.get(self.signin_password_key)
-            if UserService.check_password(user, password):
-                headers = remember(request, user.id)
-                return ZigguratSignInSuccess(
-                    headers=headers, came_from=came_from, user=user
-                )
         headers = forget(request)
         return ZigguratSignInBadAuth(headers=headers, came_from=came_from)
 
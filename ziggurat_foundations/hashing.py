@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""
+Runs password hashing of passlib contexts in executor pools.
+"""
+from __future__ import unicode_literals
+
+import asyncio
+import itertools
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+__all__ = ["PasswordHasher", "HashMigrationQueue"]
+
+log = logging.getLogger(__name__)
+
+# contexts rebuilt from configuration strings inside worker processes
+_contexts = {}
+_contexts_lock = threading.Lock()
+
+
+def _get_context(passwordmanager):
+    if not isinstance(passwordmanager, str):
+        return passwordmanager
+    from passlib.context import CryptContext
+
+    with _contexts_lock:
+        context = _contexts.get(passwordmanager)
+        if context is None:
+            context = CryptContext.from_string(passwordmanager)
+            _contexts[passwordmanager] = context
+        return context
+
+
+def _hash(passwordmanager, raw_password):
+    context = _get_context(passwordmanager)
+    # support API for both passlib 1.x and 2.x
+    hash_callable = getattr(context, "hash", context.encrypt)
+    return hash_callable(raw_password)
+
+
+def _verify_and_update(passwordmanager, raw_password, password_hash):
+    context = _get_context(passwordmanager)
+    return context.verify_and_update(raw_password, password_hash)
+
+
+def _verify(passwordmanager, raw_password, password_hash):
+    context = _get_context(passwordmanager)
+    return context.verify(raw_password, password_hash), None
+
+
+class PasswordHasher(object):
+    """
+    Runs ``hash`` and ``verify_and_update`` of user password manager in
+    executor so hashing does not block the calling thread or event loop.
+
+    Thread pool is used by default - hashlib based schemes like
+    pbkdf2_sha256 release the GIL, so hashing runs in parallel with other
+    threads. With ``use_processes`` password manager is passed to workers
+    as its configuration string and rebuilt there, which also works for
+    schemes implemented in pure python.
+
+    :param executor: ``concurrent.futures`` executor to use, created from
+        ``max_workers`` and ``use_processes`` if not passed
+    :param max_workers: number of workers of created executor
+    :param use_processes: create process pool instead of thread pool
+    """
+
+    def __init__(self, executor=None, max_workers=None, use_processes=False):
+        if executor is None:
+            if use_processes:
+                executor = ProcessPoolExecutor(max_workers=max_workers)
+            else:
+                executor = ThreadPoolExecutor(
+                    max_workers=max_workers, thread_name_prefix="ziggurat-hasher"
+                )
+        self.executor = executor
+        self.use_processes = isinstance(executor, ProcessPoolExecutor)
+
+    def hash_future(self, passwordmanager, raw_password):
+        """
+        hashes password in executor
+
+        :param passwordmanager: passlib CryptContext
+        :param raw_password:
+        :return: future resolving to password hash
+        """
+        return self.executor.submit(
+            _hash, self._passwordmanager(passwordmanager), raw_password
+        )
+
+    def hash_many(self, passwordmanager, raw_passwords, chunksize=16):
+        """
+        hashes many passwords in parallel across executor workers
+
+        :param passwordmanager: passlib CryptContext
+        :param raw_passwords: list of passwords
+        :param chunksize: number of passwords sent to process worker at once
+        :return: list of password hashes in order of passwords
+        """
+        passwordmanager = self._passwordmanager(passwordmanager)
+        return list(
+            self.executor.map(
+                _hash,
+                itertools.repeat(passwordmanager, len(raw_passwords)),
+                raw_passwords,
+                chunksize=chunksize,
+            )
+        )
+
+    def verify_future(self, passwordmanager, raw_password, password_hash, update=True):
+        """
+        verifies password against hash in executor
+
+        :param passwordmanager: passlib CryptContext
+        :param raw_password:
+        :param password_hash:
+        :param update: compute replacement hash for deprecated schemes
+        :return: future resolving to (verified, replacement_hash) tuple
+            as returned by ``CryptContext.verify_and_update``, replacement
+            hash is always None if ``update`` is False
+        """
+        return self.executor.submit(
+            _verify_and_update if update else _verify,
+            self._passwordmanager(passwordmanager),
+            raw_password,
+            password_hash,
+        )
+
+    async def hash(self, passwordmanager, raw_password):
+        """
+        awaitable version of :meth:`hash_future`
+
+        :param passwordmanager: passlib CryptContext
+        :param raw_password:
+        :return: password hash
+        """
+        return await asyncio.wrap_future(
+            self.hash_future(passwordmanager, raw_password)
+        )
+
+    async def verify(self, passwordmanager, raw_password, password_hash, update=True):
+        """
+        awaitable version of :meth:`verify_future`
+
+        :param passwordmanager: passlib CryptContext
+        :param raw_password:
+        :param password_hash:
+        :param update: compute replacement hash for deprecated schemes
+        :return: (verified, replacement_hash) tuple
+        """
+        return await asyncio.wrap_future(
+            self.verify_future(passwordmanager, raw_password, password_hash, update)
+        )
+
+    def shutdown(self, wait=True):
+        """
+        shuts down the executor
+
+        :param wait:
+        """
+        self.executor.shutdown(wait=wait)
+
+    def _passwordmanager(self, passwordmanager):
+        if self.use_processes:
+            return passwordmanager.to_string()
+        return passwordmanager
+
+
+class HashMigrationQueue(object):
+    """
+    Collects password hashes that need to be upgraded to the default scheme
+    of password manager and applies the upgrades in batches from background
+    thread, so sign-in does not pay for second hash computation and write
+    during scheme migrations.
+
+    Pending upgrades keep the plaintext password in memory until the batch
+    is processed - they are never persisted, if the process exits before
+    flushing the hash is simply upgraded on one of the next sign-ins.
+    Each user is queued at most once and update is skipped if the stored
+    hash changed in the meantime.
+
+    :param session_factory: callable returning new session used for
+        updates, the session is committed and closed after each batch
+    :param hasher: optional PasswordHasher used to compute new hashes
+    :param batch_size: number of pending upgrades that triggers a flush
+    :param interval: seconds after which pending upgrades are flushed
+    :param max_pending: upgrades over this limit are dropped
+    :param user_service: service used for bulk updates,
+        defaults to UserService
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        hasher=None,
+        batch_size=500,
+        interval=5.0,
+        max_pending=100000,
+        user_service=None,
+    ):
+        if user_service is None:
+            from ziggurat_foundations.models.services.user import UserService
+
+            user_service = UserService
+        self.session_factory = session_factory
+        self.hasher = hasher
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self.user_service = user_service
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def enqueue(self, instance, raw_password):
+        """
+        records pending hash upgrade for user, raw password was already
+        verified against ``instance.user_password``
+
+        :param instance: user object
+        :param raw_password:
+        :return: True if upgrade was queued
+        """
+        with self._lock:
+            if self._stopped or (
+                instance.id not in self._pending
+                and len(self._pending) >= self.max_pending
+            ):
+                return False
+            self._pending[instance.id] = (
+                instance.passwordmanager,
+                raw_password,
+                instance.user_password,
+            )
+            pending = len(self._pending)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="ziggurat-hash-migration"
+                )
+                self._thread.daemon = True
+                self._thread.start()
+        if pending >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    def flush(self):
+        """
+        computes new hashes for all pending upgrades and bulk updates them
+        in batches of ``batch_size``
+
+        :return: number of processed upgrades
+        """
+        processed = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    if not self._pending:
+                        break
+                    user_ids = list(self._pending)[: self.batch_size]
+                    batch = [(i, self._pending.pop(i)) for i in user_ids]
+                self._apply(batch)
+                processed += len(batch)
+        return processed
+
+    def stop(self, flush=True, timeout=None):
+        """
+        stops background thread
+
+        :param flush: apply remaining upgrades before returning
+        :param timeout: seconds to wait for background thread
+        """
+        with self._lock:
+            self._stopped = True
+            thread = self._thread
+        self._wakeup.set()
+        if thread is not None:
+            thread.join(timeout)
+        if flush:
+            self.flush()
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                log.exception("password hash migration failed")
+
+    def _apply(self, batch):
+        if self.hasher is not None:
+            futures = [
+                self.hasher.hash_future(passwordmanager, raw_password)
+                for _, (passwordmanager, raw_password, _) in batch
+            ]
+            new_hashes = [future.result() for future in futures]
+        else:
+            new_hashes = [
+                _hash(passwordmanager, raw_password)
+                for _, (passwordmanager, raw_password, _) in batch
+            ]
+        rows = [
+            (user_id, old_hash, new_hash)
+            for (user_id, (_, _, old_hash)), new_hash in zip(batch, new_hashes)
+        ]
+        db_session = self.session_factory()
+        try:
+            self.user_service.bulk_update_passwords(rows, db_session=db_session)
+            db_session.commit()
+        except Exception:
+            db_session.rollback()
+            raise
+        finally:
+            db_session.close()
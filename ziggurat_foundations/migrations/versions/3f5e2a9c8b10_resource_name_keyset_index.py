@@ -0,0 +1,26 @@
+"""create index for keyset pagination of resources
+
+Revision ID: 3f5e2a9c8b10
+Revises: 7d4a5c3e2b91
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from __future__ import unicode_literals
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "3f5e2a9c8b10"
+down_revision = "7d4a5c3e2b91"
+
+
+def upgrade():
+    op.create_index(
+        "ix_resources_resource_name_resource_id",
+        "resources",
+        ["resource_name", "resource_id"],
+    )
+
+
+def downgrade():
+    op.drop_index("ix_resources_resource_name_resource_id", table_name="resources")
@@ -0,0 +1,24 @@
+"""create index on resources parent_id and ordering
+
+Revision ID: 5b8e1d4c2f60
+Revises: 9c1f3e7a5d42
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from __future__ import unicode_literals
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "5b8e1d4c2f60"
+down_revision = "9c1f3e7a5d42"
+
+
+def upgrade():
+    op.create_index(
+        "ix_resources_parent_id_ordering", "resources", ["parent_id", "ordering"]
+    )
+
+
+def downgrade():
+    op.drop_index("ix_resources_parent_id_ordering", table_name="resources")
@@ -0,0 +1,59 @@
+"""add effective permissions table
+
+Table of optional EffectivePermissionMixin model is created for every
+install, it stays empty until EffectivePermissionService.rebuild() is called.
+
+Revision ID: 7d4a5c3e2b91
+Revises: 613e7c11dead
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from __future__ import unicode_literals
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "7d4a5c3e2b91"
+down_revision = "613e7c11dead"
+
+
+def upgrade():
+    op.create_table(
+        "effective_permissions",
+        sa.Column(
+            "user_id",
+            sa.Integer,
+            sa.ForeignKey("users.id", onupdate="CASCADE", ondelete="CASCADE"),
+            nullable=False,
+        ),
+        sa.Column(
+            "resource_id",
+            sa.Integer(),
+            sa.ForeignKey(
+                "resources.resource_id", onupdate="CASCADE", ondelete="CASCADE"
+            ),
+            nullable=False,
+        ),
+        sa.Column("perm_name", sa.Unicode(64), nullable=False),
+        sa.Column("source", sa.Unicode(20), nullable=False),
+        sa.PrimaryKeyConstraint(
+            "user_id",
+            "resource_id",
+            "perm_name",
+            "source",
+            name="pk_effective_permissions",
+        ),
+    )
+    op.create_index(
+        "ix_effective_permissions_resource_id",
+        "effective_permissions",
+        ["resource_id"],
+    )
+
+
+def downgrade():
+    op.drop_index(
+        "ix_effective_permissions_resource_id", table_name="effective_permissions"
+    )
+    op.drop_table("effective_permissions")
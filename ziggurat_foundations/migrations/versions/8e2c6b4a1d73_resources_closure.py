@@ -0,0 +1,76 @@
+"""add resources closure table
+
+Table of optional ResourceClosureMixin model is created and filled from
+existing tree for every install, it is kept up to date only by
+ResourceTreeServiceClosure - call its rebuild() before enabling it.
+
+Revision ID: 8e2c6b4a1d73
+Revises: 5b8e1d4c2f60
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from __future__ import unicode_literals
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "8e2c6b4a1d73"
+down_revision = "5b8e1d4c2f60"
+
+LEVEL_SQL = """
+    INSERT INTO resources_closure (ancestor_id, descendant_id, depth)
+    SELECT c.ancestor_id, r.resource_id, c.depth + 1
+    FROM resources_closure c
+    JOIN resources r ON r.parent_id = c.descendant_id
+    WHERE c.depth = :depth
+"""
+
+
+def upgrade():
+    op.create_table(
+        "resources_closure",
+        sa.Column(
+            "ancestor_id",
+            sa.Integer(),
+            sa.ForeignKey(
+                "resources.resource_id", onupdate="CASCADE", ondelete="CASCADE"
+            ),
+            nullable=False,
+        ),
+        sa.Column(
+            "descendant_id",
+            sa.Integer(),
+            sa.ForeignKey(
+                "resources.resource_id", onupdate="CASCADE", ondelete="CASCADE"
+            ),
+            nullable=False,
+        ),
+        sa.Column("depth", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint(
+            "ancestor_id", "descendant_id", name="pk_resources_closure"
+        ),
+    )
+    op.create_index(
+        "ix_resources_closure_descendant_id_depth",
+        "resources_closure",
+        ["descendant_id", "depth"],
+    )
+    # fill the table from existing tree, one level at a time
+    op.execute(
+        """
+        INSERT INTO resources_closure (ancestor_id, descendant_id, depth)
+        SELECT resource_id, resource_id, 0 FROM resources
+        """
+    )
+    conn = op.get_bind()
+    depth = 0
+    while conn.execute(sa.text(LEVEL_SQL), {"depth": depth}).rowcount:
+        depth += 1
+
+
+def downgrade():
+    op.drop_index(
+        "ix_resources_closure_descendant_id_depth", table_name="resources_closure"
+    )
+    op.drop_table("resources_closure")
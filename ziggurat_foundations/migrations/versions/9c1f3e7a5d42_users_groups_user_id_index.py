@@ -0,0 +1,22 @@
+"""create index on users_groups user_id
+
+Revision ID: 9c1f3e7a5d42
+Revises: 3f5e2a9c8b10
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from __future__ import unicode_literals
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "9c1f3e7a5d42"
+down_revision = "3f5e2a9c8b10"
+
+
+def upgrade():
+    op.create_index(op.f("ix_users_groups_user_id"), "users_groups", ["user_id"])
+
+
+def downgrade():
+    op.drop_index(op.f("ix_users_groups_user_id"), table_name="users_groups")
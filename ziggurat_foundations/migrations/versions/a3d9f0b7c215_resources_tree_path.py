@@ -0,0 +1,64 @@
+"""add materialized tree path to resources
+
+Paths of existing resources are filled in the same format that
+ResourceTreeServiceMaterializedPath writes (hex encoded ordering and
+resource_id + 2 ** 31 per level), so the service can be enabled right
+after upgrade.
+
+Revision ID: a3d9f0b7c215
+Revises: 8e2c6b4a1d73
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+from __future__ import unicode_literals
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "a3d9f0b7c215"
+down_revision = "8e2c6b4a1d73"
+
+resources = sa.table(
+    "resources",
+    sa.column("resource_id", sa.Integer),
+    sa.column("parent_id", sa.Integer),
+    sa.column("ordering", sa.Integer),
+    sa.column("tree_path", sa.String),
+)
+
+
+def upgrade():
+    op.add_column("resources", sa.Column("tree_path", sa.String(512)))
+    op.create_index("ix_resources_tree_path", "resources", ["tree_path"])
+    conn = op.get_bind()
+    nodes = {}
+    for row in conn.execute(
+        sa.select(resources.c.resource_id, resources.c.parent_id, resources.c.ordering)
+    ):
+        nodes[row.resource_id] = row
+    paths = {}
+    for resource_id in nodes:
+        chain = []
+        while resource_id is not None and resource_id not in paths:
+            chain.append(nodes[resource_id])
+            resource_id = nodes[resource_id].parent_id
+        tree_path = paths.get(resource_id, "")
+        for node in reversed(chain):
+            tree_path += "{:08x}{:08x}".format(
+                node.ordering, node.resource_id + 2 ** 31
+            )
+            paths[node.resource_id] = tree_path
+    if paths:
+        statement = resources.update()
+        statement = statement.where(resources.c.resource_id == sa.bindparam("b_id"))
+        statement = statement.values(tree_path=sa.bindparam("b_tree_path"))
+        conn.execute(
+            statement,
+            [{"b_id": i, "b_tree_path": tree_path} for i, tree_path in paths.items()],
+        )
+
+
+def downgrade():
+    op.drop_index("ix_resources_tree_path", table_name="resources")
+    op.drop_column("resources", "tree_path")
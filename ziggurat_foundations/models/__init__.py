@@ -16,3 +16,21 @@ def groupfinder(userid, request):
         groups = ["group:%s" % g.id for g in request.user.groups]
         return groups
     return []
+
+
+def group_ids_finder(userid, request):
+    """
+    groupfinder implementation for pyramid applications that resolves
+    principals from ``request.ziggurat_group_ids`` (provided by
+    ``ziggurat_foundations.ext.pyramid.get_user``) - only ids from
+    users_groups table are fetched, user row is never loaded
+
+    :param userid:
+    :param request:
+    :return:
+    """
+    if userid:
+        return [
+            "group:%s" % group_id for group_id in sorted(request.ziggurat_group_ids)
+        ]
+    return []
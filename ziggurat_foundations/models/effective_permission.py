@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import sqlalchemy as sa
+from sqlalchemy.ext.declarative import declared_attr
+
+from ziggurat_foundations.models.base import BaseModel
+
+__all__ = ["EffectivePermissionMixin"]
+
+
+class EffectivePermissionMixin(BaseModel):
+    """
+    Mixin for optional EffectivePermission model - materialized set of
+    permissions every user has for resources (directly, via groups or
+    ownership), maintained by EffectivePermissionService. The table is
+    created by migrations for every install and stays empty until
+    ``EffectivePermissionService.rebuild()`` is called
+    """
+
+    __table_args__ = (
+        sa.PrimaryKeyConstraint(
+            "user_id",
+            "resource_id",
+            "perm_name",
+            "source",
+            name="pk_effective_permissions",
+        ),
+        sa.Index("ix_effective_permissions_resource_id", "resource_id"),
+        {"mysql_engine": "InnoDB", "mysql_charset": "utf8"},
+    )
+
+    @declared_attr
+    def __tablename__(self):
+        return "effective_permissions"
+
+    @declared_attr
+    def user_id(self):
+        return sa.Column(
+            sa.Integer,
+            sa.ForeignKey("users.id", onupdate="CASCADE", ondelete="CASCADE"),
+            primary_key=True,
+        )
+
+    @declared_attr
+    def resource_id(self):
+        return sa.Column(
+            sa.Integer(),
+            sa.ForeignKey(
+                "resources.resource_id", onupdate="CASCADE", ondelete="CASCADE"
+            ),
+            primary_key=True,
+            autoincrement=False,
+        )
+
+    @declared_attr
+    def perm_name(self):
+        return sa.Column(sa.Unicode(64), primary_key=True)
+
+    @declared_attr
+    def source(self):
+        """ one of: user, group, owner_user, owner_group """
+        return sa.Column(sa.Unicode(20), primary_key=True)
+
+    def __repr__(self):
+        return "<EffectivePermission: u:%s, %s, r:%s, %s>" % (
+            self.user_id,
+            self.perm_name,
+            self.resource_id,
+            self.source,
+        )
@@ -2,7 +2,7 @@
 from __future__ import unicode_literals
 
 import sqlalchemy as sa
-from sqlalchemy.ext.declarative import declared_attr
+from sqlalchemy.ext.declarative import declared_attr, has_inherited_table
 
 from ziggurat_foundations.exc import ZigguratException
 from ziggurat_foundations.models.base import BaseModel
@@ -103,11 +103,24 @@ class ResourceMixin(BaseModel):
             secondary="users_resources_permissions",
             passive_deletes=True,
             passive_updates=True,
-            overlaps="user_permissions"
+            overlaps="user_permissions",
         )
 
     __mapper_args__ = {"polymorphic_on": resource_type}
-    __table_args__ = {"mysql_engine": "InnoDB", "mysql_charset": "utf8"}
+
+    @declared_attr
+    def __table_args__(self):
+        table_args = {"mysql_engine": "InnoDB", "mysql_charset": "utf8"}
+        # single table inheritance subclasses must not redefine the table
+        if has_inherited_table(self):
+            return table_args
+        return (
+            sa.Index(
+                "ix_resources_resource_name_resource_id", "resource_name", "resource_id"
+            ),
+            sa.Index("ix_resources_parent_id_ordering", "parent_id", "ordering"),
+            table_args,
+        )
 
     def __repr__(self):
         return "<Resource: %s, %s, id: %s position: %s>" % (
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import sqlalchemy as sa
+from sqlalchemy.ext.declarative import declared_attr
+
+from ziggurat_foundations.models.base import BaseModel
+
+__all__ = ["ResourceClosureMixin"]
+
+
+class ResourceClosureMixin(BaseModel):
+    """
+    Mixin for optional ResourceClosure model - closure table of resource
+    tree holding row for every ancestor/descendant pair (including every
+    resource paired with itself at depth 0), maintained by
+    ResourceTreeServiceClosure. The table is created by migrations for every
+    install, rows of resources changed before the service was used are
+    recomputed with ``ResourceTreeServiceClosure.rebuild()``
+    """
+
+    __table_args__ = (
+        sa.PrimaryKeyConstraint(
+            "ancestor_id", "descendant_id", name="pk_resources_closure"
+        ),
+        sa.Index("ix_resources_closure_descendant_id_depth", "descendant_id", "depth"),
+        {"mysql_engine": "InnoDB", "mysql_charset": "utf8"},
+    )
+
+    @declared_attr
+    def __tablename__(self):
+        return "resources_closure"
+
+    @declared_attr
+    def ancestor_id(self):
+        return sa.Column(
+            sa.Integer(),
+            sa.ForeignKey(
+                "resources.resource_id", onupdate="CASCADE", ondelete="CASCADE"
+            ),
+            primary_key=True,
+            autoincrement=False,
+        )
+
+    @declared_attr
+    def descendant_id(self):
+        return sa.Column(
+            sa.Integer(),
+            sa.ForeignKey(
+                "resources.resource_id", onupdate="CASCADE", ondelete="CASCADE"
+            ),
+            primary_key=True,
+            autoincrement=False,
+        )
+
+    @declared_attr
+    def depth(self):
+        return sa.Column(sa.Integer(), nullable=False)
+
+    def __repr__(self):
+        return "<ResourceClosure: a:%s, d:%s, depth:%s>" % (
+            self.ancestor_id,
+            self.descendant_id,
+            self.depth,
+        )
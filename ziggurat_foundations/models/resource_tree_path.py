@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import sqlalchemy as sa
+from sqlalchemy.ext.declarative import declared_attr
+
+__all__ = ["ResourceTreePathMixin"]
+
+
+class ResourceTreePathMixin(object):
+    """
+    Optional mixin for Resource model adding indexed materialized path
+    column maintained by ResourceTreeServiceMaterializedPath, it has to be
+    listed before ResourceMixin::
+
+        class Resource(ResourceTreePathMixin, ResourceMixin, Base):
+            pass
+
+    Path is concatenation of fixed width segments (ordering and resource
+    id encoded as hex) of every ancestor and the resource itself, so
+    sorting by path gives depth first traversal with siblings in order and
+    whole subtree is single range of the index.
+
+    Every level takes 16 characters, so the default ``String(512)`` column
+    holds trees 32 levels deep. Deeper trees need longer column, override
+    ``tree_path`` with ``declared_attr`` returning ``String`` of bigger
+    length (and index it the same way).
+    """
+
+    @declared_attr
+    def tree_path(self):
+        return sa.Column(sa.String(512), index=True)
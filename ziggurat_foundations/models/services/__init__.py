@@ -7,6 +7,7 @@ from ziggurat_foundations.models.base import get_db_session
 class BaseService(object):
     model = None
     models_proxy = None
+    _statements = {}
 
     @classmethod
     def all(cls, klass, db_session=None):
@@ -32,3 +33,22 @@ class BaseService(object):
         """
         db_session = get_db_session(db_session)
         return db_session.query(cls.model)
+
+    @classmethod
+    def _cached_statement(cls, name, builder):
+        """
+        returns statement produced by ``builder`` - it is built only once
+        per service and model, values should be passed to it as bound
+        parameters so every call reuses the same statement object and hits
+        sqlalchemy compiled statement cache
+
+        :param name:
+        :param builder: callable returning statement
+        :return: statement
+        """
+        key = (cls, cls.model, name)
+        models_proxy, statement = BaseService._statements.get(key, (None, None))
+        if statement is None or models_proxy is not cls.models_proxy:
+            statement = builder()
+            BaseService._statements[key] = (cls.models_proxy, statement)
+        return statement
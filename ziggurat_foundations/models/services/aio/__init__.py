@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Asyncio variants of services working with
+:class:`sqlalchemy.ext.asyncio.AsyncSession`.
+
+All statements are built with ``select()`` and executed with
+``await db_session.execute()``, returned values are lists instead of
+``Query`` objects. Async sessions can't lazy load relationships, so services
+only touch column attributes of passed instances and fetch everything else
+explicitly.
+
+``AsyncSession`` is not safe for concurrent use - to run many checks
+concurrently on one event loop give every task its own session.
+"""
+from __future__ import unicode_literals
+
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import async_object_session
+
+from ziggurat_foundations.exc import ZigguratSessionException
+
+
+def get_async_db_session(session=None, obj=None):
+    """
+    returns ``AsyncSession`` the object is attached to or passed session
+
+    :param session:
+    :param obj:
+    :return:
+    """
+    if obj is not None:
+        object_session = async_object_session(obj)
+        if object_session is not None:
+            return object_session
+    if session is not None:
+        return session
+    raise ZigguratSessionException("No AsyncSession found")
+
+
+class AsyncBaseService(object):
+    model = None
+    models_proxy = None
+
+    @classmethod
+    async def all(cls, klass, db_session=None):
+        """
+        returns all objects of specific type
+
+        :param klass:
+        :param db_session:
+        :return: list
+        """
+        db_session = get_async_db_session(db_session)
+        result = await db_session.execute(cls.base_query(klass))
+        return result.scalars().all()
+
+    @classmethod
+    def base_query(cls, klass=None):
+        """
+        returns base select statement for specific service
+
+        :param klass:
+        :return: select
+        """
+        return sa.select(klass or cls.model)
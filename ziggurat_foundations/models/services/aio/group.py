@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import sqlalchemy as sa
+
+from ziggurat_foundations.models.services.aio import (
+    AsyncBaseService,
+    get_async_db_session,
+)
+
+__all__ = ["AsyncGroupService"]
+
+
+class AsyncGroupService(AsyncBaseService):
+    """
+    Asyncio counterpart of :class:`GroupService`
+    """
+
+    @classmethod
+    async def get(cls, group_id, db_session=None):
+        """
+        Fetch row using primary key -
+        will use existing object in session if already present
+
+        :param group_id:
+        :param db_session:
+        :return:
+        """
+        db_session = get_async_db_session(db_session)
+        return await db_session.get(cls.model, group_id)
+
+    @classmethod
+    async def by_group_name(cls, group_name, db_session=None):
+        """
+        fetch group by name
+
+        :param group_name:
+        :param db_session:
+        :return:
+        """
+        db_session = get_async_db_session(db_session)
+        statement = sa.select(cls.model).where(cls.model.group_name == group_name)
+        result = await db_session.execute(statement)
+        return result.scalars().first()
+
+    @classmethod
+    async def users(cls, instance, user_ids=None, db_session=None):
+        """
+        returns users belonging to the group ordered by user name
+
+        :param instance:
+        :param user_ids: limits the users to specific user ids
+        :param db_session:
+        :return: list
+        """
+        db_session = get_async_db_session(db_session, instance)
+        user = cls.models_proxy.User
+        user_group = cls.models_proxy.UserGroup
+        statement = sa.select(user).join(user_group, user_group.user_id == user.id)
+        statement = statement.where(user_group.group_id == instance.id)
+        if user_ids:
+            statement = statement.where(user.id.in_(user_ids))
+        statement = statement.order_by(user.user_name)
+        result = await db_session.execute(statement)
+        return result.scalars().all()
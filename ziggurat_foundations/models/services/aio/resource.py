@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import sqlalchemy as sa
+
+from ziggurat_foundations.models.services.aio import (
+    AsyncBaseService,
+    get_async_db_session,
+)
+from ziggurat_foundations.models.services.aio.user import AsyncUserService
+from ziggurat_foundations.models.services.resource import ResourceService
+from ziggurat_foundations.permissions import (
+    ALL_PERMISSIONS,
+    ANY_PERMISSION,
+    PermissionResolver,
+    PermissionTuple,
+)
+
+__all__ = ["AsyncResourceService"]
+
+
+class AsyncResourceService(AsyncBaseService):
+    """
+    Asyncio counterpart of :class:`ResourceService`
+    """
+
+    @classmethod
+    async def get(cls, resource_id, db_session=None):
+        """
+        Fetch row using primary key -
+        will use existing object in session if already present
+
+        :param resource_id:
+        :param db_session:
+        :return:
+        """
+        db_session = get_async_db_session(db_session)
+        return await db_session.get(cls.model, resource_id)
+
+    @classmethod
+    async def by_resource_id(cls, resource_id, db_session=None):
+        """
+        fetch the resource by id
+
+        :param resource_id:
+        :param db_session:
+        :return:
+        """
+        db_session = get_async_db_session(db_session)
+        statement = sa.select(cls.model).where(
+            cls.model.resource_id == int(resource_id)
+        )
+        result = await db_session.execute(statement)
+        return result.scalars().first()
+
+    @classmethod
+    async def lock_resource_for_update(cls, resource_id, db_session):
+        """
+        Selects resource for update - locking access for other transactions
+
+        :param resource_id:
+        :param db_session:
+        :return:
+        """
+        db_session = get_async_db_session(db_session)
+        statement = ResourceService._lock_resource_statement(resource_id)
+        result = await db_session.execute(statement)
+        return result.scalars().first()
+
+    @classmethod
+    async def perms_for_user(cls, instance, user, db_session=None, ids_only=False):
+        """
+        returns all permissions that given user has for this resource
+            from groups and directly set ones too
+
+        :param instance:
+        :param user:
+        :param db_session:
+        :param ids_only: return PermissionIdTuple objects instead of
+            PermissionTuple objects referencing ORM instances
+        :return:
+        """
+        db_session = get_async_db_session(db_session, instance)
+        statement = ResourceService._cached_statement(
+            "perms_for_user", ResourceService._perms_for_user_statement
+        )
+        params = {"resource_id": instance.resource_id, "user_id": user.id}
+        rows = (await db_session.execute(statement, params)).all()
+        owner_group = await cls._owned_by_user_group(instance, user, db_session)
+        if ids_only:
+            return ResourceService._perm_ids_for_user(instance, user, rows, owner_group)
+
+        group_ids = set([row.owner_id for row in rows if row.type == "group"])
+        if owner_group:
+            group_ids.add(instance.owner_group_id)
+        groups_dict = await AsyncUserService.groups_dict(
+            user, group_ids, db_session=db_session
+        )
+        return ResourceService._perms_for_user_from_rows(
+            instance, user, rows, groups_dict, owner_group
+        )
+
+    @classmethod
+    async def direct_perms_for_user(cls, instance, user, db_session=None):
+        """
+        returns permissions that given user has for this resource
+            without ones inherited from groups that user belongs to
+
+        :param instance:
+        :param user:
+        :param db_session:
+        :return:
+        """
+        db_session = get_async_db_session(db_session, instance)
+        urp = cls.models_proxy.UserResourcePermission
+        statement = sa.select(urp.user_id, urp.perm_name).where(
+            urp.user_id == user.id, urp.resource_id == instance.resource_id
+        )
+        result = await db_session.execute(statement)
+        perms = [
+            PermissionTuple(user, row.perm_name, "user", None, instance, False, True)
+            for row in result
+        ]
+
+        # include all perms if user is the owner of this resource
+        if instance.owner_user_id == user.id:
+            perms.append(
+                PermissionTuple(
+                    user, ALL_PERMISSIONS, "user", None, instance, True, True
+                )
+            )
+        return perms
+
+    @classmethod
+    async def group_perms_for_user(cls, instance, user, db_session=None):
+        """
+        returns permissions that given user has for this resource
+            that are inherited from groups
+
+        :param instance:
+        :param user:
+        :param db_session:
+        :return:
+        """
+        db_session = get_async_db_session(db_session, instance)
+        perms = await cls.resource_permissions_for_users(
+            ANY_PERMISSION,
+            resource_ids=[instance.resource_id],
+            user_ids=[user.id],
+            skip_user_perms=True,
+            db_session=db_session,
+        )
+        # include all perms if user is the owner of this resource
+        if await cls._owned_by_user_group(instance, user, db_session):
+            groups_dict = await AsyncUserService.groups_dict(
+                user, [instance.owner_group_id], db_session=db_session
+            )
+            perms.append(
+                PermissionTuple(
+                    user,
+                    ALL_PERMISSIONS,
+                    "group",
+                    groups_dict.get(instance.owner_group_id),
+                    instance,
+                    True,
+                    True,
+                )
+            )
+        return perms
+
+    @classmethod
+    async def users_for_perm(
+        cls,
+        instance,
+        perm_name,
+        user_ids=None,
+        group_ids=None,
+        limit_group_permissions=False,
+        skip_group_perms=False,
+        db_session=None,
+    ):
+        """
+        return PermissionTuples for users AND groups that have given
+        permission for the resource, perm_name is __any_permission__ then
+        users with any permission will be listed
+
+        :param instance:
+        :param perm_name:
+        :param user_ids: limits the permissions to specific user ids
+        :param group_ids: limits the permissions to specific group ids
+        :param limit_group_permissions: should be used if we do not want to have
+        user objects returned for group permissions, this might cause performance
+        issues for big groups
+        :param skip_group_perms: do not attach group permissions to the resultset
+        :param db_session:
+        :return:
+        """  # noqa
+        db_session = get_async_db_session(db_session, instance)
+        users_perms = await cls.resource_permissions_for_users(
+            [perm_name],
+            [instance.resource_id],
+            user_ids=user_ids,
+            group_ids=group_ids,
+            limit_group_permissions=limit_group_permissions,
+            skip_group_perms=skip_group_perms,
+            db_session=db_session,
+        )
+        if instance.owner_user_id:
+            owner = await db_session.get(cls.models_proxy.User, instance.owner_user_id)
+            users_perms.append(
+                PermissionTuple(
+                    owner, ALL_PERMISSIONS, "user", None, instance, True, True
+                )
+            )
+        if instance.owner_group_id and not skip_group_perms:
+            user = cls.models_proxy.User
+            user_group = cls.models_proxy.UserGroup
+            owner_group = await db_session.get(
+                cls.models_proxy.Group, instance.owner_group_id
+            )
+            statement = sa.select(user).join(user_group, user_group.user_id == user.id)
+            statement = statement.where(user_group.group_id == instance.owner_group_id)
+            statement = statement.order_by(user.user_name)
+            result = await db_session.execute(statement)
+            for group_user in result.scalars():
+                users_perms.append(
+                    PermissionTuple(
+                        group_user,
+                        ALL_PERMISSIONS,
+                        "group",
+                        owner_group,
+                        instance,
+                        True,
+                        True,
+                    )
+                )
+
+        return users_perms
+
+    @classmethod
+    async def has_permission(cls, resource_id, user_id, perm_name, db_session=None):
+        """
+        checks if user has permission for resource - either by owning it
+            directly or via group or by having the permission set directly
+            or inherited from groups, resolved by single EXISTS query
+            without loading any objects
+
+        :param resource_id:
+        :param user_id:
+        :param perm_name: permission name or ANY_PERMISSION
+        :param db_session:
+        :return: bool
+        """
+        db_session = get_async_db_session(db_session)
+        statement, params = ResourceService._has_permission_query(
+            resource_id, user_id, perm_name
+        )
+        result = await db_session.execute(statement, params)
+        return bool(result.scalar())
+
+    @classmethod
+    async def resource_permissions_for_users(
+        cls,
+        perm_names,
+        resource_ids=None,
+        user_ids=None,
+        group_ids=None,
+        resource_types=None,
+        limit_group_permissions=False,
+        skip_user_perms=False,
+        skip_group_perms=False,
+        db_session=None,
+        ids_only=False,
+    ):
+        """
+        async version of :func:`resource_permissions_for_users` using
+            cached statements of :class:`PermissionResolver`
+
+        :param perm_names:
+        :param resource_ids:
+        :param user_ids:
+        :param group_ids:
+        :param resource_types:
+        :param limit_group_permissions:
+        :param skip_user_perms:
+        :param skip_group_perms:
+        :param db_session:
+        :param ids_only:
+        :return:
+        """
+        db_session = get_async_db_session(db_session)
+        resolver = PermissionResolver.for_models_proxy(cls.models_proxy)
+        statement, params = resolver.prepare(
+            perm_names,
+            resource_ids=resource_ids,
+            user_ids=user_ids,
+            group_ids=group_ids,
+            resource_types=resource_types,
+            limit_group_permissions=limit_group_permissions,
+            skip_user_perms=skip_user_perms,
+            skip_group_perms=skip_group_perms,
+            ids_only=ids_only,
+        )
+        result = await db_session.execute(statement, params)
+        return resolver.permission_tuples(result, ids_only=ids_only)
+
+    @classmethod
+    async def _owned_by_user_group(cls, instance, user, db_session=None):
+        if instance.owner_group_id is None:
+            return False
+        group_ids = await AsyncUserService.group_ids(user, db_session=db_session)
+        return instance.owner_group_id in group_ids
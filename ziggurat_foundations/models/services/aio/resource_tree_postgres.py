@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import sqlalchemy as sa
+
+from ziggurat_foundations.exc import (
+    ZigguratResourceOutOfBoundaryException,
+    ZigguratResourceTreeMissingException,
+    ZigguratResourceTreePathException,
+)
+from ziggurat_foundations.models.services.aio import get_async_db_session
+from ziggurat_foundations.models.services.aio.resource import AsyncResourceService
+from ziggurat_foundations.models.services.resource_tree_postgres import (
+    ResourceTreeServicePostgreSQL,
+)
+from ziggurat_foundations.utils import noop
+
+__all__ = ["AsyncResourceTreeServicePostgreSQL"]
+
+
+class AsyncResourceTreeServicePostgreSQL(ResourceTreeServicePostgreSQL):
+    """
+    Asyncio counterpart of :class:`ResourceTreeServicePostgreSQL`, all
+    methods except :meth:`build_subtree_strut` are coroutines and return
+    lists instead of queries
+    """
+
+    models_proxy = None
+
+    @classmethod
+    async def from_resource_deeper(
+        cls, resource_id=None, limit_depth=1000000, db_session=None, *args, **kwargs
+    ):
+        """
+        This returns you subtree of ordered objects relative
+        to the start resource_id (currently only implemented in postgresql)
+
+        :param resource_id:
+        :param limit_depth:
+        :param db_session:
+        :return: list of rows
+        """
+        db_session = get_async_db_session(db_session)
+        text_obj = sa.text(cls._subtree_sql("res.resource_id = :resource_id"))
+        statement = sa.select(
+            cls.model, sa.column("depth"), sa.column("sorting"), sa.column("path")
+        ).from_statement(text_obj)
+        result = await db_session.execute(
+            statement, {"resource_id": resource_id, "depth": limit_depth}
+        )
+        return result.all()
+
+    @classmethod
+    async def delete_branch(cls, resource_id=None, db_session=None, *args, **kwargs):
+        """
+        This deletes whole branch with children starting from resource_id
+
+        :param resource_id:
+        :param db_session:
+        :return:
+        """
+        db_session = get_async_db_session(db_session)
+        # lets lock rows to prevent bad tree states
+        resource = await AsyncResourceService.lock_resource_for_update(
+            resource_id=resource_id, db_session=db_session
+        )
+        parent_id = resource.parent_id
+        ordering = resource.ordering
+        text_obj = sa.text(cls._delete_branch_sql())
+        await db_session.execute(text_obj, {"resource_id": resource_id})
+        await cls.shift_ordering_down(parent_id, ordering, db_session=db_session)
+        return True
+
+    @classmethod
+    async def from_parent_deeper(
+        cls, parent_id=None, limit_depth=1000000, db_session=None, *args, **kwargs
+    ):
+        """
+        This returns you subtree of ordered objects relative
+        to the start parent_id (currently only implemented in postgresql)
+
+        :param resource_id:
+        :param limit_depth:
+        :param db_session:
+        :return: list of rows
+        """
+        if parent_id:
+            limiting_clause = "res.parent_id = :parent_id"
+        else:
+            limiting_clause = "res.parent_id is null"
+        db_session = get_async_db_session(db_session)
+        text_obj = sa.text(cls._subtree_sql(limiting_clause))
+        statement = sa.select(
+            cls.model, sa.column("depth"), sa.column("sorting"), sa.column("path")
+        ).from_statement(text_obj)
+        result = await db_session.execute(
+            statement, {"parent_id": parent_id, "depth": limit_depth}
+        )
+        return result.all()
+
+    @classmethod
+    async def path_upper(
+        cls, object_id, limit_depth=1000000, db_session=None, *args, **kwargs
+    ):
+        """
+        This returns you path to root node starting from object_id
+            currently only for postgresql
+
+        :param object_id:
+        :param limit_depth:
+        :param db_session:
+        :return: list of resources
+        """
+        db_session = get_async_db_session(db_session)
+        statement = sa.select(cls.model).from_statement(sa.text(cls._path_upper_sql()))
+        result = await db_session.execute(
+            statement, {"resource_id": object_id, "depth": limit_depth}
+        )
+        return result.scalars().all()
+
+    @classmethod
+    async def move_to_position(
+        cls,
+        resource_id,
+        to_position,
+        new_parent_id=noop,
+        db_session=None,
+        *args,
+        **kwargs
+    ):
+        """
+        Moves node to new location in the tree
+
+        :param resource_id: resource to move
+        :param to_position: new position
+        :param new_parent_id: new parent id
+        :param db_session:
+        :return:
+        """
+        db_session = get_async_db_session(db_session)
+        # lets lock rows to prevent bad tree states
+        resource = await AsyncResourceService.lock_resource_for_update(
+            resource_id=resource_id, db_session=db_session
+        )
+        await AsyncResourceService.lock_resource_for_update(
+            resource_id=resource.parent_id, db_session=db_session
+        )
+        same_branch = False
+
+        # reset if parent is same as old
+        if new_parent_id == resource.parent_id:
+            new_parent_id = noop
+
+        if new_parent_id is not noop:
+            await cls.check_node_parent(
+                resource_id, new_parent_id, db_session=db_session
+            )
+        else:
+            same_branch = True
+
+        if new_parent_id is noop:
+            # it is not guaranteed that parent exists
+            parent_id = resource.parent_id if resource else None
+        else:
+            parent_id = new_parent_id
+
+        await cls.check_node_position(
+            parent_id, to_position, on_same_branch=same_branch, db_session=db_session
+        )
+        # move on same branch
+        if new_parent_id is noop:
+            order_range = list(sorted((resource.ordering, to_position)))
+            move_down = resource.ordering > to_position
+            statement = sa.update(cls.model)
+            statement = statement.where(cls.model.parent_id == parent_id)
+            statement = statement.where(cls.model.ordering.between(*order_range))
+            if move_down:
+                statement = statement.values(ordering=cls.model.ordering + 1)
+            else:
+                statement = statement.values(ordering=cls.model.ordering - 1)
+            await db_session.execute(
+                statement.execution_options(synchronize_session=False)
+            )
+            await db_session.flush()
+            db_session.expire(resource)
+            resource.ordering = to_position
+        # move between branches
+        else:
+            await cls.shift_ordering_down(
+                resource.parent_id, resource.ordering, db_session=db_session
+            )
+            await cls.shift_ordering_up(
+                new_parent_id, to_position, db_session=db_session
+            )
+            db_session.expire(resource)
+            resource.parent_id = new_parent_id
+            resource.ordering = to_position
+            await db_session.flush()
+        return True
+
+    @classmethod
+    async def shift_ordering_down(
+        cls, parent_id, position, db_session=None, *args, **kwargs
+    ):
+        """
+        Shifts ordering to "close gaps" after node deletion or being moved
+        to another branch, begins the shift from given position
+
+        :param parent_id:
+        :param position:
+        :param db_session:
+        :return:
+        """
+        await cls._shift_ordering(parent_id, position, -1, db_session)
+
+    @classmethod
+    async def shift_ordering_up(
+        cls, parent_id, position, db_session=None, *args, **kwargs
+    ):
+        """
+        Shifts ordering to "open a gap" for node insertion,
+        begins the shift from given position
+
+        :param parent_id:
+        :param position:
+        :param db_session:
+        :return:
+        """
+        await cls._shift_ordering(parent_id, position, 1, db_session)
+
+    @classmethod
+    async def _shift_ordering(cls, parent_id, position, delta, db_session):
+        db_session = get_async_db_session(db_session)
+        statement = sa.update(cls.model)
+        statement = statement.where(cls.model.parent_id == parent_id)
+        statement = statement.where(cls.model.ordering >= position)
+        statement = statement.values(ordering=cls.model.ordering + delta)
+        await db_session.execute(statement.execution_options(synchronize_session=False))
+        await db_session.flush()
+
+    @classmethod
+    async def set_position(
+        cls, resource_id, to_position, db_session=None, *args, **kwargs
+    ):
+        """
+        Sets node position for new node in the tree
+
+        :param resource_id: resource to move
+        :param to_position: new position
+        :param db_session:
+        :return:
+        """
+        db_session = get_async_db_session(db_session)
+        # lets lock rows to prevent bad tree states
+        resource = await AsyncResourceService.lock_resource_for_update(
+            resource_id=resource_id, db_session=db_session
+        )
+        await cls.check_node_position(
+            resource.parent_id, to_position, on_same_branch=True, db_session=db_session
+        )
+        await cls.shift_ordering_up(
+            resource.parent_id, to_position, db_session=db_session
+        )
+        await db_session.flush()
+        db_session.expire(resource)
+        resource.ordering = to_position
+        return True
+
+    @classmethod
+    async def check_node_parent(
+        cls, resource_id, new_parent_id, db_session=None, *args, **kwargs
+    ):
+        """
+        Checks if parent destination is valid for node
+
+        :param resource_id:
+        :param new_parent_id:
+        :param db_session:
+        :return:
+        """
+        db_session = get_async_db_session(db_session)
+        new_parent = await AsyncResourceService.lock_resource_for_update(
+            resource_id=new_parent_id, db_session=db_session
+        )
+        # we are not moving to "root" so parent should be found
+        if not new_parent and new_parent_id is not None:
+            raise ZigguratResourceTreeMissingException("New parent node not found")
+        else:
+            result = await cls.path_upper(new_parent_id, db_session=db_session)
+            path_ids = [r.resource_id for r in result]
+            if resource_id in path_ids:
+                raise ZigguratResourceTreePathException(
+                    "Trying to insert node into itself"
+                )
+
+    @classmethod
+    async def count_children(cls, resource_id, db_session=None, *args, **kwargs):
+        """
+        Counts children of resource node
+
+        :param resource_id:
+        :param db_session:
+        :return:
+        """
+        db_session = get_async_db_session(db_session)
+        statement = sa.select(sa.func.count(cls.model.resource_id)).where(
+            cls.model.parent_id == resource_id
+        )
+        result = await db_session.execute(statement)
+        return result.scalar()
+
+    @classmethod
+    async def check_node_position(
+        cls, parent_id, position, on_same_branch, db_session=None, *args, **kwargs
+    ):
+        """
+        Checks if node position for given parent is valid, raises exception if
+        this is not the case
+
+        :param parent_id:
+        :param position:
+        :param on_same_branch: indicates that we are checking same branch
+        :param db_session:
+        :return:
+        """
+        db_session = get_async_db_session(db_session)
+        if not position or position < 1:
+            raise ZigguratResourceOutOfBoundaryException(
+                "Position is lower than {}", value=1
+            )
+        item_count = await cls.count_children(parent_id, db_session=db_session)
+        max_value = item_count if on_same_branch else item_count + 1
+        if position > max_value:
+            raise ZigguratResourceOutOfBoundaryException(
+                "Maximum resource ordering is {}", value=max_value
+            )
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import sqlalchemy as sa
+
+from ziggurat_foundations.models.services.aio import (
+    AsyncBaseService,
+    get_async_db_session,
+)
+from ziggurat_foundations.models.services.user import UserService
+
+__all__ = ["AsyncUserService"]
+
+
+class AsyncUserService(AsyncBaseService):
+    """
+    Asyncio counterpart of :class:`UserService`
+    """
+
+    @classmethod
+    async def get(cls, user_id, db_session=None):
+        """
+        Fetch row using primary key -
+        will use existing object in session if already present
+
+        :param user_id:
+        :param db_session:
+        :return:
+        """
+        db_session = get_async_db_session(db_session)
+        return await db_session.get(cls.model, user_id)
+
+    @classmethod
+    async def by_id(cls, user_id, db_session=None):
+        """
+        fetch user by user id
+
+        :param user_id:
+        :param db_session:
+        :return:
+        """
+        db_session = get_async_db_session(db_session)
+        statement = sa.select(cls.model).where(cls.model.id == user_id)
+        result = await db_session.execute(statement)
+        return result.scalars().first()
+
+    @classmethod
+    async def by_user_name(cls, user_name, db_session=None):
+        """
+        fetch user by user name
+
+        :param user_name:
+        :param db_session:
+        :return:
+        """
+        db_session = get_async_db_session(db_session)
+        statement = sa.select(cls.model).where(
+            sa.func.lower(cls.model.user_name) == (user_name or "").lower()
+        )
+        result = await db_session.execute(statement)
+        return result.scalars().first()
+
+    @classmethod
+    async def by_user_names(cls, user_names, db_session=None):
+        """
+        fetch user objects by user names
+
+        :param user_names:
+        :param db_session:
+        :return: list
+        """
+        user_names = [(name or "").lower() for name in user_names]
+        db_session = get_async_db_session(db_session)
+        statement = sa.select(cls.model).where(
+            sa.func.lower(cls.model.user_name).in_(user_names)
+        )
+        result = await db_session.execute(statement)
+        return result.scalars().all()
+
+    @classmethod
+    async def by_email(cls, email, db_session=None):
+        """
+        fetch user object by email
+
+        :param email:
+        :param db_session:
+        :return:
+        """
+        db_session = get_async_db_session(db_session)
+        statement = sa.select(cls.model).where(
+            sa.func.lower(cls.model.email) == (email or "").lower()
+        )
+        result = await db_session.execute(statement)
+        return result.scalars().first()
+
+    @classmethod
+    async def by_user_name_or_email(cls, login, db_session=None):
+        """
+        fetch user whose user name or email matches login in single query
+
+        :param login: user name or email
+        :param db_session:
+        :return:
+        """
+        db_session = get_async_db_session(db_session)
+        statement = UserService._cached_statement(
+            "by_user_name_or_email", UserService._by_user_name_or_email_statement
+        )
+        result = await db_session.execute(statement, {"login": (login or "").lower()})
+        return result.scalars().first()
+
+    @classmethod
+    async def group_ids(cls, instance, db_session=None):
+        """
+        async version of :meth:`UserService.group_ids`, shares the same
+            cache stored on instance state
+
+        :param instance:
+        :param db_session:
+        :return: frozenset
+        """
+        state = sa.inspect(instance)
+        if "groups" in state.dict:
+            return frozenset([g.id for g in instance.groups])
+        group_ids = state.info.get(UserService._group_ids_key)
+        if group_ids is None:
+            if instance.id is None:
+                return frozenset()
+            db_session = get_async_db_session(db_session, instance)
+            result = await db_session.execute(
+                UserService._group_ids_select(instance.id)
+            )
+            group_ids = frozenset([row.group_id for row in result])
+            state.info[UserService._group_ids_key] = group_ids
+        return group_ids
+
+    @classmethod
+    async def groups_dict(cls, instance, group_ids, db_session=None):
+        """
+        async version of :meth:`UserService.groups_dict`
+
+        :param instance:
+        :param group_ids:
+        :param db_session:
+        :return: dict
+        """
+        if "groups" in sa.inspect(instance).dict:
+            return dict([(g.id, g) for g in instance.groups])
+        group_ids = set(group_ids)
+        group_ids.discard(None)
+        if not group_ids:
+            return {}
+        db_session = get_async_db_session(db_session, instance)
+        statement = sa.select(cls.models_proxy.Group).where(
+            cls.models_proxy.Group.id.in_(list(group_ids))
+        )
+        result = await db_session.execute(statement)
+        return dict([(g.id, g) for g in result.scalars()])
+
+    @classmethod
+    async def permissions(cls, instance, db_session=None, ids_only=False):
+        """
+        returns all non-resource permissions based on what groups user
+            belongs and directly set ones for this user
+
+        :param instance:
+        :param db_session:
+        :param ids_only: return PermissionIdTuple objects instead of
+            PermissionTuple objects referencing ORM instances
+        :return:
+        """
+        db_session = get_async_db_session(db_session, instance)
+        result = await db_session.execute(
+            UserService._permissions_statement(instance.id)
+        )
+        rows = result.all()
+        if ids_only:
+            return UserService._permissions_from_rows(instance, rows, ids_only=True)
+        groups_dict = await cls.groups_dict(
+            instance,
+            [row.owner_id for row in rows if row.type == "group"],
+            db_session=db_session,
+        )
+        return UserService._permissions_from_rows(
+            instance, rows, groups_dict=groups_dict
+        )
+
+    @classmethod
+    async def resources_with_perms(
+        cls, instance, perms, resource_ids=None, resource_types=None, db_session=None
+    ):
+        """
+        returns all resources that user has perms for
+            (note that at least one perm needs to be met)
+
+        :param instance:
+        :param perms:
+        :param resource_ids: restricts the search to specific resources
+        :param resource_types:
+        :param db_session:
+        :return: list of resources ordered by resource_name
+        """
+        db_session = get_async_db_session(db_session, instance)
+        resource = cls.models_proxy.Resource
+        grp = cls.models_proxy.GroupResourcePermission
+        urp = cls.models_proxy.UserResourcePermission
+        group_ids = UserService._group_ids_select(instance.id)
+
+        # owned resources and ones with matching group permissions
+        statement = sa.select(resource.resource_id).where(
+            sa.or_(
+                resource.owner_user_id == instance.id,
+                resource.owner_group_id.in_(group_ids),
+                resource.resource_id.in_(
+                    sa.select(grp.resource_id).where(
+                        grp.group_id.in_(group_ids), grp.perm_name.in_(perms)
+                    )
+                ),
+            )
+        )
+        statement2 = sa.select(urp.resource_id).where(
+            urp.user_id == instance.id, urp.perm_name.in_(perms)
+        )
+        statement = sa.select(resource).where(
+            resource.resource_id.in_(sa.union(statement, statement2))
+        )
+        if resource_ids:
+            statement = statement.where(resource.resource_id.in_(resource_ids))
+        if resource_types:
+            statement = statement.where(resource.resource_type.in_(resource_types))
+        statement = statement.order_by(resource.resource_name)
+        result = await db_session.execute(statement)
+        return result.scalars().all()
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import itertools
+
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from ziggurat_foundations.models.base import get_db_session
+from ziggurat_foundations.models.services import BaseService
+from ziggurat_foundations.models.services.resource import ResourceService
+
+__all__ = ["EffectivePermissionService"]
+
+
+class EffectivePermissionService(BaseService):
+    """
+    Maintains optional materialized table of effective permissions, rows
+    are computed from user/group resource permissions, group memberships and
+    resource ownership. Ownership is stored with perm_name set to
+    ``ALL_PERMISSIONS_NAME``
+    """
+
+    ALL_PERMISSIONS_NAME = "__all_permissions__"
+    _members_key = "effective_permissions_members"
+
+    @classmethod
+    def source_query(cls, user_ids=None, resource_ids=None):
+        """
+        returns select statement computing effective permission rows,
+            optionally restricted to specific users or resources
+
+        :param user_ids:
+        :param resource_ids:
+        :return: select
+        """
+        urp = cls.models_proxy.UserResourcePermission
+        grp = cls.models_proxy.GroupResourcePermission
+        user_group = cls.models_proxy.UserGroup
+        resource = cls.models_proxy.Resource
+
+        query = sa.select(
+            urp.user_id, urp.resource_id, urp.perm_name, sa.literal("user")
+        )
+        query2 = sa.select(
+            user_group.user_id, grp.resource_id, grp.perm_name, sa.literal("group")
+        ).where(user_group.group_id == grp.group_id)
+        query3 = sa.select(
+            resource.owner_user_id,
+            resource.resource_id,
+            sa.literal(cls.ALL_PERMISSIONS_NAME),
+            sa.literal("owner_user"),
+        ).where(resource.owner_user_id.isnot(None))
+        query4 = sa.select(
+            user_group.user_id,
+            resource.resource_id,
+            sa.literal(cls.ALL_PERMISSIONS_NAME),
+            sa.literal("owner_group"),
+        ).where(user_group.group_id == resource.owner_group_id)
+
+        if user_ids is not None:
+            query = query.where(urp.user_id.in_(user_ids))
+            query2 = query2.where(user_group.user_id.in_(user_ids))
+            query3 = query3.where(resource.owner_user_id.in_(user_ids))
+            query4 = query4.where(user_group.user_id.in_(user_ids))
+        if resource_ids is not None:
+            query = query.where(urp.resource_id.in_(resource_ids))
+            query2 = query2.where(grp.resource_id.in_(resource_ids))
+            query3 = query3.where(resource.resource_id.in_(resource_ids))
+            query4 = query4.where(resource.resource_id.in_(resource_ids))
+        return sa.union(query, query2, query3, query4)
+
+    @classmethod
+    def rebuild(cls, db_session=None):
+        """
+        recomputes whole effective permission table
+
+        :param db_session:
+        :return:
+        """
+        cls._refresh(db_session=db_session)
+
+    @classmethod
+    def refresh_for_users(cls, user_ids, db_session=None):
+        """
+        recomputes effective permission rows of specific users
+
+        :param user_ids:
+        :param db_session:
+        :return:
+        """
+        user_ids = list(user_ids)
+        if user_ids:
+            cls._refresh(user_ids=user_ids, db_session=db_session)
+
+    @classmethod
+    def refresh_for_resources(cls, resource_ids, db_session=None):
+        """
+        recomputes effective permission rows of specific resources
+
+        :param resource_ids:
+        :param db_session:
+        :return:
+        """
+        resource_ids = list(resource_ids)
+        if resource_ids:
+            cls._refresh(resource_ids=resource_ids, db_session=db_session)
+
+    @classmethod
+    def _refresh(cls, user_ids=None, resource_ids=None, db_session=None):
+        db_session = get_db_session(db_session)
+        table = cls.model.__table__
+        delete = table.delete()
+        if user_ids is not None:
+            delete = delete.where(table.c.user_id.in_(user_ids))
+        if resource_ids is not None:
+            delete = delete.where(table.c.resource_id.in_(resource_ids))
+        db_session.execute(delete)
+        columns = ["user_id", "resource_id", "perm_name", "source"]
+        source = cls.source_query(user_ids=user_ids, resource_ids=resource_ids)
+        # concurrent refresh of overlapping rows may insert them after our
+        # delete, existing rows are skipped instead of failing on primary key
+        dialect = db_session.get_bind(cls.model).dialect.name
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+
+            statement = insert(table).from_select(columns, source)
+            statement = statement.on_conflict_do_nothing()
+        elif dialect == "mysql":
+            statement = table.insert().prefix_with("IGNORE")
+            statement = statement.from_select(columns, source)
+        elif dialect == "sqlite":
+            statement = table.insert().prefix_with("OR IGNORE")
+            statement = statement.from_select(columns, source)
+        else:
+            statement = table.insert().from_select(columns, source)
+        db_session.execute(statement)
+
+    @classmethod
+    def register(cls, target=Session):
+        """
+        attaches ``after_flush`` listener to session, sessionmaker or session
+        class that incrementally refreshes effective permissions when
+        permission rows, memberships or resource ownership change, bulk
+        ``grant``/``revoke`` are picked up through
+        :meth:`ResourceService.register_permission_write_listener`
+
+        :param target:
+        """
+        sa.event.listen(target, "before_flush", cls._before_flush)
+        sa.event.listen(target, "after_flush", cls._after_flush)
+        ResourceService.register_permission_write_listener(
+            target, cls._after_permission_write
+        )
+
+    @classmethod
+    def unregister(cls, target=Session):
+        """
+        detaches listener attached by :meth:`register`
+
+        :param target:
+        """
+        sa.event.remove(target, "before_flush", cls._before_flush)
+        sa.event.remove(target, "after_flush", cls._after_flush)
+        ResourceService.remove_permission_write_listener(
+            target, cls._after_permission_write
+        )
+
+    @classmethod
+    def _before_flush(cls, db_session, flush_context, instances):
+        # memberships of deleted groups are removed by database cascades,
+        # so members have to be read before the flush
+        group_ids = [
+            instance.id
+            for instance in db_session.deleted
+            if isinstance(instance, cls.models_proxy.Group)
+        ]
+        if group_ids:
+            user_ids = cls.member_ids(group_ids, db_session=db_session)
+            db_session.info.setdefault(cls._members_key, set()).update(user_ids)
+
+    @classmethod
+    def _after_flush(cls, db_session, flush_context):
+        user_ids, resource_ids = cls.affected_ids(
+            itertools.chain(db_session.new, db_session.dirty, db_session.deleted)
+        )
+        user_ids.update(db_session.info.pop(cls._members_key, ()))
+        # rows of deleted users are left behind without database cascades
+        user_ids.update(
+            instance.id
+            for instance in db_session.deleted
+            if isinstance(instance, cls.models_proxy.User)
+        )
+        cls.refresh_for_users(user_ids, db_session=db_session)
+        cls.refresh_for_resources(resource_ids, db_session=db_session)
+
+    @classmethod
+    def _after_permission_write(cls, db_session, user_ids, group_ids):
+        user_ids = set(user_ids)
+        if group_ids:
+            user_ids.update(cls.member_ids(group_ids, db_session=db_session))
+        cls.refresh_for_users(user_ids, db_session=db_session)
+
+    @classmethod
+    def member_ids(cls, group_ids, db_session=None):
+        """
+        returns ids of users belonging to any of the groups
+
+        :param group_ids:
+        :param db_session:
+        :return: set
+        """
+        db_session = get_db_session(db_session)
+        user_group = cls.models_proxy.UserGroup
+        statement = sa.select(user_group.user_id).where(
+            user_group.group_id.in_(group_ids)
+        )
+        return set(db_session.execute(statement).scalars())
+
+    @classmethod
+    def affected_ids(cls, instances):
+        """
+        returns sets of user ids and resource ids whose effective
+        permissions could change because of passed changed instances,
+        members of deleted groups and deleted users are not included
+
+        :param instances:
+        :return: (user_ids, resource_ids)
+        """
+        models_proxy = cls.models_proxy
+        user_ids = set()
+        resource_ids = set()
+        for instance in instances:
+            if isinstance(
+                instance,
+                (
+                    models_proxy.UserResourcePermission,
+                    models_proxy.GroupResourcePermission,
+                ),
+            ):
+                resource_ids.add(instance.resource_id)
+            elif isinstance(instance, models_proxy.UserGroup):
+                user_ids.add(instance.user_id)
+            elif isinstance(instance, models_proxy.Resource):
+                resource_ids.add(instance.resource_id)
+            elif isinstance(instance, models_proxy.User):
+                history = sa.inspect(instance).attrs.groups.history
+                if history.added or history.deleted:
+                    user_ids.add(instance.id)
+            elif isinstance(instance, models_proxy.Group):
+                history = sa.inspect(instance).attrs.users.history
+                changed = itertools.chain(history.added or (), history.deleted or ())
+                for user in changed:
+                    user_ids.add(user.id)
+        user_ids.discard(None)
+        resource_ids.discard(None)
+        return user_ids, resource_ids
+
+    @classmethod
+    def resource_ids_for_user(cls, user_id, perm_names):
+        """
+        returns select of resource ids user has one of permissions for,
+            owned resources are always included
+
+        :param user_id:
+        :param perm_names:
+        :return: select
+        """
+        perm_names = list(perm_names) + [cls.ALL_PERMISSIONS_NAME]
+        return sa.select(cls.model.resource_id).where(
+            cls.model.user_id == user_id, cls.model.perm_name.in_(perm_names)
+        )
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import sqlalchemy as sa
+
 from ziggurat_foundations.models.base import get_db_session
 from ziggurat_foundations.models.services import BaseService
 
@@ -21,9 +23,7 @@ class ExternalIdentityService(BaseService):
         :return:
         """
         db_session = get_db_session(db_session)
-        return db_session.query(cls.model).get(
-            [external_id, local_user_id, provider_name]
-        )
+        return db_session.get(cls.model, [external_id, local_user_id, provider_name])
 
     @classmethod
     def by_external_id_and_provider(cls, external_id, provider_name, db_session=None):
@@ -36,10 +36,10 @@ class ExternalIdentityService(BaseService):
         :return: ExternalIdentity
         """
         db_session = get_db_session(db_session)
-        query = db_session.query(cls.model)
-        query = query.filter(cls.model.external_id == external_id)
-        query = query.filter(cls.model.provider_name == provider_name)
-        return query.first()
+        statement = sa.select(cls.model)
+        statement = statement.where(cls.model.external_id == external_id)
+        statement = statement.where(cls.model.provider_name == provider_name)
+        return db_session.execute(statement).scalars().first()
 
     @classmethod
     def user_by_external_id_and_provider(
@@ -54,8 +54,8 @@ class ExternalIdentityService(BaseService):
         :return: User
         """
         db_session = get_db_session(db_session)
-        query = db_session.query(cls.models_proxy.User)
-        query = query.filter(cls.model.external_id == external_id)
-        query = query.filter(cls.model.provider_name == provider_name)
-        query = query.filter(cls.models_proxy.User.id == cls.model.local_user_id)
-        return query.first()
+        statement = sa.select(cls.models_proxy.User)
+        statement = statement.where(cls.model.external_id == external_id)
+        statement = statement.where(cls.model.provider_name == provider_name)
+        statement = statement.where(cls.models_proxy.User.id == cls.model.local_user_id)
+        return db_session.execute(statement).scalars().first()
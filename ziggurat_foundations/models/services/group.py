@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import sqlalchemy as sa
 from paginate_sqlalchemy import SqlalchemyOrmPage
 
 from ziggurat_foundations.models.base import get_db_session
@@ -26,7 +27,7 @@ class GroupService(BaseService):
         :return:
         """
         db_session = get_db_session(db_session)
-        return db_session.query(cls.model).get(group_id)
+        return db_session.get(cls.model, group_id)
 
     @classmethod
     def by_group_name(cls, group_name, db_session=None):
@@ -38,8 +39,8 @@ class GroupService(BaseService):
         :return:
         """
         db_session = get_db_session(db_session)
-        query = db_session.query(cls.model).filter(cls.model.group_name == group_name)
-        return query.first()
+        statement = sa.select(cls.model).where(cls.model.group_name == group_name)
+        return db_session.execute(statement).scalars().first()
 
     @classmethod
     def get_user_paginator(
@@ -98,34 +99,34 @@ class GroupService(BaseService):
         """
         db_session = get_db_session(db_session, instance)
 
-        query = db_session.query(
+        statement = sa.select(
             cls.models_proxy.GroupResourcePermission.perm_name,
             cls.models_proxy.Group,
             cls.models_proxy.Resource,
         )
-        query = query.filter(
+        statement = statement.where(
             cls.models_proxy.Resource.resource_id
             == cls.models_proxy.GroupResourcePermission.resource_id
         )
-        query = query.filter(
+        statement = statement.where(
             cls.models_proxy.Group.id
             == cls.models_proxy.GroupResourcePermission.group_id
         )
         if resource_ids:
-            query = query.filter(
+            statement = statement.where(
                 cls.models_proxy.GroupResourcePermission.resource_id.in_(resource_ids)
             )
 
         if resource_types:
-            query = query.filter(
+            statement = statement.where(
                 cls.models_proxy.Resource.resource_type.in_(resource_types)
             )
 
         if perm_names not in ([ANY_PERMISSION], ANY_PERMISSION) and perm_names:
-            query = query.filter(
+            statement = statement.where(
                 cls.models_proxy.GroupResourcePermission.perm_name.in_(perm_names)
             )
-        query = query.filter(
+        statement = statement.where(
             cls.models_proxy.GroupResourcePermission.group_id == instance.id
         )
 
@@ -133,7 +134,7 @@ class GroupService(BaseService):
             PermissionTuple(
                 None, row.perm_name, "group", instance, row.Resource, False, True
             )
-            for row in query
+            for row in db_session.execute(statement)
         ]
         for resource in instance.resources:
             perms.append(
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import sqlalchemy as sa
+
 from ziggurat_foundations.models.base import get_db_session
 from ziggurat_foundations.models.services import BaseService
 
@@ -20,7 +22,7 @@ class GroupPermissionService(BaseService):
         :return:
         """
         db_session = get_db_session(db_session)
-        return db_session.query(cls.model).get([group_id, perm_name])
+        return db_session.get(cls.model, [group_id, perm_name])
 
     @classmethod
     def by_group_and_perm(cls, group_id, perm_name, db_session=None):
@@ -33,6 +35,6 @@ class GroupPermissionService(BaseService):
         :return:
         """
         db_session = get_db_session(db_session)
-        query = db_session.query(cls.model).filter(cls.model.group_id == group_id)
-        query = query.filter(cls.model.perm_name == perm_name)
-        return query.first()
+        statement = sa.select(cls.model).where(cls.model.group_id == group_id)
+        statement = statement.where(cls.model.perm_name == perm_name)
+        return db_session.execute(statement).scalars().first()
@@ -3,6 +3,7 @@ from __future__ import unicode_literals
 
 from ziggurat_foundations.models.base import get_db_session
 from ziggurat_foundations.models.services import BaseService
+from ziggurat_foundations.models.services.resource import ResourceService
 
 __all__ = ["GroupResourcePermissionService"]
 
@@ -21,4 +22,70 @@ class GroupResourcePermissionService(BaseService):
         :return:
         """
         db_session = get_db_session(db_session)
-        return db_session.query(cls.model).get([group_id, resource_id, perm_name])
+        return db_session.get(cls.model, [group_id, resource_id, perm_name])
+
+    @classmethod
+    def grant(
+        cls,
+        group_id,
+        perm_name,
+        resource_ids=None,
+        resource_types=None,
+        db_session=None,
+    ):
+        """
+        grants permission to group on many resources with single
+        INSERT ... SELECT statement skipping already existing rows,
+        permission name is validated once per resource type
+
+        rows are written without ORM flush - session listeners are not
+        triggered, functions attached with
+        :meth:`ResourceService.register_permission_write_listener` are called
+        instead, already loaded permission collections are not refreshed
+
+        :param group_id:
+        :param perm_name:
+        :param resource_ids: list of resource ids, all resources if None
+        :param resource_types: limits grant to resources of these types
+        :param db_session:
+        :return: number of created permission rows
+        """
+        return ResourceService._grant(
+            cls.model,
+            "group_id",
+            group_id,
+            perm_name,
+            resource_ids=resource_ids,
+            resource_types=resource_types,
+            db_session=db_session,
+        )
+
+    @classmethod
+    def revoke(
+        cls,
+        group_id,
+        perm_name,
+        resource_ids=None,
+        resource_types=None,
+        db_session=None,
+    ):
+        """
+        revokes permission of group from many resources with single
+        DELETE statement, see :meth:`grant` for caveats
+
+        :param group_id:
+        :param perm_name:
+        :param resource_ids: list of resource ids, all resources if None
+        :param resource_types: limits revoke to resources of these types
+        :param db_session:
+        :return: number of deleted permission rows
+        """
+        return ResourceService._revoke(
+            cls.model,
+            "group_id",
+            group_id,
+            perm_name,
+            resource_ids=resource_ids,
+            resource_types=resource_types,
+            db_session=db_session,
+        )
@@ -5,10 +5,13 @@ import sqlalchemy as sa
 
 from ziggurat_foundations.models.base import get_db_session
 from ziggurat_foundations.models.services import BaseService
+from ziggurat_foundations.models.services.user import UserService
 from ziggurat_foundations.permissions import (
     ANY_PERMISSION,
     ALL_PERMISSIONS,
+    InheritedPermissionTuple,
     PermissionTuple,
+    PermissionIdTuple,
     resource_permissions_for_users,
 )
 
@@ -16,6 +19,10 @@ __all__ = ["ResourceService"]
 
 
 class ResourceService(BaseService):
+    # (target, function) pairs notified about permission rows written
+    # without ORM flush
+    _permission_write_listeners = []
+
     @classmethod
     def get(cls, resource_id, db_session=None):
         """
@@ -27,10 +34,10 @@ class ResourceService(BaseService):
         :return:
         """
         db_session = get_db_session(db_session)
-        return db_session.query(cls.model).get(resource_id)
+        return db_session.get(cls.model, resource_id)
 
     @classmethod
-    def perms_for_user(cls, instance, user, db_session=None):
+    def perms_for_user(cls, instance, user, db_session=None, ids_only=False):
         """
         returns all permissions that given user has for this resource
             from groups and directly set ones too
@@ -38,37 +45,61 @@ class ResourceService(BaseService):
         :param instance:
         :param user:
         :param db_session:
+        :param ids_only: return PermissionIdTuple objects instead of
+            PermissionTuple objects referencing ORM instances
         :return:
         """
         db_session = get_db_session(db_session, instance)
-        query = db_session.query(
+        statement = cls._cached_statement(
+            "perms_for_user", cls._perms_for_user_statement
+        )
+        params = {"resource_id": instance.resource_id, "user_id": user.id}
+        rows = db_session.execute(statement, params).all()
+        owner_group = cls._owned_by_user_group(instance, user, db_session)
+        if ids_only:
+            return cls._perm_ids_for_user(instance, user, rows, owner_group)
+
+        group_ids = set([row.owner_id for row in rows if row.type == "group"])
+        if owner_group:
+            group_ids.add(instance.owner_group_id)
+        groups_dict = UserService.groups_dict(user, group_ids, db_session=db_session)
+        return cls._perms_for_user_from_rows(
+            instance, user, rows, groups_dict, owner_group
+        )
+
+    @classmethod
+    def _perms_for_user_statement(cls):
+        resource_id = sa.bindparam("resource_id")
+        user_id = sa.bindparam("user_id")
+        statement = sa.select(
             cls.models_proxy.GroupResourcePermission.group_id.label("owner_id"),
             cls.models_proxy.GroupResourcePermission.perm_name,
             sa.literal("group").label("type"),
         )
-        query = query.filter(
+        statement = statement.where(
             cls.models_proxy.GroupResourcePermission.group_id.in_(
-                [gr.id for gr in user.groups]
+                cls._user_group_ids_select(user_id)
             )
         )
-        query = query.filter(
-            cls.models_proxy.GroupResourcePermission.resource_id == instance.resource_id
+        statement = statement.where(
+            cls.models_proxy.GroupResourcePermission.resource_id == resource_id
         )
 
-        query2 = db_session.query(
+        statement2 = sa.select(
             cls.models_proxy.UserResourcePermission.user_id.label("owner_id"),
             cls.models_proxy.UserResourcePermission.perm_name,
             sa.literal("user").label("type"),
         )
-        query2 = query2.filter(
-            cls.models_proxy.UserResourcePermission.user_id == user.id
+        statement2 = statement2.where(
+            cls.models_proxy.UserResourcePermission.user_id == user_id
         )
-        query2 = query2.filter(
-            cls.models_proxy.UserResourcePermission.resource_id == instance.resource_id
+        statement2 = statement2.where(
+            cls.models_proxy.UserResourcePermission.resource_id == resource_id
         )
-        query = query.union(query2)
+        return sa.union(statement, statement2)
 
-        groups_dict = dict([(g.id, g) for g in user.groups])
+    @classmethod
+    def _perms_for_user_from_rows(cls, instance, user, rows, groups_dict, owner_group):
         perms = [
             PermissionTuple(
                 user,
@@ -79,7 +110,7 @@ class ResourceService(BaseService):
                 False,
                 True,
             )
-            for row in query
+            for row in rows
         ]
 
         # include all perms if user is the owner of this resource
@@ -89,8 +120,7 @@ class ResourceService(BaseService):
                     user, ALL_PERMISSIONS, "user", None, instance, True, True
                 )
             )
-        groups_dict = dict([(g.id, g) for g in user.groups])
-        if instance.owner_group_id in groups_dict:
+        if owner_group:
             perms.append(
                 PermissionTuple(
                     user,
@@ -105,6 +135,509 @@ class ResourceService(BaseService):
 
         return perms
 
+    @classmethod
+    def inherited_perms_for_user(
+        cls, instance, user, nearest_wins=False, limit_depth=1000000, db_session=None
+    ):
+        """
+        returns all permissions that given user has for this resource and
+            all of its ancestors (including ownership), resolved with single
+            recursive CTE query, depth 1 means resource itself - on
+            databases without recursive queries (MySQL 5.7) ancestors are
+            fetched with one query per level first
+
+        :param instance:
+        :param user:
+        :param nearest_wins: if true, for every permission name only tuples
+            coming from closest level of the tree are returned, otherwise
+            permissions from all levels are returned
+        :param limit_depth: how many levels of the tree to check
+        :param db_session:
+        :return: list of InheritedPermissionTuple sorted by depth
+        """
+        db_session = get_db_session(db_session, instance)
+        grp = cls.models_proxy.GroupResourcePermission
+        urp = cls.models_proxy.UserResourcePermission
+        user_groups = cls._user_group_ids_select(user.id)
+
+        if cls._supports_recursive_cte(db_session):
+            ancestors = cls._ancestors_cte(instance.resource_id, limit_depth)
+        else:
+            ancestors = cls._ancestors_from_levels(
+                instance.resource_id, limit_depth, db_session
+            )
+            if ancestors is None:
+                return []
+
+        no_perm = sa.literal(None, sa.Unicode).label("perm_name")
+        statement = sa.union_all(
+            sa.select(
+                ancestors.c.resource_id,
+                ancestors.c.depth,
+                grp.group_id.label("owner_id"),
+                grp.perm_name.label("perm_name"),
+                sa.literal("group").label("type"),
+            )
+            .join(grp, grp.resource_id == ancestors.c.resource_id)
+            .where(grp.group_id.in_(user_groups)),
+            sa.select(
+                ancestors.c.resource_id,
+                ancestors.c.depth,
+                urp.user_id.label("owner_id"),
+                urp.perm_name.label("perm_name"),
+                sa.literal("user").label("type"),
+            )
+            .join(urp, urp.resource_id == ancestors.c.resource_id)
+            .where(urp.user_id == user.id),
+            # owned resources
+            sa.select(
+                ancestors.c.resource_id,
+                ancestors.c.depth,
+                ancestors.c.owner_user_id.label("owner_id"),
+                no_perm,
+                sa.literal("user").label("type"),
+            ).where(ancestors.c.owner_user_id == user.id),
+            sa.select(
+                ancestors.c.resource_id,
+                ancestors.c.depth,
+                ancestors.c.owner_group_id.label("owner_id"),
+                no_perm,
+                sa.literal("group").label("type"),
+            ).where(ancestors.c.owner_group_id.in_(user_groups)),
+        )
+        statement = statement.order_by(sa.literal_column("depth"))
+        rows = db_session.execute(statement).all()
+        if not rows:
+            return []
+
+        resource_ids = set([row.resource_id for row in rows])
+        statement = sa.select(cls.model).where(
+            cls.model.resource_id.in_(list(resource_ids))
+        )
+        resources_dict = dict(
+            [(r.resource_id, r) for r in db_session.execute(statement).scalars()]
+        )
+        groups_dict = UserService.groups_dict(
+            user,
+            [row.owner_id for row in rows if row.type == "group"],
+            db_session=db_session,
+        )
+
+        perms = []
+        nearest = {}
+        for row in rows:
+            owner = row.perm_name is None
+            perm_key = "__all_permissions__" if owner else row.perm_name
+            if nearest_wins and nearest.setdefault(perm_key, row.depth) < row.depth:
+                continue
+            perms.append(
+                InheritedPermissionTuple(
+                    user,
+                    ALL_PERMISSIONS if owner else row.perm_name,
+                    row.type,
+                    groups_dict.get(row.owner_id) if row.type == "group" else None,
+                    resources_dict[row.resource_id],
+                    owner,
+                    True,
+                    row.depth,
+                )
+            )
+        return perms
+
+    @classmethod
+    def _supports_recursive_cte(cls, db_session):
+        dialect = db_session.connection(
+            bind_arguments={"mapper": sa.inspect(cls.model)}
+        ).dialect
+        if dialect.name == "mysql":
+            if getattr(dialect, "is_mariadb", False):
+                return dialect.server_version_info >= (10, 2, 2)
+            return dialect.server_version_info >= (8, 0, 1)
+        elif dialect.name == "sqlite":
+            return dialect.dbapi.sqlite_version_info >= (3, 8, 3)
+        return True
+
+    @classmethod
+    def _ancestor_columns(cls, resource):
+        return (
+            resource.resource_id,
+            resource.parent_id,
+            resource.owner_user_id,
+            resource.owner_group_id,
+        )
+
+    @classmethod
+    def _ancestors_cte(cls, resource_id, limit_depth):
+        resource = cls.models_proxy.Resource
+        parent = sa.orm.aliased(resource)
+        ancestors = (
+            sa.select(*cls._ancestor_columns(resource), sa.literal(1).label("depth"))
+            .where(resource.resource_id == resource_id)
+            .cte("ancestors", recursive=True)
+        )
+        return ancestors.union_all(
+            sa.select(
+                *cls._ancestor_columns(parent), (ancestors.c.depth + 1).label("depth")
+            )
+            .where(parent.resource_id == ancestors.c.parent_id)
+            .where(ancestors.c.depth < limit_depth)
+        )
+
+    @classmethod
+    def _ancestors_from_levels(cls, resource_id, limit_depth, db_session):
+        columns = cls._ancestor_columns(cls.models_proxy.Resource)
+        statement = sa.select(*columns).where(columns[0] == sa.bindparam("resource_id"))
+        levels = []
+        while resource_id is not None and len(levels) < limit_depth:
+            row = db_session.execute(statement, {"resource_id": resource_id}).first()
+            if row is None:
+                break
+            values = [
+                sa.literal(value, column.type).label(column.key)
+                for value, column in zip(row, columns)
+            ]
+            levels.append(
+                sa.select(*values, sa.literal(len(levels) + 1).label("depth"))
+            )
+            resource_id = row.parent_id
+        if not levels:
+            return None
+        return sa.union_all(*levels).subquery("ancestors")
+
+    @classmethod
+    def perms_for_user_bulk(cls, resources_or_ids, user, db_session=None):
+        """
+        returns all permissions that given user has for multiple resources
+            from groups and directly set ones too (including ownership),
+            resolved with single permission query
+
+        :param resources_or_ids: list of resource instances or resource ids
+        :param user:
+        :param db_session:
+        :return: dictionary {resource_id: [PermissionTuple, ...]}
+        """
+        resources_or_ids = list(resources_or_ids)
+        resources = [r for r in resources_or_ids if isinstance(r, cls.model)]
+        requested_ids = [
+            r.resource_id if isinstance(r, cls.model) else int(r)
+            for r in resources_or_ids
+        ]
+        missing_ids = [int(r) for r in resources_or_ids if not isinstance(r, cls.model)]
+        if db_session is None and resources:
+            db_session = get_db_session(None, resources[0])
+        else:
+            db_session = get_db_session(db_session)
+        if missing_ids:
+            statement = sa.select(cls.model).where(
+                cls.model.resource_id.in_(missing_ids)
+            )
+            resources.extend(db_session.execute(statement).scalars())
+        resources_dict = dict([(r.resource_id, r) for r in resources])
+        perms = dict([(rid, []) for rid in requested_ids if rid in resources_dict])
+        if not perms:
+            return perms
+
+        statement = sa.select(
+            cls.models_proxy.GroupResourcePermission.resource_id,
+            cls.models_proxy.GroupResourcePermission.group_id.label("owner_id"),
+            cls.models_proxy.GroupResourcePermission.perm_name,
+            sa.literal("group").label("type"),
+        )
+        statement = statement.where(
+            cls.models_proxy.GroupResourcePermission.group_id.in_(
+                cls._user_group_ids_select(user.id)
+            )
+        )
+        statement = statement.where(
+            cls.models_proxy.GroupResourcePermission.resource_id.in_(list(perms))
+        )
+
+        statement2 = sa.select(
+            cls.models_proxy.UserResourcePermission.resource_id,
+            cls.models_proxy.UserResourcePermission.user_id.label("owner_id"),
+            cls.models_proxy.UserResourcePermission.perm_name,
+            sa.literal("user").label("type"),
+        )
+        statement2 = statement2.where(
+            cls.models_proxy.UserResourcePermission.user_id == user.id
+        )
+        statement2 = statement2.where(
+            cls.models_proxy.UserResourcePermission.resource_id.in_(list(perms))
+        )
+        rows = db_session.execute(sa.union(statement, statement2)).all()
+
+        owner_group_ids = set()
+        if any(r.owner_group_id is not None for r in resources_dict.values()):
+            owner_group_ids = UserService.group_ids(user, db_session=db_session)
+        group_ids = set([row.owner_id for row in rows if row.type == "group"])
+        group_ids.update(
+            [
+                r.owner_group_id
+                for r in resources_dict.values()
+                if r.owner_group_id in owner_group_ids
+            ]
+        )
+        groups_dict = UserService.groups_dict(user, group_ids, db_session=db_session)
+
+        for row in rows:
+            perms[row.resource_id].append(
+                PermissionTuple(
+                    user,
+                    row.perm_name,
+                    row.type,
+                    groups_dict.get(row.owner_id) if row.type == "group" else None,
+                    resources_dict[row.resource_id],
+                    False,
+                    True,
+                )
+            )
+
+        # include all perms if user is the owner of those resources
+        for resource_id, resource_perms in perms.items():
+            instance = resources_dict[resource_id]
+            if instance.owner_user_id == user.id:
+                resource_perms.append(
+                    PermissionTuple(
+                        user, ALL_PERMISSIONS, "user", None, instance, True, True
+                    )
+                )
+            if instance.owner_group_id in owner_group_ids:
+                resource_perms.append(
+                    PermissionTuple(
+                        user,
+                        ALL_PERMISSIONS,
+                        "group",
+                        groups_dict.get(instance.owner_group_id),
+                        instance,
+                        True,
+                        True,
+                    )
+                )
+        return perms
+
+    @classmethod
+    def has_permission(cls, resource_id, user_id, perm_name, db_session=None):
+        """
+        checks if user has permission for resource - either by owning it
+            directly or via group or by having the permission set directly
+            or inherited from groups, resolved by single EXISTS query
+            without loading any objects
+
+        :param resource_id:
+        :param user_id:
+        :param perm_name: permission name or ANY_PERMISSION
+        :param db_session:
+        :return: bool
+        """
+        db_session = get_db_session(db_session)
+        statement, params = cls._has_permission_query(resource_id, user_id, perm_name)
+        return bool(db_session.execute(statement, params).scalar())
+
+    @classmethod
+    def _has_permission_query(cls, resource_id, user_id, perm_name):
+        params = {"resource_id": resource_id, "user_id": user_id}
+        if perm_name == ANY_PERMISSION:
+            statement = cls._cached_statement(
+                "has_any_permission", lambda: cls._has_permission_statement(True)
+            )
+        else:
+            statement = cls._cached_statement(
+                "has_permission", lambda: cls._has_permission_statement(False)
+            )
+            params["perm_name"] = perm_name
+        return statement, params
+
+    @classmethod
+    def _has_permission_statement(cls, any_permission):
+        resource_id = sa.bindparam("resource_id")
+        user_id = sa.bindparam("user_id")
+        user_groups = cls._user_group_ids_select(user_id)
+        owned = sa.exists().where(
+            sa.and_(
+                cls.models_proxy.Resource.resource_id == resource_id,
+                sa.or_(
+                    cls.models_proxy.Resource.owner_user_id == user_id,
+                    cls.models_proxy.Resource.owner_group_id.in_(user_groups),
+                ),
+            )
+        )
+        user_perms = sa.exists().where(
+            sa.and_(
+                cls.models_proxy.UserResourcePermission.user_id == user_id,
+                cls.models_proxy.UserResourcePermission.resource_id == resource_id,
+            )
+        )
+        group_perms = sa.exists().where(
+            sa.and_(
+                cls.models_proxy.GroupResourcePermission.group_id.in_(user_groups),
+                cls.models_proxy.GroupResourcePermission.resource_id == resource_id,
+            )
+        )
+        if not any_permission:
+            user_perms = user_perms.where(
+                cls.models_proxy.UserResourcePermission.perm_name
+                == sa.bindparam("perm_name")
+            )
+            group_perms = group_perms.where(
+                cls.models_proxy.GroupResourcePermission.perm_name
+                == sa.bindparam("perm_name")
+            )
+        return sa.select(sa.or_(owned, user_perms, group_perms))
+
+    @classmethod
+    def has_permissions(cls, resource_perm_pairs, user_id, db_session=None):
+        """
+        vectorized version of :meth:`has_permission` - checks many
+            (resource_id, perm_name) pairs with single query
+
+        :param resource_perm_pairs: list of (resource_id, perm_name) tuples,
+            perm_name can be ANY_PERMISSION
+        :param user_id:
+        :param db_session:
+        :return: list of booleans in the same order as passed pairs
+        """
+        db_session = get_db_session(db_session)
+        resource_perm_pairs = [(int(r_id), p) for r_id, p in resource_perm_pairs]
+        if not resource_perm_pairs:
+            return []
+        params = {
+            "resource_ids": list(set([r_id for r_id, _ in resource_perm_pairs])),
+            "user_id": user_id,
+        }
+        if any(p == ANY_PERMISSION for _, p in resource_perm_pairs):
+            statement = cls._cached_statement(
+                "has_any_permissions", lambda: cls._has_permissions_statement(True)
+            )
+        else:
+            statement = cls._cached_statement(
+                "has_permissions", lambda: cls._has_permissions_statement(False)
+            )
+            params["perm_names"] = list(set([p for _, p in resource_perm_pairs]))
+
+        owned = set()
+        granted = set()
+        granted_ids = set()
+        for row in db_session.execute(statement, params):
+            if row.perm_name is None:
+                owned.add(row.resource_id)
+            else:
+                granted.add((row.resource_id, row.perm_name))
+                granted_ids.add(row.resource_id)
+
+        results = []
+        for resource_id, perm_name in resource_perm_pairs:
+            if resource_id in owned:
+                results.append(True)
+            elif perm_name == ANY_PERMISSION:
+                results.append(resource_id in granted_ids)
+            else:
+                results.append((resource_id, perm_name) in granted)
+        return results
+
+    @classmethod
+    def _has_permissions_statement(cls, any_permission):
+        resource_ids = sa.bindparam("resource_ids", expanding=True)
+        user_id = sa.bindparam("user_id")
+        user_groups = cls._user_group_ids_select(user_id)
+
+        statement = sa.select(
+            cls.models_proxy.Resource.resource_id,
+            sa.literal(None, sa.Unicode).label("perm_name"),
+        )
+        statement = statement.where(
+            cls.models_proxy.Resource.resource_id.in_(resource_ids)
+        )
+        statement = statement.where(
+            sa.or_(
+                cls.models_proxy.Resource.owner_user_id == user_id,
+                cls.models_proxy.Resource.owner_group_id.in_(user_groups),
+            )
+        )
+
+        statement2 = sa.select(
+            cls.models_proxy.UserResourcePermission.resource_id,
+            cls.models_proxy.UserResourcePermission.perm_name,
+        )
+        statement2 = statement2.where(
+            cls.models_proxy.UserResourcePermission.user_id == user_id
+        )
+        statement2 = statement2.where(
+            cls.models_proxy.UserResourcePermission.resource_id.in_(resource_ids)
+        )
+
+        statement3 = sa.select(
+            cls.models_proxy.GroupResourcePermission.resource_id,
+            cls.models_proxy.GroupResourcePermission.perm_name,
+        )
+        statement3 = statement3.where(
+            cls.models_proxy.GroupResourcePermission.group_id.in_(user_groups)
+        )
+        statement3 = statement3.where(
+            cls.models_proxy.GroupResourcePermission.resource_id.in_(resource_ids)
+        )
+        if not any_permission:
+            perm_names = sa.bindparam("perm_names", expanding=True)
+            statement2 = statement2.where(
+                cls.models_proxy.UserResourcePermission.perm_name.in_(perm_names)
+            )
+            statement3 = statement3.where(
+                cls.models_proxy.GroupResourcePermission.perm_name.in_(perm_names)
+            )
+        return sa.union(statement, statement2, statement3)
+
+    @classmethod
+    def _user_group_ids_select(cls, user_id):
+        return sa.select(cls.models_proxy.UserGroup.group_id).where(
+            cls.models_proxy.UserGroup.user_id == user_id
+        )
+
+    @classmethod
+    def _owned_by_user_group(cls, instance, user, db_session=None):
+        if instance.owner_group_id is None:
+            return False
+        group_ids = UserService.group_ids(user, db_session=db_session)
+        return instance.owner_group_id in group_ids
+
+    @classmethod
+    def _perm_ids_for_user(cls, instance, user, rows, owner_group):
+        perms = [
+            PermissionIdTuple(
+                user.id,
+                row.perm_name,
+                row.type,
+                row.owner_id if row.type == "group" else None,
+                instance.resource_id,
+                False,
+                True,
+            )
+            for row in rows
+        ]
+        if instance.owner_user_id == user.id:
+            perms.append(
+                PermissionIdTuple(
+                    user.id,
+                    ALL_PERMISSIONS,
+                    "user",
+                    None,
+                    instance.resource_id,
+                    True,
+                    True,
+                )
+            )
+        if owner_group:
+            perms.append(
+                PermissionIdTuple(
+                    user.id,
+                    ALL_PERMISSIONS,
+                    "group",
+                    instance.owner_group_id,
+                    instance.resource_id,
+                    True,
+                    True,
+                )
+            )
+        return perms
+
     @classmethod
     def direct_perms_for_user(cls, instance, user, db_session=None):
         """
@@ -117,24 +650,28 @@ class ResourceService(BaseService):
         :return:
         """
         db_session = get_db_session(db_session, instance)
-        query = db_session.query(
+        statement = sa.select(
             cls.models_proxy.UserResourcePermission.user_id,
             cls.models_proxy.UserResourcePermission.perm_name,
         )
-        query = query.filter(cls.models_proxy.UserResourcePermission.user_id == user.id)
-        query = query.filter(
+        statement = statement.where(
+            cls.models_proxy.UserResourcePermission.user_id == user.id
+        )
+        statement = statement.where(
             cls.models_proxy.UserResourcePermission.resource_id == instance.resource_id
         )
 
         perms = [
             PermissionTuple(user, row.perm_name, "user", None, instance, False, True)
-            for row in query
+            for row in db_session.execute(statement)
         ]
 
         # include all perms if user is the owner of this resource
         if instance.owner_user_id == user.id:
             perms.append(
-                PermissionTuple(user, ALL_PERMISSIONS, "user", None, instance, True, True)
+                PermissionTuple(
+                    user, ALL_PERMISSIONS, "user", None, instance, True, True
+                )
             )
         return perms
 
@@ -159,8 +696,10 @@ class ResourceService(BaseService):
         )
         perms = [p for p in perms if p.type == "group"]
         # include all perms if user is the owner of this resource
-        groups_dict = dict([(g.id, g) for g in user.groups])
-        if instance.owner_group_id in groups_dict:
+        if cls._owned_by_user_group(instance, user, db_session):
+            groups_dict = UserService.groups_dict(
+                user, [instance.owner_group_id], db_session=db_session
+            )
             perms.append(
                 PermissionTuple(
                     user,
@@ -244,10 +783,10 @@ class ResourceService(BaseService):
         :return:
         """
         db_session = get_db_session(db_session)
-        query = db_session.query(cls.model).filter(
+        statement = sa.select(cls.model).where(
             cls.model.resource_id == int(resource_id)
         )
-        return query.first()
+        return db_session.execute(statement).scalars().first()
 
     @classmethod
     def perm_by_group_and_perm_name(
@@ -263,17 +802,17 @@ class ResourceService(BaseService):
         :return:
         """
         db_session = get_db_session(db_session)
-        query = db_session.query(cls.models_proxy.GroupResourcePermission)
-        query = query.filter(
+        statement = sa.select(cls.models_proxy.GroupResourcePermission)
+        statement = statement.where(
             cls.models_proxy.GroupResourcePermission.group_id == group_id
         )
-        query = query.filter(
+        statement = statement.where(
             cls.models_proxy.GroupResourcePermission.perm_name == perm_name
         )
-        query = query.filter(
+        statement = statement.where(
             cls.models_proxy.GroupResourcePermission.resource_id == resource_id
         )
-        return query.first()
+        return db_session.execute(statement).scalars().first()
 
     @classmethod
     def groups_for_perm(
@@ -334,7 +873,172 @@ class ResourceService(BaseService):
         :return:
         """
         db_session = get_db_session(db_session)
-        query = db_session.query(cls.model)
-        query = query.filter(cls.model.resource_id == resource_id)
-        query = query.with_for_update()
-        return query.first()
+        statement = cls._lock_resource_statement(resource_id)
+        return db_session.execute(statement).scalars().first()
+
+    @classmethod
+    def _lock_resource_statement(cls, resource_id):
+        statement = sa.select(cls.model).where(cls.model.resource_id == resource_id)
+        return statement.with_for_update()
+
+    @classmethod
+    def validate_perm_name(
+        cls, perm_name, resource_ids=None, resource_types=None, db_session=None
+    ):
+        """
+        checks that permission name is one of ``__possible_permissions__``
+        of every resource type among selected resources - same check as
+        ``validate_permission`` of resource model, done once per type
+        instead of once per permission row
+
+        :param perm_name:
+        :param resource_ids: limits check to specific resource ids
+        :param resource_types: limits check to specific resource types
+        :param db_session:
+        :return: list of checked resource types
+        """
+        db_session = get_db_session(db_session)
+        if resource_ids is not None or resource_types is None:
+            statement = sa.select(cls.model.resource_type).distinct()
+            statement = cls._filter_resources(statement, resource_ids, resource_types)
+            resource_types = db_session.execute(statement).scalars().all()
+        mapper = sa.inspect(cls.model)
+        for resource_type in resource_types:
+            type_mapper = mapper.polymorphic_map.get(resource_type, mapper)
+            possible_permissions = type_mapper.class_.__possible_permissions__
+            if perm_name not in possible_permissions:
+                raise AssertionError(
+                    "perm_name is not one of {}".format(possible_permissions)
+                )
+        return list(resource_types)
+
+    @classmethod
+    def _grant(
+        cls,
+        permission_model,
+        owner_key,
+        owner_id,
+        perm_name,
+        resource_ids=None,
+        resource_types=None,
+        db_session=None,
+    ):
+        db_session = get_db_session(db_session)
+        if resource_ids is not None and not resource_ids:
+            return 0
+        cls.validate_perm_name(
+            perm_name, resource_ids, resource_types, db_session=db_session
+        )
+        table = permission_model.__table__
+        resources = cls.model.__table__
+        existing = sa.select(sa.literal(1)).where(
+            table.c[owner_key] == owner_id,
+            table.c.resource_id == resources.c.resource_id,
+            table.c.perm_name == perm_name,
+        )
+        source = sa.select(
+            sa.literal(owner_id, table.c[owner_key].type),
+            resources.c.resource_id,
+            sa.literal(perm_name, table.c.perm_name.type),
+        ).where(~existing.exists())
+        source = cls._filter_resources(source, resource_ids, resource_types)
+        if db_session.get_bind(cls.model).dialect.name == "postgresql":
+            # also skip rows inserted by concurrent transactions
+            from sqlalchemy.dialects.postgresql import insert
+
+            statement = insert(table).from_select(
+                [owner_key, "resource_id", "perm_name"], source
+            )
+            statement = statement.on_conflict_do_nothing()
+        else:
+            statement = table.insert().from_select(
+                [owner_key, "resource_id", "perm_name"], source
+            )
+        rowcount = db_session.execute(statement).rowcount
+        if rowcount:
+            cls._permissions_written(db_session, owner_key, owner_id)
+        return rowcount
+
+    @classmethod
+    def _revoke(
+        cls,
+        permission_model,
+        owner_key,
+        owner_id,
+        perm_name,
+        resource_ids=None,
+        resource_types=None,
+        db_session=None,
+    ):
+        db_session = get_db_session(db_session)
+        table = permission_model.__table__
+        statement = table.delete().where(
+            table.c[owner_key] == owner_id, table.c.perm_name == perm_name
+        )
+        if resource_ids is not None:
+            statement = statement.where(table.c.resource_id.in_(resource_ids))
+        if resource_types is not None:
+            resources = cls.model.__table__
+            subquery = sa.select(resources.c.resource_id).where(
+                resources.c.resource_type.in_(resource_types)
+            )
+            statement = statement.where(table.c.resource_id.in_(subquery))
+        rowcount = db_session.execute(statement).rowcount
+        if rowcount:
+            cls._permissions_written(db_session, owner_key, owner_id)
+        return rowcount
+
+    @classmethod
+    def register_permission_write_listener(cls, target, func):
+        """
+        attaches function called after ``grant`` and ``revoke`` of
+        :class:`UserResourcePermissionService` or
+        :class:`GroupResourcePermissionService` change permission rows with
+        Core statements that do not trigger session flush events, it is
+        called as ``func(db_session, user_ids, group_ids)`` with sets of
+        ids whose permissions changed
+
+        :param target: session, sessionmaker or session class the
+            function is called for
+        :param func:
+        """
+        ResourceService._permission_write_listeners.append((target, func))
+
+    @classmethod
+    def remove_permission_write_listener(cls, target, func):
+        """
+        detaches function attached by :meth:`register_permission_write_listener`
+
+        :param target:
+        :param func:
+        """
+        ResourceService._permission_write_listeners.remove((target, func))
+
+    @classmethod
+    def _permissions_written(cls, db_session, owner_key, owner_id):
+        if isinstance(db_session, sa.orm.scoped_session):
+            db_session = db_session()
+        user_ids = set([owner_id]) if owner_key == "user_id" else set()
+        group_ids = set([owner_id]) if owner_key == "group_id" else set()
+        for target, func in list(ResourceService._permission_write_listeners):
+            if _session_matches(target, db_session):
+                func(db_session, user_ids, group_ids)
+
+    @classmethod
+    def _filter_resources(cls, statement, resource_ids, resource_types):
+        resources = cls.model.__table__
+        if resource_ids is not None:
+            statement = statement.where(resources.c.resource_id.in_(resource_ids))
+        if resource_types is not None:
+            statement = statement.where(resources.c.resource_type.in_(resource_types))
+        return statement
+
+
+def _session_matches(target, db_session):
+    if isinstance(target, type):
+        return isinstance(db_session, target)
+    elif isinstance(target, sa.orm.scoped_session):
+        target = target.session_factory
+    if isinstance(target, sa.orm.sessionmaker):
+        return isinstance(db_session, target.class_)
+    return db_session is target
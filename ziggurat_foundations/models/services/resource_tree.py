@@ -75,6 +75,17 @@ class ResourceTreeService(object):
         """
         return self.service.build_subtree_strut(result=result, *args, **kwargs)
 
+    def iter_subtree_strut(self, result, *args, **kwargs):
+        """
+        Consumes rows one by one and yields top level elements in form of
+        {node:Resource, children:{node_id: Resource}} as soon as their
+        branch is complete
+
+        :param result:
+        :return:
+        """
+        return self.service.iter_subtree_strut(result=result, *args, **kwargs)
+
     def path_upper(
         self, object_id, limit_depth=1000000, db_session=None, *args, **kwargs
     ):
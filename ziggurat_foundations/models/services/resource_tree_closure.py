@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from ziggurat_foundations.exc import (
+    ZigguratResourceTreeMissingException,
+    ZigguratResourceTreePathException,
+)
+from ziggurat_foundations.models.base import get_db_session
+from ziggurat_foundations.models.services.resource import ResourceService
+from ziggurat_foundations.models.services.resource_tree_postgres import (
+    ResourceTreeServicePostgreSQL,
+)
+from ziggurat_foundations.utils import noop
+
+__all__ = ["ResourceTreeServiceClosure"]
+
+
+class ResourceTreeServiceClosure(ResourceTreeServicePostgreSQL):
+    """
+    Variant of :class:`ResourceTreeServicePostgreSQL` that reads the tree
+    from optional ResourceClosure table instead of recursive queries, so
+    :meth:`from_resource_deeper`, :meth:`path_upper` and
+    :meth:`check_node_parent` are single indexed joins and work on any
+    database.
+
+    Closure rows are maintained by :meth:`move_to_position` and
+    :meth:`delete_branch`, rows for new resources are added by listener
+    attached with :meth:`register` (or explicitly with :meth:`insert_node`).
+    Parents should only be changed with :meth:`move_to_position`.
+    Existing trees are loaded with :meth:`rebuild`.
+
+    Subtree rows are returned breadth first - ordered by depth and then
+    by ordering of siblings, :meth:`build_subtree_strut` builds the same
+    structure from them.
+    """
+
+    model = None
+    models_proxy = None
+
+    @classmethod
+    def from_resource_deeper(
+        cls, resource_id=None, limit_depth=1000000, db_session=None, *args, **kwargs
+    ):
+        """
+        This returns you subtree of ordered objects relative
+        to the start resource_id
+
+        :param resource_id:
+        :param limit_depth:
+        :param db_session:
+        :return:
+        """
+        db_session = get_db_session(db_session)
+        closure = cls.models_proxy.ResourceClosure
+        query = db_session.query(cls.model, (closure.depth + 1).label("depth"))
+        query = query.join(closure, closure.descendant_id == cls.model.resource_id)
+        query = query.filter(closure.ancestor_id == resource_id)
+        query = query.filter(closure.depth < limit_depth)
+        return cls._order_subtree(query, closure)
+
+    @classmethod
+    def from_parent_deeper(
+        cls, parent_id=None, limit_depth=1000000, db_session=None, *args, **kwargs
+    ):
+        """
+        This returns you subtree of ordered objects relative
+        to the start parent_id
+
+        :param parent_id:
+        :param limit_depth:
+        :param db_session:
+        :return:
+        """
+        db_session = get_db_session(db_session)
+        closure = cls.models_proxy.ResourceClosure
+        if parent_id:
+            query = db_session.query(cls.model, closure.depth.label("depth"))
+            query = query.join(closure, closure.descendant_id == cls.model.resource_id)
+            query = query.filter(closure.ancestor_id == parent_id)
+            query = query.filter(closure.depth.between(1, limit_depth))
+        else:
+            roots = sa.select(cls.model.resource_id).where(
+                cls.model.parent_id == None  # noqa
+            )
+            query = db_session.query(cls.model, (closure.depth + 1).label("depth"))
+            query = query.join(closure, closure.descendant_id == cls.model.resource_id)
+            query = query.filter(closure.ancestor_id.in_(roots))
+            query = query.filter(closure.depth < limit_depth)
+        return cls._order_subtree(query, closure)
+
+    @classmethod
+    def _order_subtree(cls, query, closure):
+        return query.order_by(
+            closure.depth,
+            cls.model.parent_id,
+            cls.model.ordering,
+            cls.model.resource_id,
+        )
+
+    @classmethod
+    def iter_subtree_strut(cls, result, *args, **kwargs):
+        """
+        Builds whole structure and yields top level elements in form of
+        {node:Resource, children:{node_id: Resource}}, rows are ordered
+        breadth first so no branch is complete before last row is read
+
+        :param result:
+        :return: iterator of top level elements
+        """
+        return iter(list(cls._top_level_elements(result)))
+
+    @classmethod
+    def path_upper(
+        cls, object_id, limit_depth=1000000, db_session=None, *args, **kwargs
+    ):
+        """
+        This returns you path to root node starting from object_id
+
+        :param object_id:
+        :param limit_depth:
+        :param db_session:
+        :return:
+        """
+        db_session = get_db_session(db_session)
+        closure = cls.models_proxy.ResourceClosure
+        query = db_session.query(cls.model)
+        query = query.join(closure, closure.ancestor_id == cls.model.resource_id)
+        query = query.filter(closure.descendant_id == object_id)
+        query = query.filter(closure.depth < limit_depth)
+        return query.order_by(closure.depth)
+
+    @classmethod
+    def check_node_parent(
+        cls, resource_id, new_parent_id, db_session=None, *args, **kwargs
+    ):
+        """
+        Checks if parent destination is valid for node
+
+        :param resource_id:
+        :param new_parent_id:
+        :param db_session:
+        :return:
+        """
+        db_session = get_db_session(db_session)
+        new_parent = ResourceService.lock_resource_for_update(
+            resource_id=new_parent_id, db_session=db_session
+        )
+        # we are not moving to "root" so parent should be found
+        if not new_parent and new_parent_id is not None:
+            raise ZigguratResourceTreeMissingException("New parent node not found")
+        elif new_parent_id is not None:
+            closure = cls.models_proxy.ResourceClosure
+            statement = sa.select(
+                sa.exists().where(
+                    closure.ancestor_id == resource_id,
+                    closure.descendant_id == new_parent_id,
+                )
+            )
+            if db_session.execute(statement).scalar():
+                raise ZigguratResourceTreePathException(
+                    "Trying to insert node into itself"
+                )
+
+    @classmethod
+    def delete_branch(cls, resource_id=None, db_session=None, *args, **kwargs):
+        """
+        This deletes whole branch with children starting from resource_id
+
+        :param resource_id:
+        :param db_session:
+        :return:
+        """
+        db_session = get_db_session(db_session)
+        # lets lock rows to prevent bad tree states
+        resource = ResourceService.lock_resource_for_update(
+            resource_id=resource_id, db_session=db_session
+        )
+        parent_id = resource.parent_id
+        ordering = resource.ordering
+        closure = cls.models_proxy.ResourceClosure.__table__
+        # rows linking subtree with resource itself are kept until the
+        # resources are gone, they select the subtree in all statements
+        db_session.execute(
+            closure.delete().where(
+                closure.c.descendant_id.in_(cls._subtree_ids(resource_id)),
+                closure.c.ancestor_id != resource_id,
+            )
+        )
+        subtree = sa.select(closure.c.descendant_id).where(
+            closure.c.ancestor_id == resource_id
+        )
+        table = cls.model.__table__
+        db_session.execute(table.delete().where(table.c.resource_id.in_(subtree)))
+        # foreign keys cascade already removed the rows where enforced
+        db_session.execute(closure.delete().where(closure.c.ancestor_id == resource_id))
+        cls.shift_ordering_down(parent_id, ordering, db_session=db_session)
+        return True
+
+    @classmethod
+    def move_to_position(
+        cls,
+        resource_id,
+        to_position,
+        new_parent_id=noop,
+        db_session=None,
+        *args,
+        **kwargs
+    ):
+        """
+        Moves node to new location in the tree, closure rows of the moved
+        subtree are relinked to ancestors of new parent
+
+        :param resource_id: resource to move
+        :param to_position: new position
+        :param new_parent_id: new parent id
+        :param db_session:
+        :return:
+        """
+        db_session = get_db_session(db_session)
+        resource = ResourceService.lock_resource_for_update(
+            resource_id=resource_id, db_session=db_session
+        )
+        parent_id = resource.parent_id
+        super(ResourceTreeServiceClosure, cls).move_to_position(
+            resource_id,
+            to_position,
+            new_parent_id=new_parent_id,
+            db_session=db_session,
+        )
+        if resource.parent_id != parent_id:
+            cls._relink_subtree(resource_id, resource.parent_id, db_session)
+        return True
+
+    @classmethod
+    def _subtree_ids(cls, resource_id):
+        closure = cls.models_proxy.ResourceClosure.__table__
+        statement = sa.select(closure.c.descendant_id).where(
+            closure.c.ancestor_id == resource_id
+        )
+        return cls._derived_ids(statement)
+
+    @classmethod
+    def _ancestor_ids(cls, resource_id):
+        closure = cls.models_proxy.ResourceClosure.__table__
+        statement = sa.select(closure.c.ancestor_id).where(
+            closure.c.descendant_id == resource_id,
+            closure.c.ancestor_id != resource_id,
+        )
+        return cls._derived_ids(statement)
+
+    @classmethod
+    def _derived_ids(cls, statement):
+        # MySQL refuses DELETE with subquery reading the same table (error
+        # 1093) unless the subquery is derived table it materializes first,
+        # DISTINCT keeps optimizer from merging it back into the DELETE
+        derived = statement.distinct().subquery()
+        return sa.select(list(derived.c)[0])
+
+    @classmethod
+    def _relink_subtree(cls, resource_id, parent_id, db_session):
+        closure = cls.models_proxy.ResourceClosure.__table__
+        subtree = closure.alias("subtree")
+        supertree = closure.alias("supertree")
+        db_session.execute(
+            closure.delete().where(
+                closure.c.descendant_id.in_(cls._subtree_ids(resource_id)),
+                closure.c.ancestor_id.in_(cls._ancestor_ids(resource_id)),
+            )
+        )
+        if parent_id is None:
+            return
+        statement = sa.select(
+            supertree.c.ancestor_id,
+            subtree.c.descendant_id,
+            supertree.c.depth + subtree.c.depth + 1,
+        )
+        # every ancestor of new parent is paired with every subtree node
+        statement = statement.select_from(supertree.join(subtree, sa.true()))
+        statement = statement.where(
+            supertree.c.descendant_id == parent_id,
+            subtree.c.ancestor_id == resource_id,
+        )
+        db_session.execute(
+            closure.insert().from_select(
+                ["ancestor_id", "descendant_id", "depth"], statement
+            )
+        )
+
+    @classmethod
+    def insert_node(cls, resource_id, parent_id, db_session=None):
+        """
+        adds closure rows for new resource placed under parent
+
+        :param resource_id:
+        :param parent_id:
+        :param db_session:
+        :return:
+        """
+        db_session = get_db_session(db_session)
+        closure = cls.models_proxy.ResourceClosure.__table__
+        statement = sa.select(
+            sa.literal(resource_id, sa.Integer),
+            sa.literal(resource_id, sa.Integer),
+            sa.literal(0, sa.Integer),
+        )
+        if parent_id is not None:
+            statement = sa.union_all(
+                statement,
+                sa.select(
+                    closure.c.ancestor_id,
+                    sa.literal(resource_id, sa.Integer),
+                    closure.c.depth + 1,
+                ).where(closure.c.descendant_id == parent_id),
+            )
+        db_session.execute(
+            closure.insert().from_select(
+                ["ancestor_id", "descendant_id", "depth"], statement
+            )
+        )
+
+    @classmethod
+    def rebuild(cls, db_session=None):
+        """
+        recomputes whole closure table from ``parent_id`` of resources,
+        one statement per tree level
+
+        :param db_session:
+        :return:
+        """
+        db_session = get_db_session(db_session)
+        closure = cls.models_proxy.ResourceClosure.__table__
+        table = cls.model.__table__
+        columns = ["ancestor_id", "descendant_id", "depth"]
+        db_session.execute(closure.delete())
+        statement = sa.select(
+            table.c.resource_id, table.c.resource_id, sa.literal(0, sa.Integer)
+        )
+        db_session.execute(closure.insert().from_select(columns, statement))
+        depth = 0
+        while True:
+            parents = closure.alias("parents")
+            statement = sa.select(
+                parents.c.ancestor_id, table.c.resource_id, parents.c.depth + 1
+            ).where(
+                table.c.parent_id == parents.c.descendant_id,
+                parents.c.depth == depth,
+            )
+            result = db_session.execute(
+                closure.insert().from_select(columns, statement)
+            )
+            if not result.rowcount:
+                break
+            depth += 1
+
+    @classmethod
+    def register(cls, target=Session):
+        """
+        attaches ``after_flush`` listener to session, sessionmaker or session
+        class that adds closure rows for newly inserted resources
+
+        :param target:
+        """
+        sa.event.listen(target, "after_flush", cls._after_flush)
+
+    @classmethod
+    def unregister(cls, target=Session):
+        """
+        detaches listener attached by :meth:`register`
+
+        :param target:
+        """
+        sa.event.remove(target, "after_flush", cls._after_flush)
+
+    @classmethod
+    def _after_flush(cls, db_session, flush_context):
+        for instance in cls._new_resources(db_session):
+            cls.insert_node(
+                instance.resource_id, instance.parent_id, db_session=db_session
+            )
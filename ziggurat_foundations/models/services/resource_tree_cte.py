@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import sqlalchemy as sa
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+from ziggurat_foundations.models.base import get_db_session
+from ziggurat_foundations.models.services import BaseService
+from ziggurat_foundations.models.services.resource import ResourceService
+from ziggurat_foundations.models.services.resource_tree_postgres import (
+    ResourceTreeServicePostgreSQL,
+)
+
+__all__ = ["ResourceTreeServiceCTE"]
+
+
+class zero_pad(FunctionElement):
+    """
+    Left pads integer expression with zeros to given width,
+    ``zero_pad(expression, width)``
+    """
+
+    type = sa.String()
+    name = "zero_pad"
+    inherit_cache = True
+
+
+@compiles(zero_pad)
+def _compile_zero_pad(element, compiler, **kw):
+    expression, width = list(element.clauses)
+    return "lpad(%s, %s, '0')" % (
+        compiler.process(sa.cast(expression, sa.String()), **kw),
+        compiler.process(width, **kw),
+    )
+
+
+@compiles(zero_pad, "sqlite")
+def _compile_zero_pad_sqlite(element, compiler, **kw):
+    expression, width = list(element.clauses)
+    return "printf('%%0*d', %s, %s)" % (
+        compiler.process(width, **kw),
+        compiler.process(expression, **kw),
+    )
+
+
+class ResourceTreeServiceCTE(ResourceTreeServicePostgreSQL, BaseService):
+    """
+    Variant of :class:`ResourceTreeServicePostgreSQL` with recursive
+    queries built from SQLAlchemy constructs instead of raw SQL, tested on
+    PostgreSQL and SQLite 3.8.3+. Statements also compile for MySQL 8
+    (padding uses ``lpad``, branch delete reads subtree from derived table) but
+    MySQL is not covered by the test suite. Statements are built once per
+    model with bound parameters so every call reuses them, depth limit is
+    applied inside the recursion.
+    """
+
+    model = None
+    # maximum length of sorting and path strings
+    path_length = 4000
+
+    @classmethod
+    def from_resource_deeper(
+        cls, resource_id=None, limit_depth=1000000, db_session=None, *args, **kwargs
+    ):
+        """
+        This returns you subtree of ordered objects relative
+        to the start resource_id
+
+        :param resource_id:
+        :param limit_depth:
+        :param db_session:
+        :return:
+        """
+        db_session = get_db_session(db_session)
+        statement = cls._cached_statement(
+            "from_resource_deeper",
+            lambda: cls._subtree_statement(
+                cls.model.resource_id == sa.bindparam("resource_id")
+            ),
+        )
+        return cls._subtree_query(db_session, statement).params(
+            resource_id=resource_id, depth=limit_depth
+        )
+
+    @classmethod
+    def from_parent_deeper(
+        cls, parent_id=None, limit_depth=1000000, db_session=None, *args, **kwargs
+    ):
+        """
+        This returns you subtree of ordered objects relative
+        to the start parent_id
+
+        :param parent_id:
+        :param limit_depth:
+        :param db_session:
+        :return:
+        """
+        db_session = get_db_session(db_session)
+        if parent_id:
+            statement = cls._cached_statement(
+                "from_parent_deeper",
+                lambda: cls._subtree_statement(
+                    cls.model.parent_id == sa.bindparam("parent_id")
+                ),
+            )
+        else:
+            statement = cls._cached_statement(
+                "from_roots_deeper",
+                lambda: cls._subtree_statement(cls.model.parent_id == None),  # noqa
+            )
+        return cls._subtree_query(db_session, statement).params(
+            parent_id=parent_id, depth=limit_depth
+        )
+
+    @classmethod
+    def _subtree_query(cls, db_session, statement):
+        query = db_session.query(
+            cls.model, sa.column("depth"), sa.column("sorting"), sa.column("path")
+        )
+        return query.from_statement(statement)
+
+    @classmethod
+    def _subtree_cte(cls, limiting_clause, limit_depth=True):
+        table = cls.model.__table__
+        path_type = sa.String(cls.path_length)
+        width = sa.literal_column(str(cls.sorting_width))
+        statement = sa.select(
+            table.c.resource_id,
+            sa.literal_column("1").label("depth"),
+            sa.cast(zero_pad(table.c.ordering, width), path_type).label("sorting"),
+            sa.cast(sa.cast(table.c.resource_id, sa.String()), path_type).label("path"),
+        ).where(limiting_clause)
+        subtree = statement.cte("subtree", recursive=True)
+        child = table.alias("res_u")
+        sorting = subtree.c.sorting + "/" + zero_pad(child.c.ordering, width)
+        path = subtree.c.path + "/" + sa.cast(child.c.resource_id, sa.String())
+        statement = sa.select(
+            child.c.resource_id,
+            subtree.c.depth + 1,
+            sa.cast(sorting, path_type),
+            sa.cast(path, path_type),
+        ).where(child.c.parent_id == subtree.c.resource_id)
+        if limit_depth:
+            # stop recursion at the limit instead of filtering afterwards
+            statement = statement.where(subtree.c.depth < sa.bindparam("depth"))
+        return subtree.union_all(statement)
+
+    @classmethod
+    def _subtree_statement(cls, limiting_clause):
+        subtree = cls._subtree_cte(limiting_clause)
+        statement = sa.select(
+            cls.model, subtree.c.depth, subtree.c.sorting, subtree.c.path
+        ).join(subtree, subtree.c.resource_id == cls.model.resource_id)
+        return statement.order_by(subtree.c.sorting)
+
+    @classmethod
+    def path_upper(
+        cls, object_id, limit_depth=1000000, db_session=None, *args, **kwargs
+    ):
+        """
+        This returns you path to root node starting from object_id
+
+        :param object_id:
+        :param limit_depth:
+        :param db_session:
+        :return:
+        """
+        db_session = get_db_session(db_session)
+        statement = cls._cached_statement("path_upper", cls._path_upper_statement)
+        query = db_session.query(cls.model).from_statement(statement)
+        return query.params(resource_id=object_id, depth=limit_depth)
+
+    @classmethod
+    def _path_upper_statement(cls):
+        table = cls.model.__table__
+        statement = sa.select(
+            table.c.resource_id,
+            table.c.parent_id,
+            sa.literal_column("1").label("depth"),
+        ).where(table.c.resource_id == sa.bindparam("resource_id"))
+        path = statement.cte("path", recursive=True)
+        parent = table.alias("res_u")
+        statement = sa.select(
+            parent.c.resource_id, parent.c.parent_id, path.c.depth + 1
+        ).where(
+            parent.c.resource_id == path.c.parent_id,
+            path.c.depth < sa.bindparam("depth"),
+        )
+        path = path.union_all(statement)
+        statement = sa.select(cls.model).join(
+            path, path.c.resource_id == cls.model.resource_id
+        )
+        return statement.order_by(path.c.depth)
+
+    @classmethod
+    def delete_branch(cls, resource_id=None, db_session=None, *args, **kwargs):
+        """
+        This deletes whole branch with children starting from resource_id
+
+        :param resource_id:
+        :param db_session:
+        :return:
+        """
+        db_session = get_db_session(db_session)
+        # lets lock rows to prevent bad tree states
+        resource = ResourceService.lock_resource_for_update(
+            resource_id=resource_id, db_session=db_session
+        )
+        parent_id = resource.parent_id
+        ordering = resource.ordering
+        statement = cls._cached_statement("delete_branch", cls._delete_branch_statement)
+        db_session.execute(statement, {"resource_id": resource_id})
+        cls.shift_ordering_down(parent_id, ordering, db_session=db_session)
+        return True
+
+    @classmethod
+    def _delete_branch_statement(cls):
+        table = cls.model.__table__
+        subtree = cls._subtree_cte(
+            table.c.resource_id == sa.bindparam("resource_id"), limit_depth=False
+        )
+        # MySQL refuses DELETE with subquery reading the same table (error
+        # 1093) unless the subquery is derived table it materializes first,
+        # DISTINCT keeps optimizer from merging it back into the DELETE
+        branch = sa.select(subtree.c.resource_id).distinct().subquery("branch")
+        return table.delete().where(
+            table.c.resource_id.in_(sa.select(branch.c.resource_id))
+        )
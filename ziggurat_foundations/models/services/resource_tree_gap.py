@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import sqlalchemy as sa
+
+from ziggurat_foundations.models.base import get_db_session
+from ziggurat_foundations.models.services.resource_tree_postgres import (
+    ResourceTreeServicePostgreSQL,
+)
+from ziggurat_foundations.utils import noop
+
+__all__ = ["ResourceTreeServiceGapOrdering"]
+
+
+class ResourceTreeServiceGapOrdering(ResourceTreeServicePostgreSQL):
+    """
+    Variant of :class:`ResourceTreeServicePostgreSQL` that keeps sparse
+    ``ordering`` values between siblings. Inserting or moving a node picks a
+    value between its new neighbours and updates only that node, deleting a
+    node leaves a gap. Siblings of single parent are renumbered only when
+    there is no free value left between the neighbours.
+
+    Positions accepted by :meth:`move_to_position`, :meth:`set_position`
+    and :meth:`check_node_position` are still 1-based ranks among siblings,
+    ``ordering`` values are only meaningful for sorting. Existing trees with
+    dense ordering are renumbered lazily, branch by branch.
+    """
+
+    model = None
+    # distance between ordering values of siblings after renumbering
+    gap = 1024
+    max_ordering = 2 ** 31 - 1
+    sorting_width = 10
+
+    @classmethod
+    def delete_branch(cls, resource_id=None, db_session=None, *args, **kwargs):
+        """
+        This deletes whole branch with children starting from resource_id,
+        orderings of remaining siblings are left untouched
+
+        :param resource_id:
+        :param db_session:
+        :return:
+        """
+        db_session = get_db_session(db_session)
+        # lets lock rows to prevent bad tree states
+        cls._lock_node(resource_id, db_session)
+        text_obj = sa.text(cls._delete_branch_sql())
+        db_session.execute(text_obj, params={"resource_id": resource_id})
+        return True
+
+    @classmethod
+    def move_to_position(
+        cls,
+        resource_id,
+        to_position,
+        new_parent_id=noop,
+        db_session=None,
+        *args,
+        **kwargs
+    ):
+        """
+        Moves node to new location in the tree
+
+        :param resource_id: resource to move
+        :param to_position: new position
+        :param new_parent_id: new parent id
+        :param db_session:
+        :return:
+        """
+        db_session = get_db_session(db_session)
+        # lets lock rows to prevent bad tree states
+        resource = cls._lock_node(resource_id, db_session)
+        cls._lock_node(resource.parent_id, db_session)
+        # reset if parent is same as old
+        if new_parent_id == resource.parent_id:
+            new_parent_id = noop
+
+        if new_parent_id is noop:
+            parent_id = resource.parent_id
+        else:
+            cls.check_node_parent(resource_id, new_parent_id, db_session=db_session)
+            parent_id = new_parent_id
+
+        cls.check_node_position(
+            parent_id,
+            to_position,
+            on_same_branch=new_parent_id is noop,
+            db_session=db_session,
+        )
+        ordering = cls.ordering_for_position(
+            parent_id, to_position, exclude_id=resource_id, db_session=db_session
+        )
+        resource.parent_id = parent_id
+        resource.ordering = ordering
+        db_session.flush()
+        return True
+
+    @classmethod
+    def set_position(cls, resource_id, to_position, db_session=None, *args, **kwargs):
+        """
+        Sets node position for new node in the tree
+
+        :param resource_id: resource to move
+        :param to_position: new position
+        :param db_session:
+        :return:
+        """
+        db_session = get_db_session(db_session)
+        # lets lock rows to prevent bad tree states
+        resource = cls._lock_node(resource_id, db_session)
+        cls.check_node_position(
+            resource.parent_id, to_position, on_same_branch=True, db_session=db_session
+        )
+        resource.ordering = cls.ordering_for_position(
+            resource.parent_id,
+            to_position,
+            exclude_id=resource_id,
+            db_session=db_session,
+        )
+        db_session.flush()
+        return True
+
+    @classmethod
+    def _lock_node(cls, resource_id, db_session):
+        # same as ResourceService.lock_resource_for_update for model of
+        # this service
+        statement = sa.select(cls.model).where(cls.model.resource_id == resource_id)
+        return db_session.execute(statement.with_for_update()).scalars().first()
+
+    @classmethod
+    def ordering_for_position(
+        cls, parent_id, position, exclude_id=None, db_session=None
+    ):
+        """
+        Returns ordering value that places node at given position among
+        children of parent, renumbers the children if neighbours have no
+        free value between them
+
+        :param parent_id:
+        :param position: 1-based position
+        :param exclude_id: node that is being placed, skipped when looking
+            for neighbours
+        :param db_session:
+        :return: int
+        """
+        db_session = get_db_session(db_session)
+        statement = sa.select(cls.model.ordering)
+        statement = statement.where(cls.model.parent_id == parent_id)
+        if exclude_id is not None:
+            statement = statement.where(cls.model.resource_id != exclude_id)
+        statement = statement.order_by(cls.model.ordering, cls.model.resource_id)
+        if position > 1:
+            statement = statement.offset(position - 2).limit(2)
+            neighbours = db_session.execute(statement).scalars().all()
+        else:
+            neighbours = [0] + db_session.execute(statement.limit(1)).scalars().all()
+
+        before = neighbours[0] if neighbours else 0
+        if len(neighbours) < 2:
+            ordering = before + cls.gap
+            if ordering <= cls.max_ordering:
+                return ordering
+        elif neighbours[1] - before > 1:
+            return (before + neighbours[1]) // 2
+
+        cls.rebalance(parent_id, db_session=db_session)
+        return cls.ordering_for_position(
+            parent_id, position, exclude_id=exclude_id, db_session=db_session
+        )
+
+    @classmethod
+    def rebalance(cls, parent_id, db_session=None):
+        """
+        Renumbers children of parent so their ordering values are ``gap``
+        apart, keeping their current order
+
+        :param parent_id:
+        :param db_session:
+        :return:
+        """
+        db_session = get_db_session(db_session)
+        statement = sa.select(cls.model.resource_id)
+        statement = statement.where(cls.model.parent_id == parent_id)
+        statement = statement.order_by(cls.model.ordering, cls.model.resource_id)
+        resource_ids = db_session.execute(statement).scalars().all()
+        gap = min(cls.gap, cls.max_ordering // (len(resource_ids) + 2))
+        table = cls.model.__table__
+        statement = table.update()
+        statement = statement.where(table.c.resource_id == sa.bindparam("b_id"))
+        statement = statement.values(ordering=sa.bindparam("b_ordering"))
+        db_session.execute(
+            statement,
+            [
+                {"b_id": resource_id, "b_ordering": (i + 1) * gap}
+                for i, resource_id in enumerate(resource_ids)
+            ],
+        )
+        # objects already loaded in session carry old values
+        for instance in list(db_session.identity_map.values()):
+            if (
+                isinstance(instance, cls.model)
+                and sa.inspect(instance).dict.get("parent_id") == parent_id
+            ):
+                db_session.expire(instance, ["ordering"])
@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import itertools
+
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from ziggurat_foundations.exc import (
+    ZigguratResourceTreeMissingException,
+    ZigguratResourceTreePathException,
+)
+from ziggurat_foundations.models.base import get_db_session
+from ziggurat_foundations.models.services.resource_tree_gap import (
+    ResourceTreeServiceGapOrdering,
+)
+from ziggurat_foundations.utils import noop
+
+__all__ = ["ResourceTreeServiceMaterializedPath"]
+
+
+class ResourceTreeServiceMaterializedPath(ResourceTreeServiceGapOrdering):
+    """
+    Variant of :class:`ResourceTreeServiceGapOrdering` that reads the tree
+    from ``tree_path`` column added by ResourceTreePathMixin. Subtree
+    fetches with depth limits are single range scans of the path index
+    returned in depth first order, :meth:`path_upper` reads ancestors by
+    ids encoded in the path. Works on any database.
+
+    Paths of moved or reordered node and its descendants are rewritten by
+    single UPDATE, gap ordering keeps reordering from touching siblings.
+    Paths of new resources are set by listener attached with
+    :meth:`register` (or explicitly with :meth:`update_path`), existing
+    trees are loaded with :meth:`rebuild`. Every level takes
+    ``2 * segment_digits`` characters of the column (see
+    :meth:`max_depth`), placing node deeper raises
+    :class:`ZigguratResourceTreePathException`.
+    """
+
+    model = None
+    # hex digits used for ordering and for resource id in path segment
+    segment_digits = 8
+    # sorts after every hex digit, bounds subtree range
+    range_end = "g"
+    id_offset = 2 ** 31
+
+    @classmethod
+    def path_segment(cls, ordering, resource_id):
+        """
+        returns path segment of resource
+
+        :param ordering:
+        :param resource_id:
+        :return: string
+        """
+        return "{:0{width}x}{:0{width}x}".format(
+            ordering, resource_id + cls.id_offset, width=cls.segment_digits
+        )
+
+    @classmethod
+    def max_depth(cls):
+        """
+        returns number of tree levels that fit into ``tree_path`` column
+
+        :return: int
+        """
+        length = cls.model.__table__.c.tree_path.type.length
+        return length // (cls.segment_digits * 2)
+
+    @classmethod
+    def path_ids(cls, tree_path):
+        """
+        returns resource ids encoded in path, from root to the resource
+
+        :param tree_path:
+        :return: list of ids
+        """
+        resource_ids = []
+        # id is second half of every segment
+        for start in range(cls.segment_digits, len(tree_path), cls.segment_digits * 2):
+            end = start + cls.segment_digits
+            resource_ids.append(int(tree_path[start:end], 16) - cls.id_offset)
+        return resource_ids
+
+    @classmethod
+    def _subtree_range(cls, column, tree_path, include_self=True):
+        if include_self:
+            start = column >= tree_path
+        else:
+            start = column > tree_path
+        return sa.and_(start, column < tree_path + cls.range_end)
+
+    @classmethod
+    def _depth(cls, column):
+        return sa.func.length(column) / (cls.segment_digits * 2)
+
+    @classmethod
+    def from_resource_deeper(
+        cls, resource_id=None, limit_depth=1000000, db_session=None, *args, **kwargs
+    ):
+        """
+        This returns you subtree of ordered objects relative
+        to the start resource_id
+
+        :param resource_id:
+        :param limit_depth:
+        :param db_session:
+        :return:
+        """
+        db_session = get_db_session(db_session)
+        start = sa.orm.aliased(cls.model)
+        depth = cls._depth(cls.model.tree_path) - cls._depth(start.tree_path) + 1
+        query = db_session.query(cls.model, depth.label("depth"))
+        query = query.join(start, start.resource_id == resource_id)
+        query = query.filter(cls._subtree_range(cls.model.tree_path, start.tree_path))
+        query = query.filter(depth <= limit_depth)
+        return query.order_by(cls.model.tree_path)
+
+    @classmethod
+    def from_parent_deeper(
+        cls, parent_id=None, limit_depth=1000000, db_session=None, *args, **kwargs
+    ):
+        """
+        This returns you subtree of ordered objects relative
+        to the start parent_id
+
+        :param parent_id:
+        :param limit_depth:
+        :param db_session:
+        :return:
+        """
+        db_session = get_db_session(db_session)
+        if parent_id:
+            parent = sa.orm.aliased(cls.model)
+            depth = cls._depth(cls.model.tree_path) - cls._depth(parent.tree_path)
+            query = db_session.query(cls.model, depth.label("depth"))
+            query = query.join(parent, parent.resource_id == parent_id)
+            query = query.filter(
+                cls._subtree_range(
+                    cls.model.tree_path, parent.tree_path, include_self=False
+                )
+            )
+        else:
+            depth = cls._depth(cls.model.tree_path)
+            query = db_session.query(cls.model, depth.label("depth"))
+        query = query.filter(depth <= limit_depth)
+        return query.order_by(cls.model.tree_path)
+
+    @classmethod
+    def path_upper(
+        cls, object_id, limit_depth=1000000, db_session=None, *args, **kwargs
+    ):
+        """
+        This returns you path to root node starting from object_id
+
+        :param object_id:
+        :param limit_depth:
+        :param db_session:
+        :return:
+        """
+        db_session = get_db_session(db_session)
+        statement = sa.select(cls.model.tree_path)
+        statement = statement.where(cls.model.resource_id == object_id)
+        tree_path = db_session.execute(statement).scalar()
+        resource_ids = cls.path_ids(tree_path) if tree_path else []
+        query = db_session.query(cls.model)
+        query = query.filter(cls.model.resource_id.in_(resource_ids[-limit_depth:]))
+        return query.order_by(cls.model.tree_path.desc())
+
+    @classmethod
+    def check_node_parent(
+        cls, resource_id, new_parent_id, db_session=None, *args, **kwargs
+    ):
+        """
+        Checks if parent destination is valid for node
+
+        :param resource_id:
+        :param new_parent_id:
+        :param db_session:
+        :return:
+        """
+        db_session = get_db_session(db_session)
+        new_parent = cls._lock_node(new_parent_id, db_session)
+        # we are not moving to "root" so parent should be found
+        if not new_parent and new_parent_id is not None:
+            raise ZigguratResourceTreeMissingException("New parent node not found")
+        elif new_parent_id is not None:
+            tree_path = cls._require_path(new_parent_id, new_parent.tree_path)
+            if resource_id in cls.path_ids(tree_path):
+                raise ZigguratResourceTreePathException(
+                    "Trying to insert node into itself"
+                )
+
+    @classmethod
+    def delete_branch(cls, resource_id=None, db_session=None, *args, **kwargs):
+        """
+        This deletes whole branch with children starting from resource_id,
+        orderings of remaining siblings are left untouched
+
+        :param resource_id:
+        :param db_session:
+        :return:
+        """
+        db_session = get_db_session(db_session)
+        # lets lock rows to prevent bad tree states
+        resource = cls._lock_node(resource_id, db_session)
+        tree_path = cls._require_path(resource_id, resource.tree_path)
+        table = cls.model.__table__
+        db_session.execute(
+            table.delete().where(cls._subtree_range(table.c.tree_path, tree_path))
+        )
+        return True
+
+    @classmethod
+    def move_to_position(
+        cls,
+        resource_id,
+        to_position,
+        new_parent_id=noop,
+        db_session=None,
+        *args,
+        **kwargs
+    ):
+        """
+        Moves node to new location in the tree, paths of the node and its
+        descendants are rewritten
+
+        :param resource_id: resource to move
+        :param to_position: new position
+        :param new_parent_id: new parent id
+        :param db_session:
+        :return:
+        """
+        db_session = get_db_session(db_session)
+        super(ResourceTreeServiceMaterializedPath, cls).move_to_position(
+            resource_id,
+            to_position,
+            new_parent_id=new_parent_id,
+            db_session=db_session,
+        )
+        cls.update_path(resource_id, db_session=db_session)
+        return True
+
+    @classmethod
+    def set_position(cls, resource_id, to_position, db_session=None, *args, **kwargs):
+        """
+        Sets node position for new node in the tree
+
+        :param resource_id: resource to move
+        :param to_position: new position
+        :param db_session:
+        :return:
+        """
+        db_session = get_db_session(db_session)
+        super(ResourceTreeServiceMaterializedPath, cls).set_position(
+            resource_id, to_position, db_session=db_session
+        )
+        cls.update_path(resource_id, db_session=db_session)
+        return True
+
+    @classmethod
+    def rebalance(cls, parent_id, db_session=None):
+        """
+        Renumbers children of parent so their ordering values are ``gap``
+        apart and rewrites their paths
+
+        :param parent_id:
+        :param db_session:
+        :return:
+        """
+        db_session = get_db_session(db_session)
+        super(ResourceTreeServiceMaterializedPath, cls).rebalance(
+            parent_id, db_session=db_session
+        )
+        statement = sa.select(cls.model.resource_id)
+        statement = statement.where(cls.model.parent_id == parent_id)
+        for resource_id in db_session.execute(statement).scalars().all():
+            cls.update_path(resource_id, db_session=db_session)
+
+    @classmethod
+    def update_path(cls, resource_id, db_session=None):
+        """
+        computes path of resource from its parent path, ordering and id and
+        rewrites paths of the resource and its descendants with single
+        UPDATE if it changed
+
+        :param resource_id:
+        :param db_session:
+        :return: new path
+        """
+        db_session = get_db_session(db_session)
+        tree_path, rewritten = cls._write_path(resource_id, db_session)
+        if rewritten:
+            cls._expire_paths(db_session)
+        return tree_path
+
+    @classmethod
+    def _require_path(cls, resource_id, tree_path):
+        if tree_path is None:
+            raise ZigguratResourceTreePathException(
+                "Resource {} has no tree_path, paths of existing resources "
+                "have to be computed with rebuild()",
+                value=resource_id,
+            )
+        return tree_path
+
+    @classmethod
+    def _check_length(cls, path_length):
+        if path_length > cls.model.__table__.c.tree_path.type.length:
+            raise ZigguratResourceTreePathException(
+                "Resource tree is limited to {} levels by tree_path column",
+                value=cls.max_depth(),
+            )
+
+    @classmethod
+    def _write_path(cls, resource_id, db_session):
+        table = cls.model.__table__
+        parent = table.alias("parent")
+        statement = sa.select(
+            table.c.ordering,
+            table.c.parent_id,
+            table.c.tree_path,
+            parent.c.tree_path.label("parent"),
+        )
+        statement = statement.select_from(
+            table.outerjoin(parent, parent.c.resource_id == table.c.parent_id)
+        )
+        row = db_session.execute(
+            statement.where(table.c.resource_id == resource_id)
+        ).first()
+        parent_path = ""
+        if row.parent_id is not None:
+            parent_path = cls._require_path(row.parent_id, row.parent)
+        tree_path = parent_path + cls.path_segment(row.ordering, resource_id)
+        if row.tree_path == tree_path:
+            return tree_path, False
+        statement = table.update()
+        if row.tree_path is None:
+            cls._check_length(len(tree_path))
+            statement = statement.where(table.c.resource_id == resource_id)
+            statement = statement.values(tree_path=tree_path)
+        else:
+            subtree = cls._subtree_range(table.c.tree_path, row.tree_path)
+            deepest = sa.select(sa.func.max(sa.func.length(table.c.tree_path)))
+            deepest = db_session.execute(deepest.where(subtree)).scalar()
+            cls._check_length(len(tree_path) + deepest - len(row.tree_path))
+            statement = statement.where(subtree)
+            statement = statement.values(
+                tree_path=tree_path
+                + sa.func.substr(table.c.tree_path, len(row.tree_path) + 1)
+            )
+        db_session.execute(statement)
+        return tree_path, True
+
+    @classmethod
+    def rebuild(cls, db_session=None, batch_size=1000):
+        """
+        recomputes paths of all resources from ``parent_id`` and
+        ``ordering``
+
+        :param db_session:
+        :param batch_size: number of rows updated by single executemany
+        :return:
+        """
+        db_session = get_db_session(db_session)
+        table = cls.model.__table__
+        statement = sa.select(table.c.resource_id, table.c.parent_id, table.c.ordering)
+        nodes = dict((row.resource_id, row) for row in db_session.execute(statement))
+        paths = {}
+        for resource_id in nodes:
+            # walk up to first node with known path
+            chain = []
+            while resource_id is not None and resource_id not in paths:
+                chain.append(nodes[resource_id])
+                resource_id = nodes[resource_id].parent_id
+            tree_path = paths.get(resource_id, "")
+            for node in reversed(chain):
+                tree_path += cls.path_segment(node.ordering, node.resource_id)
+                paths[node.resource_id] = tree_path
+        cls._check_length(max([len(path) for path in paths.values()] or [0]))
+
+        statement = table.update()
+        statement = statement.where(table.c.resource_id == sa.bindparam("b_id"))
+        statement = statement.values(tree_path=sa.bindparam("b_tree_path"))
+        remaining = iter(paths.items())
+        for batch in iter(lambda: list(itertools.islice(remaining, batch_size)), []):
+            db_session.execute(
+                statement,
+                [{"b_id": i, "b_tree_path": tree_path} for i, tree_path in batch],
+            )
+        cls._expire_paths(db_session)
+
+    @classmethod
+    def _expire_paths(cls, db_session):
+        # objects already loaded in session carry old values
+        for instance in list(db_session.identity_map.values()):
+            if isinstance(instance, cls.model):
+                db_session.expire(instance, ["tree_path"])
+
+    @classmethod
+    def register(cls, target=Session):
+        """
+        attaches ``after_flush`` listener to session, sessionmaker or session
+        class that sets paths of newly inserted resources
+
+        :param target:
+        """
+        sa.event.listen(target, "after_flush", cls._after_flush)
+
+    @classmethod
+    def unregister(cls, target=Session):
+        """
+        detaches listener attached by :meth:`register`
+
+        :param target:
+        """
+        sa.event.remove(target, "after_flush", cls._after_flush)
+
+    @classmethod
+    def _after_flush(cls, db_session, flush_context):
+        for instance in cls._new_resources(db_session):
+            tree_path, _ = cls._write_path(instance.resource_id, db_session)
+            sa.orm.attributes.set_committed_value(instance, "tree_path", tree_path)
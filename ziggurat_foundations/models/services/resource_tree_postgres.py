@@ -19,6 +19,8 @@ __all__ = ["ResourceTreeServicePostgreSQL"]
 
 class ResourceTreeServicePostgreSQL(object):
     model = None
+    # number of digits ordering is padded to when building sorting key
+    sorting_width = 7
 
     @classmethod
     def from_resource_deeper(
@@ -33,26 +35,11 @@ class ResourceTreeServicePostgreSQL(object):
         :param db_session:
         :return:
         """
-        tablename = cls.model.__table__.name
-        raw_q = """
-            WITH RECURSIVE subtree AS (
-                    SELECT res.*, 1 AS depth, LPAD(res.ordering::CHARACTER VARYING, 7, '0') AS sorting,
-                    res.resource_id::CHARACTER VARYING AS path
-                    FROM {tablename} AS res WHERE res.resource_id = :resource_id
-                  UNION ALL
-                    SELECT res_u.*, depth+1 AS depth,
-                    (st.sorting::CHARACTER VARYING || '/' || LPAD(res_u.ordering::CHARACTER VARYING, 7, '0') ) AS sorting,
-                    (st.path::CHARACTER VARYING || '/' || res_u.resource_id::CHARACTER VARYING ) AS path
-                    FROM {tablename} res_u, subtree st
-                    WHERE res_u.parent_id = st.resource_id
-            )
-            SELECT * FROM subtree WHERE depth<=:depth ORDER BY sorting;
-        """.format(
-            tablename=tablename
-        )  # noqa
         db_session = get_db_session(db_session)
-        text_obj = sa.text(raw_q)
-        query = db_session.query(cls.model, sa.column("depth"), sa.column("sorting"), sa.column("path"))
+        text_obj = sa.text(cls._subtree_sql("res.resource_id = :resource_id"))
+        query = db_session.query(
+            cls.model, sa.column("depth"), sa.column("sorting"), sa.column("path")
+        )
         query = query.from_statement(text_obj)
         query = query.params(resource_id=resource_id, depth=limit_depth)
         return query
@@ -66,14 +53,21 @@ class ResourceTreeServicePostgreSQL(object):
         :param db_session:
         :return:
         """
-        tablename = cls.model.__table__.name
-
         # lets lock rows to prevent bad tree states
         resource = ResourceService.lock_resource_for_update(
             resource_id=resource_id, db_session=db_session
         )
         parent_id = resource.parent_id
         ordering = resource.ordering
+        db_session = get_db_session(db_session)
+        text_obj = sa.text(cls._delete_branch_sql())
+        db_session.execute(text_obj, params={"resource_id": resource_id})
+        cls.shift_ordering_down(parent_id, ordering, db_session=db_session)
+        return True
+
+    @classmethod
+    def _delete_branch_sql(cls):
+        tablename = cls.model.__table__.name
         raw_q = """
             WITH RECURSIVE subtree AS (
                     SELECT res.resource_id
@@ -83,15 +77,11 @@ class ResourceTreeServicePostgreSQL(object):
                     FROM {tablename} res_u, subtree st
                     WHERE res_u.parent_id = st.resource_id
             )
-            DELETE FROM resources where resource_id in (select * from subtree);
+            DELETE FROM {tablename} where resource_id in (select * from subtree);
         """.format(
             tablename=tablename
         )  # noqa
-        db_session = get_db_session(db_session)
-        text_obj = sa.text(raw_q)
-        db_session.execute(text_obj, params={"resource_id": resource_id})
-        cls.shift_ordering_down(parent_id, ordering, db_session=db_session)
-        return True
+        return raw_q
 
     @classmethod
     def from_parent_deeper(
@@ -111,29 +101,37 @@ class ResourceTreeServicePostgreSQL(object):
             limiting_clause = "res.parent_id = :parent_id"
         else:
             limiting_clause = "res.parent_id is null"
+        db_session = get_db_session(db_session)
+        text_obj = sa.text(cls._subtree_sql(limiting_clause))
+        query = db_session.query(
+            cls.model, sa.column("depth"), sa.column("sorting"), sa.column("path")
+        )
+        query = query.from_statement(text_obj)
+        query = query.params(parent_id=parent_id, depth=limit_depth)
+        return query
+
+    @classmethod
+    def _subtree_sql(cls, limiting_clause):
         tablename = cls.model.__table__.name
         raw_q = """
             WITH RECURSIVE subtree AS (
-                    SELECT res.*, 1 AS depth, LPAD(res.ordering::CHARACTER VARYING, 7, '0') AS sorting,
+                    SELECT res.*, 1 AS depth, LPAD(res.ordering::CHARACTER VARYING, {width}, '0') AS sorting,
                     res.resource_id::CHARACTER VARYING AS path
                     FROM {tablename} AS res WHERE {limiting_clause}
                   UNION ALL
                     SELECT res_u.*, depth+1 AS depth,
-                    (st.sorting::CHARACTER VARYING || '/' || LPAD(res_u.ordering::CHARACTER VARYING, 7, '0') ) AS sorting,
+                    (st.sorting::CHARACTER VARYING || '/' || LPAD(res_u.ordering::CHARACTER VARYING, {width}, '0') ) AS sorting,
                     (st.path::CHARACTER VARYING || '/' || res_u.resource_id::CHARACTER VARYING ) AS path
                     FROM {tablename} res_u, subtree st
                     WHERE res_u.parent_id = st.resource_id
             )
             SELECT * FROM subtree WHERE depth<=:depth ORDER BY sorting;
         """.format(
-            tablename=tablename, limiting_clause=limiting_clause
+            tablename=tablename,
+            limiting_clause=limiting_clause,
+            width=cls.sorting_width,
         )  # noqa
-        db_session = get_db_session(db_session)
-        text_obj = sa.text(raw_q)
-        query = db_session.query(cls.model, sa.column("depth"), sa.column("sorting"), sa.column("path"))
-        query = query.from_statement(text_obj)
-        query = query.params(parent_id=parent_id, depth=limit_depth)
-        return query
+        return raw_q
 
     @classmethod
     def build_subtree_strut(cls, result, *args, **kwargs):
@@ -141,25 +139,76 @@ class ResourceTreeServicePostgreSQL(object):
         Returns a dictionary in form of
         {node:Resource, children:{node_id: Resource}}
 
-        :param result:
+        :param result: rows ordered so parents come before their children,
+            as returned by from_resource_deeper and from_parent_deeper
         :return:
         """
-        items = list(result)
         root_elem = {"node": None, "children": OrderedDict()}
-        if len(items) == 0:
-            return root_elem
-        for _, node in enumerate(items):
-            node_res = getattr(node, cls.model.__name__)
-            new_elem = {"node": node_res, "children": OrderedDict()}
-            path = list(map(int, node.path.split("/")))
-            parent_node = root_elem
-            normalized_path = path[:-1]
-            if normalized_path:
-                for path_part in normalized_path:
-                    parent_node = parent_node["children"][path_part]
-            parent_node["children"][new_elem["node"].resource_id] = new_elem
+        for elem in cls.iter_subtree_strut(result):
+            root_elem["children"][elem["node"].resource_id] = elem
         return root_elem
 
+    @classmethod
+    def iter_subtree_strut(cls, result, *args, **kwargs):
+        """
+        Consumes rows one by one and yields top level elements in form of
+        {node:Resource, children:{node_id: Resource}} as soon as their
+        branch is complete, every node is attached to its parent with single
+        dictionary lookup. Combined with ``yield_per()`` on the query
+        rendering can start before whole subtree is fetched.
+
+        :param result: rows or resources ordered so parents come before
+            their children, as returned by from_resource_deeper and
+            from_parent_deeper
+        :return: generator of top level elements
+        """
+        branch = None
+        for elem in cls._top_level_elements(result):
+            # rows are ordered depth first, previous branch is finished
+            if branch is not None:
+                yield branch
+            branch = elem
+        if branch is not None:
+            yield branch
+
+    @classmethod
+    def _top_level_elements(cls, result):
+        """
+        attaches every node to element of its parent and yields elements
+        of nodes whose parent is not part of the result
+        """
+        elements = {}
+        for row in result:
+            node = getattr(row, cls.model.__name__, row)
+            elem = {"node": node, "children": OrderedDict()}
+            parent_elem = elements.get(node.parent_id)
+            if parent_elem is not None:
+                parent_elem["children"][node.resource_id] = elem
+            else:
+                yield elem
+            elements[node.resource_id] = elem
+
+    @classmethod
+    def _new_resources(cls, db_session):
+        """
+        returns resources pending insert in flushed session, parents
+        inserted in same flush come before their children
+        """
+        new = dict(
+            (instance.resource_id, instance)
+            for instance in db_session.new
+            if isinstance(instance, cls.model)
+        )
+        depths = {}
+
+        def depth(instance):
+            if instance.resource_id not in depths:
+                parent = new.get(instance.parent_id)
+                depths[instance.resource_id] = depth(parent) + 1 if parent else 0
+            return depths[instance.resource_id]
+
+        return sorted(new.values(), key=depth)
+
     @classmethod
     def path_upper(
         cls, object_id, limit_depth=1000000, db_session=None, *args, **kwargs
@@ -173,6 +222,16 @@ class ResourceTreeServicePostgreSQL(object):
         :param db_session:
         :return:
         """
+        db_session = get_db_session(db_session)
+        q = (
+            db_session.query(cls.model)
+            .from_statement(sa.text(cls._path_upper_sql()))
+            .params(resource_id=object_id, depth=limit_depth)
+        )
+        return q
+
+    @classmethod
+    def _path_upper_sql(cls):
         tablename = cls.model.__table__.name
         raw_q = """
             WITH RECURSIVE subtree AS (
@@ -187,13 +246,7 @@ class ResourceTreeServicePostgreSQL(object):
         """.format(
             tablename=tablename
         )
-        db_session = get_db_session(db_session)
-        q = (
-            db_session.query(cls.model)
-            .from_statement(sa.text(raw_q))
-            .params(resource_id=object_id, depth=limit_depth)
-        )
-        return q
+        return raw_q
 
     @classmethod
     def move_to_position(
@@ -247,19 +300,14 @@ class ResourceTreeServicePostgreSQL(object):
             order_range = list(sorted((resource.ordering, to_position)))
             move_down = resource.ordering > to_position
 
-            query = db_session.query(cls.model)
-            query = query.filter(cls.model.parent_id == parent_id)
-            query = query.filter(cls.model.ordering.between(*order_range))
+            statement = sa.update(cls.model)
+            statement = statement.where(cls.model.parent_id == parent_id)
+            statement = statement.where(cls.model.ordering.between(*order_range))
             if move_down:
-                query.update(
-                    {cls.model.ordering: cls.model.ordering + 1},
-                    synchronize_session=False,
-                )
+                statement = statement.values(ordering=cls.model.ordering + 1)
             else:
-                query.update(
-                    {cls.model.ordering: cls.model.ordering - 1},
-                    synchronize_session=False,
-                )
+                statement = statement.values(ordering=cls.model.ordering - 1)
+            db_session.execute(statement.execution_options(synchronize_session=False))
             db_session.flush()
             db_session.expire(resource)
             resource.ordering = to_position
@@ -287,12 +335,11 @@ class ResourceTreeServicePostgreSQL(object):
         :return:
         """
         db_session = get_db_session(db_session)
-        query = db_session.query(cls.model)
-        query = query.filter(cls.model.parent_id == parent_id)
-        query = query.filter(cls.model.ordering >= position)
-        query.update(
-            {cls.model.ordering: cls.model.ordering - 1}, synchronize_session=False
-        )
+        statement = sa.update(cls.model)
+        statement = statement.where(cls.model.parent_id == parent_id)
+        statement = statement.where(cls.model.ordering >= position)
+        statement = statement.values(ordering=cls.model.ordering - 1)
+        db_session.execute(statement.execution_options(synchronize_session=False))
         db_session.flush()
 
     @classmethod
@@ -307,12 +354,11 @@ class ResourceTreeServicePostgreSQL(object):
         :return:
         """
         db_session = get_db_session(db_session)
-        query = db_session.query(cls.model)
-        query = query.filter(cls.model.parent_id == parent_id)
-        query = query.filter(cls.model.ordering >= position)
-        query.update(
-            {cls.model.ordering: cls.model.ordering + 1}, synchronize_session=False
-        )
+        statement = sa.update(cls.model)
+        statement = statement.where(cls.model.parent_id == parent_id)
+        statement = statement.where(cls.model.ordering >= position)
+        statement = statement.values(ordering=cls.model.ordering + 1)
+        db_session.execute(statement.execution_options(synchronize_session=False))
         db_session.flush()
 
     @classmethod
@@ -375,9 +421,11 @@ class ResourceTreeServicePostgreSQL(object):
         :param db_session:
         :return:
         """
-        query = db_session.query(cls.model.resource_id)
-        query = query.filter(cls.model.parent_id == resource_id)
-        return query.count()
+        db_session = get_db_session(db_session)
+        statement = sa.select(sa.func.count(cls.model.resource_id)).where(
+            cls.model.parent_id == resource_id
+        )
+        return db_session.execute(statement).scalar()
 
     @classmethod
     def check_node_position(
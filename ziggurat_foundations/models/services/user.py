@@ -2,16 +2,21 @@
 from __future__ import unicode_literals
 
 import hashlib
+import itertools
+import secrets
+from datetime import datetime
 
 import six
 import sqlalchemy as sa
 
+from ziggurat_foundations.hashing import PasswordHasher
 from ziggurat_foundations.models.base import get_db_session
 from ziggurat_foundations.models.services import BaseService
 from ziggurat_foundations.permissions import (
     ALL_PERMISSIONS,
     ANY_PERMISSION,
     PermissionTuple,
+    PermissionIdTuple,
     resource_permissions_for_users,
 )
 from ziggurat_foundations.utils import generate_random_string
@@ -20,6 +25,12 @@ __all__ = ["UserService"]
 
 
 class UserService(BaseService):
+    _group_ids_key = "ziggurat_group_ids"
+    _dummy_hashes = {}
+    # bulk_create without hasher hashes fewer passwords inline instead of
+    # starting temporary process pool
+    bulk_create_inline_hashes = 32
+
     @classmethod
     def get(cls, user_id, db_session=None):
         """
@@ -31,41 +42,69 @@ class UserService(BaseService):
         :return:
         """
         db_session = get_db_session(db_session)
-        return db_session.query(cls.model).get(user_id)
+        return db_session.get(cls.model, user_id)
 
     @classmethod
-    def permissions(cls, instance, db_session=None):
+    def permissions(cls, instance, db_session=None, ids_only=False):
         """
         returns all non-resource permissions based on what groups user
             belongs and directly set ones for this user
 
         :param instance:
         :param db_session:
+        :param ids_only: return PermissionIdTuple objects instead of
+            PermissionTuple objects referencing ORM instances
         :return:
         """
         db_session = get_db_session(db_session, instance)
-        query = db_session.query(
+        rows = db_session.execute(cls._permissions_statement(instance.id)).all()
+        if ids_only:
+            return cls._permissions_from_rows(instance, rows, ids_only=True)
+        groups_dict = cls.groups_dict(
+            instance,
+            [row.owner_id for row in rows if row.type == "group"],
+            db_session=db_session,
+        )
+        return cls._permissions_from_rows(instance, rows, groups_dict=groups_dict)
+
+    @classmethod
+    def _permissions_statement(cls, user_id):
+        statement = sa.select(
             cls.models_proxy.GroupPermission.group_id.label("owner_id"),
             cls.models_proxy.GroupPermission.perm_name.label("perm_name"),
             sa.literal("group").label("type"),
         )
-        query = query.filter(
+        statement = statement.where(
             cls.models_proxy.GroupPermission.group_id
             == cls.models_proxy.UserGroup.group_id
         )
-        query = query.filter(
-            cls.models_proxy.User.id == cls.models_proxy.UserGroup.user_id
-        )
-        query = query.filter(cls.models_proxy.User.id == instance.id)
+        statement = statement.where(cls.models_proxy.UserGroup.user_id == user_id)
 
-        query2 = db_session.query(
+        statement2 = sa.select(
             cls.models_proxy.UserPermission.user_id.label("owner_id"),
             cls.models_proxy.UserPermission.perm_name.label("perm_name"),
             sa.literal("user").label("type"),
         )
-        query2 = query2.filter(cls.models_proxy.UserPermission.user_id == instance.id)
-        query = query.union(query2)
-        groups_dict = dict([(g.id, g) for g in instance.groups])
+        statement2 = statement2.where(
+            cls.models_proxy.UserPermission.user_id == user_id
+        )
+        return sa.union(statement, statement2)
+
+    @classmethod
+    def _permissions_from_rows(cls, instance, rows, groups_dict=None, ids_only=False):
+        if ids_only:
+            return [
+                PermissionIdTuple(
+                    instance.id,
+                    row.perm_name,
+                    row.type,
+                    row.owner_id if row.type == "group" else None,
+                    None,
+                    False,
+                    True,
+                )
+                for row in rows
+            ]
         return [
             PermissionTuple(
                 instance,
@@ -76,12 +115,136 @@ class UserService(BaseService):
                 False,
                 True,
             )
-            for row in query
+            for row in rows
+        ]
+
+    @classmethod
+    def group_ids(cls, instance, db_session=None):
+        """
+        returns frozenset of ids of groups user belongs to - if ``groups``
+            relationship is loaded it is used, otherwise ids are fetched from
+            users_groups table without loading group entities and cached on
+            instance state until user is expired or its memberships change
+
+        :param instance:
+        :param db_session:
+        :return: frozenset
+        """
+        state = sa.inspect(instance)
+        if "groups" in state.dict:
+            return frozenset([g.id for g in instance.groups])
+        group_ids = state.info.get(cls._group_ids_key)
+        if group_ids is None:
+            if instance.id is None:
+                return frozenset()
+            db_session = get_db_session(db_session, instance)
+            group_ids = cls.group_ids_by_user_id(instance.id, db_session=db_session)
+            state.info[cls._group_ids_key] = group_ids
+        return group_ids
+
+    @classmethod
+    def group_ids_by_user_id(cls, user_id, db_session=None):
+        """
+        returns frozenset of ids of groups user with given id belongs to,
+            fetched from users_groups table without touching users table
+
+        :param user_id:
+        :param db_session:
+        :return: frozenset
+        """
+        db_session = get_db_session(db_session)
+        statement = cls._cached_statement(
+            "group_ids", lambda: cls._group_ids_select(sa.bindparam("user_id"))
+        )
+        rows = db_session.execute(statement, {"user_id": user_id})
+        return frozenset([row.group_id for row in rows])
+
+    @classmethod
+    def reset_group_ids(cls, instance):
+        """
+        drops group ids cached by :meth:`group_ids`, needed only when
+            memberships are changed with plain SQL statements
+
+        :param instance:
+        """
+        sa.inspect(instance).info.pop(cls._group_ids_key, None)
+
+    @classmethod
+    def groups_dict(cls, instance, group_ids, db_session=None):
+        """
+        returns dictionary of {group_id: group} for passed ids of groups
+            user belongs to - uses loaded ``groups`` relationship if present,
+            otherwise only requested groups are fetched
+
+        :param instance:
+        :param group_ids:
+        :param db_session:
+        :return: dict
+        """
+        if "groups" in sa.inspect(instance).dict:
+            return dict([(g.id, g) for g in instance.groups])
+        group_ids = set(group_ids)
+        group_ids.discard(None)
+        if not group_ids:
+            return {}
+        db_session = get_db_session(db_session, instance)
+        statement = sa.select(cls.models_proxy.Group).where(
+            cls.models_proxy.Group.id.in_(list(group_ids))
+        )
+        return dict([(g.id, g) for g in db_session.execute(statement).scalars()])
+
+    @classmethod
+    def _group_ids_select(cls, user_id):
+        return sa.select(cls.models_proxy.UserGroup.group_id).where(
+            cls.models_proxy.UserGroup.user_id == user_id
+        )
+
+    @classmethod
+    def register_group_ids_listeners(cls):
+        """
+        attaches model event listeners that drop group ids cached by
+            :meth:`group_ids` whenever user is expired or its memberships
+            change, called by ``ziggurat_model_init``
+        """
+        listeners = [
+            (cls.models_proxy.User, "expire", cls._user_expired),
+            (cls.models_proxy.Group.users, "append", cls._membership_changed),
+            (cls.models_proxy.Group.users, "remove", cls._membership_changed),
+            (cls.models_proxy.UserGroup, "after_insert", cls._user_group_flushed),
+            (cls.models_proxy.UserGroup, "after_delete", cls._user_group_flushed),
         ]
+        for target, identifier, func in listeners:
+            if not sa.event.contains(target, identifier, func):
+                sa.event.listen(target, identifier, func)
+
+    @classmethod
+    def _user_expired(cls, target, attrs):
+        if attrs is None or "groups" in attrs:
+            cls.reset_group_ids(target)
+
+    @classmethod
+    def _membership_changed(cls, target, value, initiator):
+        cls.reset_group_ids(value)
+
+    @classmethod
+    def _user_group_flushed(cls, mapper, connection, target):
+        db_session = sa.orm.object_session(target)
+        if db_session is None:
+            return
+        key = sa.orm.util.identity_key(cls.models_proxy.User, target.user_id)
+        user = db_session.identity_map.get(key)
+        if user is not None:
+            cls.reset_group_ids(user)
 
     @classmethod
     def resources_with_perms(
-        cls, instance, perms, resource_ids=None, resource_types=None, db_session=None
+        cls,
+        instance,
+        perms,
+        resource_ids=None,
+        resource_types=None,
+        db_session=None,
+        use_effective_permissions=False,
     ):
         """
         returns all resources that user has perms for
@@ -92,39 +255,161 @@ class UserService(BaseService):
         :param resource_ids: restricts the search to specific resources
         :param resource_types:
         :param db_session:
+        :param use_effective_permissions: read from materialized
+            effective permissions table maintained by
+            EffectivePermissionService instead of permission tables
         :return:
         """
+        db_session = get_db_session(db_session, instance)
+        query = cls._resources_with_perms_query(
+            instance,
+            perms,
+            resource_ids,
+            resource_types,
+            db_session,
+            use_effective_permissions=use_effective_permissions,
+        )
+        query = query.order_by(cls.models_proxy.Resource.resource_name)
+        return query
+
+    @classmethod
+    def resources_with_perms_page(
+        cls,
+        instance,
+        perms,
+        limit=100,
+        after=None,
+        resource_ids=None,
+        resource_types=None,
+        db_session=None,
+        use_effective_permissions=False,
+    ):
+        """
+        returns single page of resources that user has perms for, ordered by
+            (resource_name, resource_id) - uses keyset pagination so every page
+            costs the same regardless of how deep it is
+
+        :param instance:
+        :param perms:
+        :param limit: maximum number of resources on the page
+        :param after: (resource_name, resource_id) tuple of last resource
+            from previous page, None for first page
+        :param resource_ids: restricts the search to specific resources
+        :param resource_types:
+        :param db_session:
+        :param use_effective_permissions:
+        :return: list of resources
+        """
+        db_session = get_db_session(db_session, instance)
+        criterion = None
+        if after is not None:
+            resource = cls.models_proxy.Resource
+            resource_name, resource_id = after
+            criterion = sa.or_(
+                resource.resource_name > resource_name,
+                sa.and_(
+                    resource.resource_name == resource_name,
+                    resource.resource_id > resource_id,
+                ),
+            )
+        query = cls._resources_with_perms_query(
+            instance,
+            perms,
+            resource_ids,
+            resource_types,
+            db_session,
+            criterion=criterion,
+            use_effective_permissions=use_effective_permissions,
+            limit=limit,
+        )
+        query = query.order_by(
+            cls.models_proxy.Resource.resource_name,
+            cls.models_proxy.Resource.resource_id,
+        )
+        return query.limit(limit).all()
+
+    @classmethod
+    def iter_resources_with_perms(
+        cls,
+        instance,
+        perms,
+        batch_size=1000,
+        resource_ids=None,
+        resource_types=None,
+        db_session=None,
+        use_effective_permissions=False,
+    ):
+        """
+        streams all resources that user has perms for, ordered by
+            (resource_name, resource_id), rows are fetched in batches with
+            ``yield_per`` so memory usage stays flat for large exports
+
+        :param instance:
+        :param perms:
+        :param batch_size: number of rows fetched at once
+        :param resource_ids: restricts the search to specific resources
+        :param resource_types:
+        :param db_session:
+        :param use_effective_permissions:
+        :return: iterator of resources
+        """
+        db_session = get_db_session(db_session, instance)
+        query = cls._resources_with_perms_query(
+            instance,
+            perms,
+            resource_ids,
+            resource_types,
+            db_session,
+            use_effective_permissions=use_effective_permissions,
+        )
+        query = query.order_by(
+            cls.models_proxy.Resource.resource_name,
+            cls.models_proxy.Resource.resource_id,
+        )
+        return iter(query.yield_per(batch_size))
+
+    @classmethod
+    def _resources_with_perms_query(
+        cls,
+        instance,
+        perms,
+        resource_ids,
+        resource_types,
+        db_session,
+        criterion=None,
+        use_effective_permissions=False,
+        limit=None,
+    ):
         # owned entities have ALL permissions so we return those resources too
         # even without explicit perms set
         # TODO: implement admin superrule perm - maybe return all apps
-        db_session = get_db_session(db_session, instance)
-        query = db_session.query(cls.models_proxy.Resource).distinct()
-        group_ids = [gr.id for gr in instance.groups]
-        # if user has some groups lets try to join based on their permissions
-        if group_ids:
-            join_conditions = (
-                cls.models_proxy.GroupResourcePermission.group_id.in_(group_ids),
-                cls.models_proxy.Resource.resource_id
-                == cls.models_proxy.GroupResourcePermission.resource_id,
-                cls.models_proxy.GroupResourcePermission.perm_name.in_(perms),
-            )
-            query = query.outerjoin(
-                (cls.models_proxy.GroupResourcePermission, sa.and_(*join_conditions))
+        if use_effective_permissions:
+            return cls._resources_with_effective_perms(
+                instance, perms, resource_ids, resource_types, db_session, criterion
             )
-            # ensure outerjoin permissions are correct -
-            # dont add empty rows from join
-            # conditions are - join ON possible group permissions
-            # OR owning group/user
-            query = query.filter(
-                sa.or_(
-                    cls.models_proxy.Resource.owner_user_id == instance.id,
-                    cls.models_proxy.Resource.owner_group_id.in_(group_ids),
-                    cls.models_proxy.GroupResourcePermission.perm_name != None,
-                )  # noqa
-            )
-        else:
-            # filter just by username
-            query = query.filter(cls.models_proxy.Resource.owner_user_id == instance.id)
+        query = db_session.query(cls.models_proxy.Resource).distinct()
+        group_ids = cls._group_ids_select(instance.id)
+        # join based on permissions of groups user belongs to
+        join_conditions = (
+            cls.models_proxy.GroupResourcePermission.group_id.in_(group_ids),
+            cls.models_proxy.Resource.resource_id
+            == cls.models_proxy.GroupResourcePermission.resource_id,
+            cls.models_proxy.GroupResourcePermission.perm_name.in_(perms),
+        )
+        query = query.outerjoin(
+            (cls.models_proxy.GroupResourcePermission, sa.and_(*join_conditions))
+        )
+        # ensure outerjoin permissions are correct -
+        # dont add empty rows from join
+        # conditions are - join ON possible group permissions
+        # OR owning group/user
+        query = query.filter(
+            sa.or_(
+                cls.models_proxy.Resource.owner_user_id == instance.id,
+                cls.models_proxy.Resource.owner_group_id.in_(group_ids),
+                cls.models_proxy.GroupResourcePermission.perm_name != None,
+            )  # noqa
+        )
         # lets try by custom user permissions for resource
         query2 = db_session.query(cls.models_proxy.Resource).distinct()
         query2 = query2.filter(
@@ -152,8 +437,55 @@ class UserService(BaseService):
             query2 = query2.filter(
                 cls.models_proxy.Resource.resource_type.in_(resource_types)
             )
-        query = query.union(query2)
-        query = query.order_by(cls.models_proxy.Resource.resource_name)
+        if criterion is not None:
+            query = query.filter(criterion)
+            query2 = query2.filter(criterion)
+        if limit is None:
+            return query.union(query2)
+        # every branch is cut to the page before union, so page reads at
+        # most limit rows of each branch from (resource_name, resource_id)
+        # index instead of sorting all remaining resources
+        candidates = sa.union(
+            cls._keyset_page_ids(query, limit), cls._keyset_page_ids(query2, limit)
+        ).subquery()
+        query = db_session.query(cls.models_proxy.Resource)
+        return query.filter(
+            cls.models_proxy.Resource.resource_id.in_(
+                sa.select(candidates.c.resource_id)
+            )
+        )
+
+    @classmethod
+    def _keyset_page_ids(cls, query, limit):
+        resource = cls.models_proxy.Resource
+        query = query.with_entities(resource.resource_id, resource.resource_name)
+        query = query.order_by(resource.resource_name, resource.resource_id)
+        return sa.select(query.limit(limit).subquery().c.resource_id)
+
+    @classmethod
+    def _resources_with_effective_perms(
+        cls, instance, perms, resource_ids, resource_types, db_session, criterion
+    ):
+        from ziggurat_foundations.models.services.effective_permission import (
+            EffectivePermissionService,
+        )
+
+        query = db_session.query(cls.models_proxy.Resource)
+        query = query.filter(
+            cls.models_proxy.Resource.resource_id.in_(
+                EffectivePermissionService.resource_ids_for_user(instance.id, perms)
+            )
+        )
+        if resource_ids:
+            query = query.filter(
+                cls.models_proxy.Resource.resource_id.in_(resource_ids)
+            )
+        if resource_types:
+            query = query.filter(
+                cls.models_proxy.Resource.resource_type.in_(resource_types)
+            )
+        if criterion is not None:
+            query = query.filter(criterion)
         return query
 
     @classmethod
@@ -166,7 +498,7 @@ class UserService(BaseService):
         :return:
         """
         return instance.groups_dynamic.options(
-            sa.orm.eagerload(cls.models_proxy.Group.resources)
+            sa.orm.joinedload(cls.models_proxy.Group.resources)
         )
 
     @classmethod
@@ -229,45 +561,274 @@ class UserService(BaseService):
         return "https://secure.gravatar.com/avatar/{}?{}".format(hash, params)
 
     @classmethod
-    def set_password(cls, instance, raw_password):
+    def set_password(cls, instance, raw_password, hasher=None):
         """
         sets new password on a user using password manager
 
         :param instance:
         :param raw_password:
+        :param hasher: optional PasswordHasher computing the hash in its
+            executor, calling thread waits for the result
         :return:
         """
-        # support API for both passlib 1.x and 2.x
-        hash_callable = getattr(
-            instance.passwordmanager, "hash", instance.passwordmanager.encrypt
-        )
-        password = hash_callable(raw_password)
-        if six.PY2:
-            instance.user_password = password.decode("utf8")
+        if hasher is not None:
+            password = hasher.hash_future(
+                instance.passwordmanager, raw_password
+            ).result()
         else:
-            instance.user_password = password
+            # support API for both passlib 1.x and 2.x
+            hash_callable = getattr(
+                instance.passwordmanager, "hash", instance.passwordmanager.encrypt
+            )
+            password = hash_callable(raw_password)
+        cls._store_password(instance, password)
+        cls.regenerate_security_code(instance)
+
+    @classmethod
+    async def set_password_async(cls, instance, raw_password, hasher):
+        """
+        sets new password on a user, hash is computed in executor of
+        passed PasswordHasher without blocking the event loop
+
+        :param instance:
+        :param raw_password:
+        :param hasher: PasswordHasher
+        :return:
+        """
+        password = await hasher.hash(instance.passwordmanager, raw_password)
+        cls._store_password(instance, password)
         cls.regenerate_security_code(instance)
 
     @classmethod
-    def check_password(cls, instance, raw_password, enable_hash_migration=True):
+    def check_password(
+        cls,
+        instance,
+        raw_password,
+        enable_hash_migration=True,
+        hasher=None,
+        migration_queue=None,
+    ):
         """
         checks string with users password hash using password manager
 
         :param instance:
         :param raw_password:
         :param enable_hash_migration: if legacy hashes should be migrated
+        :param hasher: optional PasswordHasher verifying the password in its
+            executor, calling thread waits for the result
+        :param migration_queue: optional HashMigrationQueue - legacy hashes
+            are queued for batched upgrade instead of being rehashed inline
+        :return:
+        """
+        defer_migration = enable_hash_migration and migration_queue is not None
+        if hasher is not None:
+            verified, replacement_hash = hasher.verify_future(
+                instance.passwordmanager,
+                raw_password,
+                instance.user_password,
+                update=not defer_migration,
+            ).result()
+        elif defer_migration:
+            verified = instance.passwordmanager.verify(
+                raw_password, instance.user_password
+            )
+            replacement_hash = None
+        else:
+            verified, replacement_hash = instance.passwordmanager.verify_and_update(
+                raw_password, instance.user_password
+            )
+        if defer_migration:
+            cls._queue_hash_migration(instance, raw_password, verified, migration_queue)
+        elif enable_hash_migration and replacement_hash:
+            cls._store_password(instance, replacement_hash)
+        return verified
+
+    @classmethod
+    async def check_password_async(
+        cls,
+        instance,
+        raw_password,
+        hasher,
+        enable_hash_migration=True,
+        migration_queue=None,
+    ):
+        """
+        checks string with users password hash, verification runs in
+        executor of passed PasswordHasher without blocking the event loop
+
+        :param instance:
+        :param raw_password:
+        :param hasher: PasswordHasher
+        :param enable_hash_migration: if legacy hashes should be migrated
+        :param migration_queue: optional HashMigrationQueue - legacy hashes
+            are queued for batched upgrade instead of being rehashed inline
         :return:
         """
-        verified, replacement_hash = instance.passwordmanager.verify_and_update(
-            raw_password, instance.user_password
+        defer_migration = enable_hash_migration and migration_queue is not None
+        verified, replacement_hash = await hasher.verify(
+            instance.passwordmanager,
+            raw_password,
+            instance.user_password,
+            update=not defer_migration,
         )
-        if enable_hash_migration and replacement_hash:
-            if six.PY2:
-                instance.user_password = replacement_hash.decode("utf8")
-            else:
-                instance.user_password = replacement_hash
+        if defer_migration:
+            cls._queue_hash_migration(instance, raw_password, verified, migration_queue)
+        elif enable_hash_migration and replacement_hash:
+            cls._store_password(instance, replacement_hash)
         return verified
 
+    @classmethod
+    def bulk_create(cls, rows, hasher=None, batch_size=1000, db_session=None):
+        """
+        creates many users at once - passwords are hashed in parallel,
+        security codes generated up front and rows inserted with executemany
+        INSERT statements of ``batch_size`` rows, no ORM objects are created
+
+        New ids are read with RETURNING on dialects supporting it with
+        executemany, otherwise with one query per batch selecting ids of
+        inserted emails.
+
+        :param rows: list of dicts with column values, raw password can be
+            passed under ``password`` key, all rows need the same keys
+            (``password`` may be missing in some of them)
+        :param hasher: PasswordHasher used to hash passwords, if not passed
+            up to ``bulk_create_inline_hashes`` passwords are hashed in
+            calling thread, more in temporary process pool hasher
+        :param batch_size: number of rows inserted by single statement
+        :param db_session:
+        :return: list of new user ids in order of rows
+        """
+        db_session = get_db_session(db_session)
+        rows = [dict(row) for row in rows]
+        passwords = [row.pop("password", None) for row in rows]
+        for i, row in enumerate(rows[1:], 1):
+            if row.keys() != rows[0].keys():
+                raise ValueError(
+                    "All rows need the same keys, row {} has {} instead of {}".format(
+                        i, sorted(row), sorted(rows[0])
+                    )
+                )
+        to_hash = [i for i, password in enumerate(passwords) if password is not None]
+        if to_hash:
+            own_hasher = hasher is None and len(to_hash) > cls.bulk_create_inline_hashes
+            if own_hasher:
+                hasher = PasswordHasher(use_processes=True)
+            try:
+                if hasher is not None:
+                    hashes = hasher.hash_many(
+                        cls.model.passwordmanager, [passwords[i] for i in to_hash]
+                    )
+                else:
+                    passwordmanager = cls.model.passwordmanager
+                    # support API for both passlib 1.x and 2.x
+                    hash_callable = getattr(
+                        passwordmanager, "hash", passwordmanager.encrypt
+                    )
+                    hashes = [hash_callable(passwords[i]) for i in to_hash]
+            finally:
+                if own_hasher:
+                    hasher.shutdown()
+            for i, password_hash in zip(to_hash, hashes):
+                rows[i]["user_password"] = password_hash
+
+        now = datetime.utcnow()
+        for row in rows:
+            if to_hash:
+                row.setdefault("user_password", None)
+            if "security_code" not in row:
+                row["security_code"] = cls.generate_random_string(64)
+                row.setdefault("security_code_date", now)
+
+        table = cls.model.__table__
+        dialect = db_session.get_bind(cls.model).dialect
+        returning = dialect.insert_executemany_returning
+        insert = table.insert()
+        if returning:
+            insert = insert.returning(table.c.id)
+        ids = []
+        remaining = iter(rows)
+        for batch in iter(lambda: list(itertools.islice(remaining, batch_size)), []):
+            result = db_session.execute(insert, batch)
+            if returning:
+                ids.extend(result.scalars().all())
+                continue
+            # email is required and unique so it maps rows back to new ids
+            emails = [row["email"] for row in batch]
+            statement = sa.select(table.c.email, table.c.id)
+            statement = statement.where(table.c.email.in_(emails))
+            ids_by_email = dict(db_session.execute(statement).all())
+            ids.extend(ids_by_email[email] for email in emails)
+        return ids
+
+    @classmethod
+    def dummy_check_password(cls, raw_password, hasher=None):
+        """
+        verifies password against hash of random password made with default
+        scheme of password manager, used when user was not found so failed
+        sign-ins cost the same as ones with wrong password
+
+        :param raw_password:
+        :param hasher: optional PasswordHasher verifying the password in its
+            executor, calling thread waits for the result
+        :return: always False
+        """
+        passwordmanager = cls.model.passwordmanager
+        dummy_hash = cls._dummy_hashes.get(passwordmanager)
+        if dummy_hash is None:
+            # support API for both passlib 1.x and 2.x
+            hash_callable = getattr(passwordmanager, "hash", passwordmanager.encrypt)
+            dummy_hash = hash_callable(secrets.token_hex(16))
+            cls._dummy_hashes[passwordmanager] = dummy_hash
+        if hasher is not None:
+            hasher.verify_future(
+                passwordmanager, raw_password, dummy_hash, update=False
+            ).result()
+        else:
+            passwordmanager.verify(raw_password, dummy_hash)
+        return False
+
+    @classmethod
+    def bulk_update_passwords(cls, rows, db_session=None):
+        """
+        updates password hashes of many users with single executemany
+        statement, rows where stored hash no longer matches the old hash
+        are left untouched
+
+        :param rows: iterable of (user_id, old_hash, new_hash) tuples
+        :param db_session:
+        :return:
+        """
+        db_session = get_db_session(db_session)
+        params = [
+            {"b_user_id": user_id, "b_old_hash": old_hash, "b_new_hash": new_hash}
+            for user_id, old_hash, new_hash in rows
+        ]
+        if not params:
+            return
+        statement = cls._cached_statement(
+            "bulk_update_passwords", cls._bulk_update_passwords_statement
+        )
+        db_session.execute(statement, params)
+
+    @classmethod
+    def _bulk_update_passwords_statement(cls):
+        table = cls.model.__table__
+        statement = table.update().where(table.c.id == sa.bindparam("b_user_id"))
+        statement = statement.where(table.c.user_password == sa.bindparam("b_old_hash"))
+        return statement.values(user_password=sa.bindparam("b_new_hash"))
+
+    @classmethod
+    def _queue_hash_migration(cls, instance, raw_password, verified, queue):
+        if verified and instance.passwordmanager.needs_update(instance.user_password):
+            queue.enqueue(instance, raw_password)
+
+    @classmethod
+    def _store_password(cls, instance, password):
+        if six.PY2:
+            instance.user_password = password.decode("utf8")
+        else:
+            instance.user_password = password
+
     @classmethod
     def generate_random_pass(cls, chars=7):
         """
@@ -307,10 +868,21 @@ class UserService(BaseService):
         :return:
         """
         db_session = get_db_session(db_session)
-        query = db_session.query(cls.model)
-        query = query.filter(cls.model.id == user_id)
-        query = query.options(sa.orm.eagerload("groups"))
-        return query.first()
+        statement = cls._cached_statement("by_id", cls._by_id_statement)
+        result = db_session.execute(statement, {"user_id": user_id})
+        return result.unique().scalars().first()
+
+    @classmethod
+    def _groups_loader(cls):
+        # groups is a backref of Group.users, so it exists on the model
+        # only after mappers are configured
+        sa.orm.configure_mappers()
+        return sa.orm.joinedload(cls.model.groups)
+
+    @classmethod
+    def _by_id_statement(cls):
+        statement = sa.select(cls.model).where(cls.model.id == sa.bindparam("user_id"))
+        return statement.options(cls._groups_loader())
 
     @classmethod
     def by_user_name(cls, user_name, db_session=None):
@@ -322,12 +894,16 @@ class UserService(BaseService):
         :return:
         """
         db_session = get_db_session(db_session)
-        query = db_session.query(cls.model)
-        query = query.filter(
-            sa.func.lower(cls.model.user_name) == (user_name or "").lower()
+        statement = cls._cached_statement("by_user_name", cls._by_user_name_statement)
+        result = db_session.execute(statement, {"user_name": (user_name or "").lower()})
+        return result.unique().scalars().first()
+
+    @classmethod
+    def _by_user_name_statement(cls):
+        statement = sa.select(cls.model).where(
+            sa.func.lower(cls.model.user_name) == sa.bindparam("user_name")
         )
-        query = query.options(sa.orm.eagerload("groups"))
-        return query.first()
+        return statement.options(cls._groups_loader())
 
     @classmethod
     def by_user_name_and_security_code(cls, user_name, security_code, db_session=None):
@@ -340,12 +916,11 @@ class UserService(BaseService):
         :return:
         """
         db_session = get_db_session(db_session)
-        query = db_session.query(cls.model)
-        query = query.filter(
+        statement = sa.select(cls.model).where(
             sa.func.lower(cls.model.user_name) == (user_name or "").lower()
         )
-        query = query.filter(cls.model.security_code == security_code)
-        return query.first()
+        statement = statement.where(cls.model.security_code == security_code)
+        return db_session.execute(statement).scalars().first()
 
     @classmethod
     def by_user_names(cls, user_names, db_session=None):
@@ -391,11 +966,41 @@ class UserService(BaseService):
         :return:
         """
         db_session = get_db_session(db_session)
-        query = db_session.query(cls.model).filter(
-            sa.func.lower(cls.model.email) == (email or "").lower()
+        statement = cls._cached_statement("by_email", cls._by_email_statement)
+        result = db_session.execute(statement, {"email": (email or "").lower()})
+        return result.unique().scalars().first()
+
+    @classmethod
+    def _by_email_statement(cls):
+        statement = sa.select(cls.model).where(
+            sa.func.lower(cls.model.email) == sa.bindparam("email")
+        )
+        return statement.options(cls._groups_loader())
+
+    @classmethod
+    def by_user_name_or_email(cls, login, db_session=None):
+        """
+        fetch user whose user name or email matches login in single query
+        without loading groups, user name match takes precedence
+
+        :param login: user name or email
+        :param db_session:
+        :return:
+        """
+        db_session = get_db_session(db_session)
+        statement = cls._cached_statement(
+            "by_user_name_or_email", cls._by_user_name_or_email_statement
         )
-        query = query.options(sa.orm.eagerload("groups"))
-        return query.first()
+        result = db_session.execute(statement, {"login": (login or "").lower()})
+        return result.scalars().first()
+
+    @classmethod
+    def _by_user_name_or_email_statement(cls):
+        user_name_match = sa.func.lower(cls.model.user_name) == sa.bindparam("login")
+        email_match = sa.func.lower(cls.model.email) == sa.bindparam("login")
+        statement = sa.select(cls.model).where(sa.or_(user_name_match, email_match))
+        statement = statement.order_by(sa.case((user_name_match, 0), else_=1))
+        return statement.limit(1)
 
     @classmethod
     def by_email_and_username(cls, email, user_name, db_session=None):
@@ -408,12 +1013,12 @@ class UserService(BaseService):
         :return:
         """
         db_session = get_db_session(db_session)
-        query = db_session.query(cls.model).filter(cls.model.email == email)
-        query = query.filter(
+        statement = sa.select(cls.model).where(cls.model.email == email)
+        statement = statement.where(
             sa.func.lower(cls.model.user_name) == (user_name or "").lower()
         )
-        query = query.options(sa.orm.eagerload("groups"))
-        return query.first()
+        statement = statement.options(cls._groups_loader())
+        return db_session.execute(statement).unique().scalars().first()
 
     @classmethod
     def users_for_perms(cls, perm_names, db_session=None):
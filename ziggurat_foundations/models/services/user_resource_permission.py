@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import sqlalchemy as sa
+
 from ziggurat_foundations.models.base import get_db_session
 from ziggurat_foundations.models.services import BaseService
+from ziggurat_foundations.models.services.resource import ResourceService
 
 __all__ = ["UserResourcePermissionService"]
 
@@ -21,7 +24,7 @@ class UserResourcePermissionService(BaseService):
         :return:
         """
         db_session = get_db_session(db_session)
-        return db_session.query(cls.model).get([user_id, resource_id, perm_name])
+        return db_session.get(cls.model, [user_id, resource_id, perm_name])
 
     @classmethod
     def by_resource_user_and_perm(
@@ -38,7 +41,63 @@ class UserResourcePermissionService(BaseService):
         """
         db_session = get_db_session(db_session)
 
-        query = db_session.query(cls.model).filter(cls.model.user_id == user_id)
-        query = query.filter(cls.model.resource_id == resource_id)
-        query = query.filter(cls.model.perm_name == perm_name)
-        return query.first()
+        statement = sa.select(cls.model).where(cls.model.user_id == user_id)
+        statement = statement.where(cls.model.resource_id == resource_id)
+        statement = statement.where(cls.model.perm_name == perm_name)
+        return db_session.execute(statement).scalars().first()
+
+    @classmethod
+    def grant(
+        cls, user_id, perm_name, resource_ids=None, resource_types=None, db_session=None
+    ):
+        """
+        grants permission to user on many resources with single
+        INSERT ... SELECT statement skipping already existing rows,
+        permission name is validated once per resource type
+
+        rows are written without ORM flush - session listeners are not
+        triggered, functions attached with
+        :meth:`ResourceService.register_permission_write_listener` are called
+        instead, already loaded permission collections are not refreshed
+
+        :param user_id:
+        :param perm_name:
+        :param resource_ids: list of resource ids, all resources if None
+        :param resource_types: limits grant to resources of these types
+        :param db_session:
+        :return: number of created permission rows
+        """
+        return ResourceService._grant(
+            cls.model,
+            "user_id",
+            user_id,
+            perm_name,
+            resource_ids=resource_ids,
+            resource_types=resource_types,
+            db_session=db_session,
+        )
+
+    @classmethod
+    def revoke(
+        cls, user_id, perm_name, resource_ids=None, resource_types=None, db_session=None
+    ):
+        """
+        revokes permission of user from many resources with single
+        DELETE statement, see :meth:`grant` for caveats
+
+        :param user_id:
+        :param perm_name:
+        :param resource_ids: list of resource ids, all resources if None
+        :param resource_types: limits revoke to resources of these types
+        :param db_session:
+        :return: number of deleted permission rows
+        """
+        return ResourceService._revoke(
+            cls.model,
+            "user_id",
+            user_id,
+            perm_name,
+            resource_ids=resource_ids,
+            resource_types=resource_types,
+            db_session=db_session,
+        )
@@ -34,6 +34,7 @@ class UserGroupMixin(BaseModel):
             sa.Integer,
             sa.ForeignKey("users.id", onupdate="CASCADE", ondelete="CASCADE"),
             primary_key=True,
+            index=True,
         )
 
     def __repr__(self):
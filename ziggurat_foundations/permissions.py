@@ -37,7 +37,11 @@ except ImportError as e:
 __all__ = [
     "ANY_PERMISSION_CLS",
     "ANY_PERMISSION",
+    "PermissionTuple",
+    "PermissionIdTuple",
+    "InheritedPermissionTuple",
     "resource_permissions_for_users",
+    "PermissionResolver",
     "permission_to_04_acls",
     "permission_to_pyramid_acls",
 ]
@@ -58,6 +62,17 @@ PermissionTuple = namedtuple(
     ["user", "perm_name", "type", "group", "resource", "owner", "allowed"],
 )
 
+# PermissionTuple annotated with tree depth permission was inherited from
+InheritedPermissionTuple = namedtuple(
+    "InheritedPermissionTuple", PermissionTuple._fields + ("depth",)
+)
+
+# lightweight counterpart of PermissionTuple holding only ids
+PermissionIdTuple = namedtuple(
+    "PermissionIdTuple",
+    ["user_id", "perm_name", "type", "group_id", "resource_id", "owner", "allowed"],
+)
+
 
 def resource_permissions_for_users(
     models_proxy,
@@ -70,6 +85,7 @@ def resource_permissions_for_users(
     skip_user_perms=False,
     skip_group_perms=False,
     db_session=None,
+    ids_only=False,
 ):
     """
     Returns permission tuples that match one of passed permission names
@@ -80,113 +96,422 @@ def resource_permissions_for_users(
     limit_group_permissions - should be used if we do not want to have
     user objects returned for group permissions, this might cause performance
     issues for big groups
+    ids_only - return PermissionIdTuple objects built from id columns instead
+    of PermissionTuple objects holding ORM instances
     """
     db_session = get_db_session(db_session)
-
-    # fetch groups and their permissions (possibly with users belonging
-    # to group if needed)
-    query = db_session.query(
-        models_proxy.GroupResourcePermission.perm_name,
-        models_proxy.User,
-        models_proxy.Group,
-        sa.literal("group").label("type"),
-        models_proxy.Resource,
+    return PermissionResolver.for_models_proxy(
+        models_proxy
+    ).resource_permissions_for_users(
+        perm_names,
+        resource_ids=resource_ids,
+        user_ids=user_ids,
+        group_ids=group_ids,
+        resource_types=resource_types,
+        limit_group_permissions=limit_group_permissions,
+        skip_user_perms=skip_user_perms,
+        skip_group_perms=skip_group_perms,
+        db_session=db_session,
+        ids_only=ids_only,
     )
 
-    query = query.join(
-        models_proxy.Group,
-        models_proxy.Group.id == models_proxy.GroupResourcePermission.group_id,
-    )
-    query = query.join(
-        models_proxy.Resource,
-        models_proxy.Resource.resource_id
-        == models_proxy.GroupResourcePermission.resource_id,
-    )
-    if limit_group_permissions:
-        query = query.outerjoin(models_proxy.User, models_proxy.User.id == None)  # noqa
-    else:
-        query = query.join(
-            models_proxy.UserGroup,
-            models_proxy.UserGroup.group_id
-            == models_proxy.GroupResourcePermission.group_id,
-        )
 
-        query = query.outerjoin(
-            models_proxy.User, models_proxy.User.id == models_proxy.UserGroup.user_id
-        )
-
-    if resource_ids:
-        query = query.filter(
-            models_proxy.GroupResourcePermission.resource_id.in_(resource_ids)
-        )
-    if resource_types:
-        query = query.filter(models_proxy.Resource.resource_type.in_(resource_types))
-
-    if perm_names not in ([ANY_PERMISSION], ANY_PERMISSION) and perm_names:
-        query = query.filter(
-            models_proxy.GroupResourcePermission.perm_name.in_(perm_names)
-        )
-    if group_ids:
-        query = query.filter(
-            models_proxy.GroupResourcePermission.group_id.in_(group_ids)
-        )
-
-    if user_ids and not limit_group_permissions:
-        query = query.filter(models_proxy.UserGroup.user_id.in_(user_ids))
-
-    # 2nd query that will fetch users with direct resource permissions
-    query2 = db_session.query(
-        models_proxy.UserResourcePermission.perm_name,
-        models_proxy.User,
-        models_proxy.Group,
-        sa.literal("user").label("type"),
-        models_proxy.Resource,
-    )
-    query2 = query2.join(
-        models_proxy.User,
-        models_proxy.User.id == models_proxy.UserResourcePermission.user_id,
-    )
-    query2 = query2.join(
-        models_proxy.Resource,
-        models_proxy.Resource.resource_id
-        == models_proxy.UserResourcePermission.resource_id,
-    )
+class PermissionResolver(object):
+    """
+    Resolves the same permission tuples as
+    :func:`resource_permissions_for_users` but builds the underlying
+    ``select()`` statements only once per filter combination - arguments
+    are passed as bound parameters, so repeated calls skip query
+    construction and hit sqlalchemy compiled statement cache.
+
+    Use :meth:`for_models_proxy` to obtain shared resolver for
+    ``models_proxy`` configuration.
+    """
 
-    # group needs to be present to work for union, but never actually matched
-    query2 = query2.outerjoin(models_proxy.Group, models_proxy.Group.id == None)  # noqa
-    if perm_names not in ([ANY_PERMISSION], ANY_PERMISSION) and perm_names:
-        query2 = query2.filter(
-            models_proxy.UserResourcePermission.perm_name.in_(perm_names)
+    _instances = {}
+
+    def __init__(self, models_proxy):
+        self.models_proxy = models_proxy
+        self._statements = {}
+
+    @classmethod
+    def for_models_proxy(cls, models_proxy):
+        """
+        returns resolver shared by all callers using this models_proxy
+
+        :param models_proxy:
+        :return: PermissionResolver
+        """
+        resolver = cls._instances.get(id(models_proxy))
+        if resolver is None or resolver.models_proxy is not models_proxy:
+            resolver = cls(models_proxy)
+            cls._instances[id(models_proxy)] = resolver
+        return resolver
+
+    def _group_statement(self, key):
+        (
+            filter_perms,
+            filter_resources,
+            filter_resource_types,
+            filter_groups,
+            filter_users,
+            limit_group_permissions,
+            ids_only,
+        ) = key
+        models_proxy = self.models_proxy
+        if ids_only:
+            if limit_group_permissions:
+                user_id = sa.null()
+            else:
+                user_id = models_proxy.UserGroup.user_id
+            statement = sa.select(
+                models_proxy.GroupResourcePermission.perm_name,
+                user_id.label("user_id"),
+                models_proxy.GroupResourcePermission.group_id.label("group_id"),
+                sa.literal("group").label("type"),
+                models_proxy.GroupResourcePermission.resource_id,
+            )
+            if filter_resource_types:
+                statement = statement.join(
+                    models_proxy.Resource,
+                    models_proxy.Resource.resource_id
+                    == models_proxy.GroupResourcePermission.resource_id,
+                )
+            if not limit_group_permissions:
+                statement = statement.join(
+                    models_proxy.UserGroup,
+                    models_proxy.UserGroup.group_id
+                    == models_proxy.GroupResourcePermission.group_id,
+                )
+        else:
+            statement = sa.select(
+                models_proxy.GroupResourcePermission.perm_name,
+                models_proxy.User,
+                models_proxy.Group,
+                sa.literal("group").label("type"),
+                models_proxy.Resource,
+            )
+            statement = statement.join(
+                models_proxy.Group,
+                models_proxy.Group.id == models_proxy.GroupResourcePermission.group_id,
+            )
+            statement = statement.join(
+                models_proxy.Resource,
+                models_proxy.Resource.resource_id
+                == models_proxy.GroupResourcePermission.resource_id,
+            )
+            if limit_group_permissions:
+                statement = statement.outerjoin(
+                    models_proxy.User, models_proxy.User.id == None  # noqa
+                )
+            else:
+                statement = statement.join(
+                    models_proxy.UserGroup,
+                    models_proxy.UserGroup.group_id
+                    == models_proxy.GroupResourcePermission.group_id,
+                )
+                statement = statement.outerjoin(
+                    models_proxy.User,
+                    models_proxy.User.id == models_proxy.UserGroup.user_id,
+                )
+        if filter_resources:
+            statement = statement.where(
+                models_proxy.GroupResourcePermission.resource_id.in_(
+                    sa.bindparam("resource_ids", expanding=True)
+                )
+            )
+        if filter_resource_types:
+            statement = statement.where(
+                models_proxy.Resource.resource_type.in_(
+                    sa.bindparam("resource_types", expanding=True)
+                )
+            )
+        if filter_perms:
+            statement = statement.where(
+                models_proxy.GroupResourcePermission.perm_name.in_(
+                    sa.bindparam("perm_names", expanding=True)
+                )
+            )
+        if filter_groups:
+            statement = statement.where(
+                models_proxy.GroupResourcePermission.group_id.in_(
+                    sa.bindparam("group_ids", expanding=True)
+                )
+            )
+        if filter_users and not limit_group_permissions:
+            statement = statement.where(
+                models_proxy.UserGroup.user_id.in_(
+                    sa.bindparam("user_ids", expanding=True)
+                )
+            )
+        return statement
+
+    def _user_statement(self, key):
+        (
+            filter_perms,
+            filter_resources,
+            filter_resource_types,
+            filter_groups,
+            filter_users,
+            limit_group_permissions,
+            ids_only,
+        ) = key
+        models_proxy = self.models_proxy
+        if ids_only:
+            statement = sa.select(
+                models_proxy.UserResourcePermission.perm_name,
+                models_proxy.UserResourcePermission.user_id.label("user_id"),
+                sa.null().label("group_id"),
+                sa.literal("user").label("type"),
+                models_proxy.UserResourcePermission.resource_id,
+            )
+            if filter_resource_types:
+                statement = statement.join(
+                    models_proxy.Resource,
+                    models_proxy.Resource.resource_id
+                    == models_proxy.UserResourcePermission.resource_id,
+                )
+        else:
+            statement = sa.select(
+                models_proxy.UserResourcePermission.perm_name,
+                models_proxy.User,
+                models_proxy.Group,
+                sa.literal("user").label("type"),
+                models_proxy.Resource,
+            )
+            statement = statement.join(
+                models_proxy.User,
+                models_proxy.User.id == models_proxy.UserResourcePermission.user_id,
+            )
+            statement = statement.join(
+                models_proxy.Resource,
+                models_proxy.Resource.resource_id
+                == models_proxy.UserResourcePermission.resource_id,
+            )
+            # group needs to be present to work for union,
+            # but never actually matched
+            statement = statement.outerjoin(
+                models_proxy.Group, models_proxy.Group.id == None  # noqa
+            )
+        if filter_perms:
+            statement = statement.where(
+                models_proxy.UserResourcePermission.perm_name.in_(
+                    sa.bindparam("perm_names", expanding=True)
+                )
+            )
+        if filter_resources:
+            statement = statement.where(
+                models_proxy.UserResourcePermission.resource_id.in_(
+                    sa.bindparam("resource_ids", expanding=True)
+                )
+            )
+        if filter_resource_types:
+            statement = statement.where(
+                models_proxy.Resource.resource_type.in_(
+                    sa.bindparam("resource_types", expanding=True)
+                )
+            )
+        if filter_users:
+            statement = statement.where(
+                models_proxy.UserResourcePermission.user_id.in_(
+                    sa.bindparam("user_ids", expanding=True)
+                )
+            )
+        return statement
+
+    def statement(
+        self,
+        filter_perms=False,
+        filter_resources=False,
+        filter_resource_types=False,
+        filter_groups=False,
+        filter_users=False,
+        limit_group_permissions=False,
+        skip_user_perms=False,
+        skip_group_perms=False,
+        ids_only=False,
+    ):
+        """
+        returns (cached) ORM statement for given combination of filters,
+        values for filters are passed as bound parameters named
+        ``perm_names``, ``resource_ids``, ``resource_types``,
+        ``group_ids`` and ``user_ids``, if ``ids_only`` is set the statement
+        selects ``perm_name``, ``user_id``, ``group_id``, ``type`` and
+        ``resource_id`` columns only
+
+        :return: select
+        """
+        key = (
+            bool(filter_perms),
+            bool(filter_resources),
+            bool(filter_resource_types),
+            bool(filter_groups),
+            bool(filter_users),
+            bool(limit_group_permissions),
+            bool(ids_only),
         )
-    if resource_ids:
-        query2 = query2.filter(
-            models_proxy.UserResourcePermission.resource_id.in_(resource_ids)
+        cache_key = key + (bool(skip_user_perms), bool(skip_group_perms))
+        statement = self._statements.get(cache_key)
+        if statement is not None:
+            return statement
+        if not skip_group_perms and not skip_user_perms:
+            compound = sa.union(self._group_statement(key), self._user_statement(key))
+        elif skip_group_perms:
+            compound = self._user_statement(key)
+        else:
+            compound = self._group_statement(key)
+        if ids_only:
+            self._statements[cache_key] = compound
+            return compound
+        models_proxy = self.models_proxy
+        statement = sa.select(
+            models_proxy.GroupResourcePermission.perm_name,
+            models_proxy.User,
+            models_proxy.Group,
+            sa.literal("group").label("type"),
+            models_proxy.Resource,
+        ).from_statement(compound)
+        self._statements[cache_key] = statement
+        return statement
+
+    def resource_permissions_for_users(
+        self,
+        perm_names,
+        resource_ids=None,
+        user_ids=None,
+        group_ids=None,
+        resource_types=None,
+        limit_group_permissions=False,
+        skip_user_perms=False,
+        skip_group_perms=False,
+        db_session=None,
+        ids_only=False,
+    ):
+        """
+        Returns permission tuples that match one of passed permission names,
+        accepts same arguments as :func:`resource_permissions_for_users`
+
+        :param perm_names:
+        :param resource_ids:
+        :param user_ids:
+        :param group_ids:
+        :param resource_types:
+        :param limit_group_permissions:
+        :param skip_user_perms:
+        :param skip_group_perms:
+        :param db_session:
+        :param ids_only:
+        :return:
+        """
+        db_session = get_db_session(db_session)
+        statement, params = self.prepare(
+            perm_names,
+            resource_ids=resource_ids,
+            user_ids=user_ids,
+            group_ids=group_ids,
+            resource_types=resource_types,
+            limit_group_permissions=limit_group_permissions,
+            skip_user_perms=skip_user_perms,
+            skip_group_perms=skip_group_perms,
+            ids_only=ids_only,
         )
-    if resource_types:
-        query2 = query2.filter(models_proxy.Resource.resource_type.in_(resource_types))
-    if user_ids:
-        query2 = query2.filter(
-            models_proxy.UserResourcePermission.user_id.in_(user_ids)
+        rows = db_session.execute(statement, params)
+        return self.permission_tuples(rows, ids_only=ids_only)
+
+    def prepare(
+        self,
+        perm_names,
+        resource_ids=None,
+        user_ids=None,
+        group_ids=None,
+        resource_types=None,
+        limit_group_permissions=False,
+        skip_user_perms=False,
+        skip_group_perms=False,
+        ids_only=False,
+    ):
+        """
+        returns (statement, params) pair for passed arguments, useful when
+        statement needs to be executed by something else than regular
+        session - for example ``AsyncSession``, rows can be converted with
+        :meth:`permission_tuples`
+
+        :return: (select, dict)
+        """
+        filter_perms = (
+            perm_names not in ([ANY_PERMISSION], ANY_PERMISSION) and perm_names
         )
-
-    if not skip_group_perms and not skip_user_perms:
-        query = query.union(query2)
-    elif skip_group_perms:
-        query = query2
-
-    users = [
-        PermissionTuple(
-            row.User,
-            row.perm_name,
-            row.type,
-            row.Group or None,
-            row.Resource,
-            False,
-            True,
+        statement = self.statement(
+            filter_perms=filter_perms,
+            filter_resources=resource_ids,
+            filter_resource_types=resource_types,
+            filter_groups=group_ids,
+            filter_users=user_ids,
+            limit_group_permissions=limit_group_permissions,
+            skip_user_perms=skip_user_perms,
+            skip_group_perms=skip_group_perms,
+            ids_only=ids_only,
         )
-        for row in query
-    ]
-    return users
+        params = {}
+        if filter_perms:
+            params["perm_names"] = list(perm_names)
+        if resource_ids:
+            params["resource_ids"] = list(resource_ids)
+        if resource_types:
+            params["resource_types"] = list(resource_types)
+        if group_ids:
+            params["group_ids"] = list(group_ids)
+        if user_ids:
+            params["user_ids"] = list(user_ids)
+        return statement, params
+
+    @staticmethod
+    def permission_tuples(rows, ids_only=False):
+        """
+        converts rows returned by statement from :meth:`prepare` into
+        permission tuples
+
+        :param rows:
+        :param ids_only:
+        :return: list of PermissionTuple or PermissionIdTuple
+        """
+        if ids_only:
+            return [
+                PermissionIdTuple(
+                    row.user_id,
+                    row.perm_name,
+                    row.type,
+                    row.group_id,
+                    row.resource_id,
+                    False,
+                    True,
+                )
+                for row in rows
+            ]
+        return [
+            PermissionTuple(
+                row.User,
+                row.perm_name,
+                row.type,
+                row.Group or None,
+                row.Resource,
+                False,
+                True,
+            )
+            for row in rows
+        ]
+
+
+def _permission_user_id(perm):
+    if isinstance(perm, PermissionIdTuple):
+        return perm.user_id
+    return perm.user.id
+
+
+def _permission_group_id(perm):
+    if isinstance(perm, PermissionIdTuple):
+        return perm.group_id
+    return perm.group.id
 
 
 def permission_to_04_acls(permissions):
@@ -198,22 +523,25 @@ def permission_to_04_acls(permissions):
     acls = []
     for perm in permissions:
         if perm.type == "user":
-            acls.append((perm.user.id, perm.perm_name))
+            acls.append((_permission_user_id(perm), perm.perm_name))
         elif perm.type == "group":
-            acls.append(("group:%s" % perm.group.id, perm.perm_name))
+            acls.append(("group:%s" % _permission_group_id(perm), perm.perm_name))
     return acls
 
 
 def permission_to_pyramid_acls(permissions):
     """
-    Returns a list of permissions in a format understood by pyramid
+    Returns a list of permissions in a format understood by pyramid,
+    accepts both PermissionTuple and PermissionIdTuple objects
     :param permissions:
     :return:
     """
     acls = []
     for perm in permissions:
         if perm.type == "user":
-            acls.append((Allow, perm.user.id, perm.perm_name))
+            acls.append((Allow, _permission_user_id(perm), perm.perm_name))
         elif perm.type == "group":
-            acls.append((Allow, "group:%s" % perm.group.id, perm.perm_name))
+            acls.append(
+                (Allow, "group:%s" % _permission_group_id(perm), perm.perm_name)
+            )
     return acls
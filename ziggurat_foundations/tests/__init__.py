@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 from __future__ import with_statement, unicode_literals
 
+import sqlalchemy as sa
+
 from ziggurat_foundations.tests.conftest import (
     User,
     Group,
@@ -13,6 +15,7 @@ from ziggurat_foundations.tests.conftest import (
     ResourceTestobjB,
 )
 from ziggurat_foundations.models.services.user import UserService
+from ziggurat_foundations.permissions import ANY_PERMISSION, PermissionTuple
 
 
 def check_one_in_other(first, second):
@@ -90,27 +93,149 @@ def add_group(db_session, group_name="group", description="desc"):
     return group
 
 
-def create_default_tree(db_session):
-    root = add_resource(db_session, -1, "root a", ordering=1)
-    res_a = add_resource(db_session, 1, "a", parent_id=root.resource_id, ordering=1)
-    add_resource(db_session, 5, "aa", parent_id=res_a.resource_id, ordering=1)
-    add_resource(db_session, 6, "ab", parent_id=res_a.resource_id, ordering=2)
-    res_ac = add_resource(db_session, 7, "ac", parent_id=res_a.resource_id, ordering=3)
-    res_aca = add_resource(
-        db_session, 9, "aca", parent_id=res_ac.resource_id, ordering=1
-    )
-    add_resource(db_session, 12, "acaa", parent_id=res_aca.resource_id, ordering=1)
-    add_resource(db_session, 8, "ad", parent_id=res_a.resource_id, ordering=4)
-    res_b = add_resource(db_session, 2, "b", parent_id=root.resource_id, ordering=2)
-    add_resource(db_session, 4, "ba", parent_id=res_b.resource_id, ordering=1)
-    add_resource(db_session, 3, "c", parent_id=root.resource_id, ordering=3)
-    add_resource(db_session, 10, "d", parent_id=root.resource_id, ordering=4)
-    add_resource(db_session, 11, "e", parent_id=root.resource_id, ordering=5)
-    root_b = add_resource(db_session, -2, "root b", ordering=2)
-    root_c = add_resource(db_session, -3, "root c", ordering=3)
+def create_default_tree(db_session, add=add_resource):
+    root = add(db_session, -1, "root a", ordering=1)
+    res_a = add(db_session, 1, "a", parent_id=root.resource_id, ordering=1)
+    add(db_session, 5, "aa", parent_id=res_a.resource_id, ordering=1)
+    add(db_session, 6, "ab", parent_id=res_a.resource_id, ordering=2)
+    res_ac = add(db_session, 7, "ac", parent_id=res_a.resource_id, ordering=3)
+    res_aca = add(db_session, 9, "aca", parent_id=res_ac.resource_id, ordering=1)
+    add(db_session, 12, "acaa", parent_id=res_aca.resource_id, ordering=1)
+    add(db_session, 8, "ad", parent_id=res_a.resource_id, ordering=4)
+    res_b = add(db_session, 2, "b", parent_id=root.resource_id, ordering=2)
+    add(db_session, 4, "ba", parent_id=res_b.resource_id, ordering=1)
+    add(db_session, 3, "c", parent_id=root.resource_id, ordering=3)
+    add(db_session, 10, "d", parent_id=root.resource_id, ordering=4)
+    add(db_session, 11, "e", parent_id=root.resource_id, ordering=5)
+    root_b = add(db_session, -2, "root b", ordering=2)
+    root_c = add(db_session, -3, "root c", ordering=3)
     return [root, root_b, root_c]
 
 
+def legacy_resource_permissions_for_users(
+    models_proxy,
+    perm_names,
+    resource_ids=None,
+    user_ids=None,
+    group_ids=None,
+    resource_types=None,
+    limit_group_permissions=False,
+    skip_user_perms=False,
+    skip_group_perms=False,
+    db_session=None,
+):
+    """
+    ``Query`` based implementation of
+    :func:`ziggurat_foundations.permissions.resource_permissions_for_users`
+    from before it was moved to PermissionResolver, kept as reference for
+    equivalence tests and benchmarks
+    """
+    # fetch groups and their permissions (possibly with users belonging
+    # to group if needed)
+    query = db_session.query(
+        models_proxy.GroupResourcePermission.perm_name,
+        models_proxy.User,
+        models_proxy.Group,
+        sa.literal("group").label("type"),
+        models_proxy.Resource,
+    )
+
+    query = query.join(
+        models_proxy.Group,
+        models_proxy.Group.id == models_proxy.GroupResourcePermission.group_id,
+    )
+    query = query.join(
+        models_proxy.Resource,
+        models_proxy.Resource.resource_id
+        == models_proxy.GroupResourcePermission.resource_id,
+    )
+    if limit_group_permissions:
+        query = query.outerjoin(models_proxy.User, models_proxy.User.id == None)  # noqa
+    else:
+        query = query.join(
+            models_proxy.UserGroup,
+            models_proxy.UserGroup.group_id
+            == models_proxy.GroupResourcePermission.group_id,
+        )
+
+        query = query.outerjoin(
+            models_proxy.User, models_proxy.User.id == models_proxy.UserGroup.user_id
+        )
+
+    if resource_ids:
+        query = query.filter(
+            models_proxy.GroupResourcePermission.resource_id.in_(resource_ids)
+        )
+    if resource_types:
+        query = query.filter(models_proxy.Resource.resource_type.in_(resource_types))
+
+    if perm_names not in ([ANY_PERMISSION], ANY_PERMISSION) and perm_names:
+        query = query.filter(
+            models_proxy.GroupResourcePermission.perm_name.in_(perm_names)
+        )
+    if group_ids:
+        query = query.filter(
+            models_proxy.GroupResourcePermission.group_id.in_(group_ids)
+        )
+
+    if user_ids and not limit_group_permissions:
+        query = query.filter(models_proxy.UserGroup.user_id.in_(user_ids))
+
+    # 2nd query that will fetch users with direct resource permissions
+    query2 = db_session.query(
+        models_proxy.UserResourcePermission.perm_name,
+        models_proxy.User,
+        models_proxy.Group,
+        sa.literal("user").label("type"),
+        models_proxy.Resource,
+    )
+    query2 = query2.join(
+        models_proxy.User,
+        models_proxy.User.id == models_proxy.UserResourcePermission.user_id,
+    )
+    query2 = query2.join(
+        models_proxy.Resource,
+        models_proxy.Resource.resource_id
+        == models_proxy.UserResourcePermission.resource_id,
+    )
+
+    # group needs to be present to work for union, but never actually matched
+    query2 = query2.outerjoin(models_proxy.Group, models_proxy.Group.id == None)  # noqa
+    if perm_names not in ([ANY_PERMISSION], ANY_PERMISSION) and perm_names:
+        query2 = query2.filter(
+            models_proxy.UserResourcePermission.perm_name.in_(perm_names)
+        )
+    if resource_ids:
+        query2 = query2.filter(
+            models_proxy.UserResourcePermission.resource_id.in_(resource_ids)
+        )
+    if resource_types:
+        query2 = query2.filter(models_proxy.Resource.resource_type.in_(resource_types))
+    if user_ids:
+        query2 = query2.filter(
+            models_proxy.UserResourcePermission.user_id.in_(user_ids)
+        )
+
+    if not skip_group_perms and not skip_user_perms:
+        query = query.union(query2)
+    elif skip_group_perms:
+        query = query2
+
+    users = [
+        PermissionTuple(
+            row.User,
+            row.perm_name,
+            row.type,
+            row.Group or None,
+            row.Resource,
+            False,
+            True,
+        )
+        for row in query
+    ]
+    return users
+
+
 class BaseTestCase(object):
     def set_up_user_group_and_perms(self, db_session):
         """
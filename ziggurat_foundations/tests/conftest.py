@@ -11,6 +11,7 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 from ziggurat_foundations import ziggurat_model_init
+from ziggurat_foundations.models.effective_permission import EffectivePermissionMixin
 from ziggurat_foundations.models.external_identity import ExternalIdentityMixin
 from ziggurat_foundations.models.group import GroupMixin
 from ziggurat_foundations.models.group_permission import GroupPermissionMixin
@@ -18,6 +19,7 @@ from ziggurat_foundations.models.group_resource_permission import (
     GroupResourcePermissionMixin,
 )
 from ziggurat_foundations.models.resource import ResourceMixin
+from ziggurat_foundations.models.resource_closure import ResourceClosureMixin
 from ziggurat_foundations.models.user import UserMixin
 from ziggurat_foundations.models.user_group import UserGroupMixin
 from ziggurat_foundations.models.user_permission import UserPermissionMixin
@@ -84,6 +86,14 @@ class ExternalIdentity(ExternalIdentityMixin, Base):
     pass
 
 
+class EffectivePermission(EffectivePermissionMixin, Base):
+    pass
+
+
+class ResourceClosure(ResourceClosureMixin, Base):
+    pass
+
+
 class User(UserMixin, Base):
     __possible_permissions__ = ["root", "alter_users", "custom1"]
 
@@ -98,6 +108,8 @@ ziggurat_model_init(
     GroupResourcePermission,
     Resource,
     ExternalIdentity,
+    EffectivePermission,
+    ResourceClosure,
 )
 
 
@@ -133,6 +145,22 @@ def db_session(request):
     return session
 
 
+@pytest.fixture
+def maintained_session(request, db_session):
+    """
+    session with listeners of ``maintained_service`` from test module
+    registered for duration of the test
+    """
+    service = request.module.maintained_service
+    service.register(db_session)
+    yield db_session
+    service.unregister(db_session)
+
+
+def child_ids(tree_struct):
+    return [n["node"].resource_id for n in tree_struct["children"].values()]
+
+
 @pytest.fixture
 def db_session2(request):
     sql_str = os.environ.get("DB_STRING2", "sqlite://")
@@ -173,12 +201,16 @@ def pyramid_app(request, db_session):
     from pyramid.config import Configurator
     from ziggurat_foundations.ext.pyramid.sign_in import ZigguratSignInSuccess
     from ziggurat_foundations.ext.pyramid.sign_in import ZigguratSignInBadAuth
+    from ziggurat_foundations.ext.pyramid.sign_in import ZigguratSignInThrottled
     from ziggurat_foundations.ext.pyramid.sign_in import ZigguratSignOut
+    from ziggurat_foundations.models import group_ids_finder
 
-    auth_policy = AuthTktAuthenticationPolicy("secret")
+    auth_policy = AuthTktAuthenticationPolicy("secret", callback=group_ids_finder)
     authorization_policy = ACLAuthorizationPolicy()
 
     settings = {"ziggurat_foundations.session_provider_callable": lambda x: db_session}
+    # extra settings can be passed with indirect parametrization
+    settings.update(getattr(request, "param", {}))
 
     config = Configurator(
         settings=settings,
@@ -202,15 +234,27 @@ def pyramid_app(request, db_session):
     def bad_auth(req):
         return {"view": "bad_auth"}
 
+    def throttled(req):
+        return {"view": "throttled"}
+
     def index(req):
         username = None
         if req.user:
             username = req.user.user_name
         return {"view": "index", "username": username}
 
+    def principals(req):
+        return {
+            "principals": [str(p) for p in req.effective_principals],
+            "user_loaded": "user" in req.__dict__,
+        }
+
     config.add_view(sign_in, context=ZigguratSignInSuccess, renderer="json")
     config.add_view(sign_out, context=ZigguratSignOut, renderer="json")
     config.add_view(bad_auth, context=ZigguratSignInBadAuth, renderer="json")
+    config.add_view(throttled, context=ZigguratSignInThrottled, renderer="json")
     config.add_route("/", "/")
     config.add_view(index, route_name="/", renderer="json")
+    config.add_route("/principals", "/principals")
+    config.add_view(principals, route_name="/principals", renderer="json")
     return TestApp(config.make_wsgi_app())
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+from __future__ import with_statement, unicode_literals
+
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from ziggurat_foundations.models.services.aio.group import AsyncGroupService
+from ziggurat_foundations.models.services.aio.resource import AsyncResourceService
+from ziggurat_foundations.models.services.aio.user import AsyncUserService
+from ziggurat_foundations.models.services.resource import ResourceService
+from ziggurat_foundations.models.services.user import UserService
+from ziggurat_foundations.permissions import ANY_PERMISSION
+from ziggurat_foundations.tests import BaseTestCase
+from ziggurat_foundations.tests.conftest import Base
+
+pytest.importorskip("aiosqlite")
+
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine  # noqa
+
+
+@pytest.fixture
+def aio_session_factory(tmp_path):
+    path = tmp_path.joinpath("aio.sqlite")
+    engine = create_engine("sqlite:///%s" % path)
+    Base.metadata.create_all(engine)
+    async_engine = create_async_engine(
+        "sqlite+aiosqlite:///%s" % path, poolclass=NullPool
+    )
+    db_session = sessionmaker(bind=engine)()
+
+    def async_session():
+        return AsyncSession(async_engine, expire_on_commit=False)
+
+    yield db_session, async_session
+    db_session.close()
+    engine.dispose()
+
+
+def perm_key(perm):
+    return (
+        perm.user.id if perm.user else None,
+        str(perm.perm_name),
+        perm.type,
+        perm.group.id if perm.group else None,
+        perm.resource.resource_id if perm.resource else None,
+        perm.owner,
+    )
+
+
+class TestAsyncServices(BaseTestCase):
+    def set_up(self, db_session):
+        self.set_up_user_group_and_perms(db_session)
+        self.resource2.owner_user_id = self.user.id
+        self.resource.owner_group_id = self.group2.id
+        db_session.commit()
+
+    def test_lookups(self, aio_session_factory):
+        db_session, async_session = aio_session_factory
+        self.set_up(db_session)
+
+        async def lookups():
+            async with async_session() as session:
+                user = await AsyncUserService.get(self.user.id, db_session=session)
+                by_name = await AsyncUserService.by_user_name(
+                    "FIRST_USER", db_session=session
+                )
+                by_email = await AsyncUserService.by_email(
+                    "new_email2", db_session=session
+                )
+                by_names = await AsyncUserService.by_user_names(
+                    ["foouser", "bazuser"], db_session=session
+                )
+                group = await AsyncGroupService.by_group_name(
+                    "group2", db_session=session
+                )
+                members = await AsyncGroupService.users(group)
+                resource = await AsyncResourceService.by_resource_id(
+                    "2", db_session=session
+                )
+                return (
+                    user.user_name,
+                    by_name.id,
+                    by_email.user_name,
+                    sorted(u.user_name for u in by_names),
+                    [u.user_name for u in members],
+                    resource.resource_name,
+                )
+
+        assert asyncio.run(lookups()) == (
+            "first_user",
+            self.user.id,
+            "baruser",
+            ["bazuser", "foouser"],
+            ["bazuser"],
+            "other_resource",
+        )
+
+    def test_user_permissions(self, aio_session_factory):
+        db_session, async_session = aio_session_factory
+        self.set_up(db_session)
+
+        async def permissions():
+            async with async_session() as session:
+                user = await AsyncUserService.get(self.user.id, db_session=session)
+                perms = await AsyncUserService.permissions(user)
+                ids = await AsyncUserService.permissions(user, ids_only=True)
+                return [perm_key(p) for p in perms], ids
+
+        perms, ids = asyncio.run(permissions())
+        assert sorted(perms) == sorted(
+            perm_key(p) for p in UserService.permissions(self.user)
+        )
+        assert sorted(ids) == sorted(UserService.permissions(self.user, ids_only=True))
+
+    def test_perms_for_user(self, aio_session_factory):
+        db_session, async_session = aio_session_factory
+        self.set_up(db_session)
+        users = [self.user, self.user2, self.user3, self.user4]
+        resources = [self.resource, self.resource2]
+
+        async def perms_for_users():
+            found = []
+            async with async_session() as session:
+                for resource in resources:
+                    resource = await AsyncResourceService.get(
+                        resource.resource_id, db_session=session
+                    )
+                    for user in users:
+                        user = await AsyncUserService.get(user.id, db_session=session)
+                        perms = await AsyncResourceService.perms_for_user(
+                            resource, user
+                        )
+                        ids = await AsyncResourceService.perms_for_user(
+                            resource, user, ids_only=True
+                        )
+                        found.append((sorted(perm_key(p) for p in perms), ids))
+            return found
+
+        expected = []
+        for resource in resources:
+            for user in users:
+                perms = ResourceService.perms_for_user(resource, user)
+                ids = ResourceService.perms_for_user(resource, user, ids_only=True)
+                expected.append((sorted(perm_key(p) for p in perms), ids))
+        assert asyncio.run(perms_for_users()) == expected
+
+    def test_resource_permission_helpers(self, aio_session_factory):
+        db_session, async_session = aio_session_factory
+        self.set_up(db_session)
+
+        async def helpers():
+            async with async_session() as session:
+                resource = await AsyncResourceService.get(1, db_session=session)
+                user = await AsyncUserService.get(self.user4.id, db_session=session)
+                return (
+                    [
+                        perm_key(p)
+                        for p in await AsyncResourceService.direct_perms_for_user(
+                            resource, user
+                        )
+                    ],
+                    [
+                        perm_key(p)
+                        for p in await AsyncResourceService.group_perms_for_user(
+                            resource, user
+                        )
+                    ],
+                    [
+                        perm_key(p)
+                        for p in await AsyncResourceService.users_for_perm(
+                            resource, "group_perm"
+                        )
+                    ],
+                )
+
+        direct, group, users = asyncio.run(helpers())
+        assert direct == [
+            perm_key(p)
+            for p in ResourceService.direct_perms_for_user(self.resource, self.user4)
+        ]
+        assert sorted(group) == sorted(
+            perm_key(p)
+            for p in ResourceService.group_perms_for_user(self.resource, self.user4)
+        )
+        assert sorted(users) == sorted(
+            perm_key(p)
+            for p in ResourceService.users_for_perm(self.resource, "group_perm")
+        )
+
+    def test_resources_with_perms(self, aio_session_factory):
+        db_session, async_session = aio_session_factory
+        self.set_up(db_session)
+
+        async def resources_with_perms(user_id, perms):
+            async with async_session() as session:
+                user = await AsyncUserService.get(user_id, db_session=session)
+                resources = await AsyncUserService.resources_with_perms(user, perms)
+                return [r.resource_id for r in resources]
+
+        for user in [self.user, self.user2, self.user4]:
+            for perms in (["foo_perm"], ["group_perm"], ["test_perm"]):
+                expected = UserService.resources_with_perms(user, perms).all()
+                assert asyncio.run(resources_with_perms(user.id, perms)) == [
+                    r.resource_id for r in expected
+                ]
+
+    def test_concurrent_has_permission(self, aio_session_factory):
+        db_session, async_session = aio_session_factory
+        self.set_up(db_session)
+        checks = [
+            (1, self.user.id, "foo_perm"),
+            (1, self.user2.id, "foo_perm"),
+            (2, self.user2.id, "foo_perm"),
+            (2, self.user.id, "anything"),
+            (1, self.user4.id, "anything"),
+            (2, self.user4.id, ANY_PERMISSION),
+        ]
+
+        async def check(resource_id, user_id, perm_name):
+            async with async_session() as session:
+                return await AsyncResourceService.has_permission(
+                    resource_id, user_id, perm_name, db_session=session
+                )
+
+        async def check_all():
+            return await asyncio.gather(*[check(*args) for args in checks])
+
+        assert asyncio.run(check_all()) == [True, False, True, True, True, False]
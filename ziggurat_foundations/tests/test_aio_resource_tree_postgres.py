@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+from __future__ import with_statement, unicode_literals
+
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from ziggurat_foundations.exc import (
+    ZigguratResourceOutOfBoundaryException,
+    ZigguratResourceTreeMissingException,
+    ZigguratResourceTreePathException,
+)
+from ziggurat_foundations.models.services.aio.resource_tree_postgres import (
+    AsyncResourceTreeServicePostgreSQL,
+)
+from ziggurat_foundations.tests import BaseTestCase, create_default_tree
+from ziggurat_foundations.tests.conftest import Base, not_postgres
+
+tree_service = AsyncResourceTreeServicePostgreSQL
+
+
+@pytest.fixture
+def aio_tree_session(request, tmp_path):
+    """
+    Creates default tree with sync session and returns factory of async
+    sessions connected to the same database
+    """
+    if not_postgres:
+        pytest.importorskip("aiosqlite")
+        path = tmp_path.joinpath("aio_tree.sqlite")
+        engine = create_engine("sqlite:///%s" % path)
+        Base.metadata.create_all(engine)
+        db_session = sessionmaker(bind=engine)()
+        request.addfinalizer(engine.dispose)
+        url = "sqlite+aiosqlite:///%s" % path
+    else:
+        pytest.importorskip("asyncpg")
+        db_session = request.getfixturevalue("db_session")
+        url = db_session.bind.url.set(drivername="postgresql+asyncpg")
+    create_default_tree(db_session)
+    db_session.commit()
+    db_session.close()
+    async_engine = create_async_engine(url, poolclass=NullPool)
+
+    def run(coroutine_fn):
+        async def wrapper():
+            async with AsyncSession(async_engine) as session:
+                return await coroutine_fn(session)
+
+        return asyncio.run(wrapper())
+
+    return run
+
+
+async def subtree_ids(session, resource_id=None, limit_depth=1000000):
+    if resource_id is None:
+        rows = await tree_service.from_parent_deeper(
+            None, limit_depth=limit_depth, db_session=session
+        )
+    else:
+        rows = await tree_service.from_resource_deeper(
+            resource_id, limit_depth=limit_depth, db_session=session
+        )
+    return [(r.Resource.resource_id, r.Resource.ordering) for r in rows]
+
+
+class TestAsyncResourceTree(BaseTestCase):
+    def test_count_children(self, aio_tree_session):
+        async def count(session):
+            return [
+                await tree_service.count_children(i, db_session=session)
+                for i in (-1, 1, 7, 12)
+            ]
+
+        assert aio_tree_session(count) == [5, 4, 1, 0]
+
+    @pytest.mark.parametrize(
+        "position, on_same_branch", [(0, True), (6, True), (7, False)]
+    )
+    def test_check_node_position(self, aio_tree_session, position, on_same_branch):
+        async def check(session):
+            await tree_service.check_node_position(
+                -1, position, on_same_branch=on_same_branch, db_session=session
+            )
+
+        with pytest.raises(ZigguratResourceOutOfBoundaryException):
+            aio_tree_session(check)
+
+    @pytest.mark.skipif(not_postgres, reason="requires postgres")
+    def test_root_nesting(self, aio_tree_session):
+        async def nesting(session):
+            rows = await tree_service.from_resource_deeper(-1, db_session=session)
+            return tree_service.build_subtree_strut(rows)
+
+        tree_struct = aio_tree_session(nesting)["children"][-1]
+        assert tree_struct["node"].resource_id == -1
+        assert list(tree_struct["children"].keys()) == [1, 2, 3, 10, 11]
+        a_node = tree_struct["children"][1]
+        assert list(a_node["children"].keys()) == [5, 6, 7, 8]
+        assert list(a_node["children"][7]["children"].keys()) == [9]
+        assert list(tree_struct["children"][2]["children"].keys()) == [4]
+
+    @pytest.mark.skipif(not_postgres, reason="requires postgres")
+    def test_full_nesting(self, aio_tree_session):
+        async def nesting(session):
+            rows = await tree_service.from_parent_deeper(db_session=session)
+            return tree_service.build_subtree_strut(rows)
+
+        tree_struct = aio_tree_session(nesting)
+        assert list(tree_struct["children"].keys()) == [-1, -2, -3]
+        l1_nodes = tree_struct["children"][-1]["children"]
+        assert list(l1_nodes.keys()) == [1, 2, 3, 10, 11]
+
+    @pytest.mark.skipif(not_postgres, reason="requires postgres")
+    def test_branch_data_with_limit(self, aio_tree_session):
+        async def branch(session):
+            return await subtree_ids(session, 1, limit_depth=2)
+
+        assert aio_tree_session(branch) == [(1, 1), (5, 1), (6, 2), (7, 3), (8, 4)]
+
+    @pytest.mark.skipif(not_postgres, reason="requires postgres")
+    def test_branch_data_with_limit_from_parent(self, aio_tree_session):
+        async def branch(session):
+            rows = await tree_service.from_parent_deeper(
+                1, limit_depth=2, db_session=session
+            )
+            return [r.Resource.resource_id for r in rows]
+
+        assert aio_tree_session(branch) == [5, 6, 7, 9, 8]
+
+    @pytest.mark.skipif(not_postgres, reason="requires postgres")
+    def test_going_up_hierarchy(self, aio_tree_session):
+        async def path(session):
+            result = await tree_service.path_upper(9, db_session=session)
+            return [r.resource_id for r in result]
+
+        assert aio_tree_session(path) == [9, 7, 1, -1]
+
+    @pytest.mark.skipif(not_postgres, reason="requires postgres")
+    @pytest.mark.parametrize(
+        "resource_id, to_position, expected",
+        [
+            (3, 2, [(1, 1), (3, 2), (2, 3), (10, 4), (11, 5)]),
+            (3, 1, [(3, 1), (1, 2), (2, 3), (10, 4), (11, 5)]),
+            (1, 3, [(2, 1), (3, 2), (1, 3), (10, 4), (11, 5)]),
+            (1, 5, [(2, 1), (3, 2), (10, 3), (11, 4), (1, 5)]),
+            (1, 1, [(1, 1), (2, 2), (3, 3), (10, 4), (11, 5)]),
+        ],
+    )
+    def test_move_on_same_branch(
+        self, aio_tree_session, resource_id, to_position, expected
+    ):
+        async def move(session):
+            await tree_service.move_to_position(
+                resource_id, to_position, db_session=session
+            )
+            ids = await subtree_ids(session, -1, limit_depth=2)
+            return ids[1:]
+
+        assert aio_tree_session(move) == expected
+
+    @pytest.mark.skipif(not_postgres, reason="requires postgres")
+    def test_move_on_different_branch_with_siblings(self, aio_tree_session):
+        async def move(session):
+            await tree_service.move_to_position(
+                6, new_parent_id=-1, to_position=1, db_session=session
+            )
+            return (
+                await subtree_ids(session, -1, limit_depth=2),
+                await subtree_ids(session, 1, limit_depth=2),
+            )
+
+        root_ids, a_ids = aio_tree_session(move)
+        assert [i for i, _ in root_ids] == [-1, 6, 1, 2, 3, 10, 11]
+        assert a_ids == [(1, 2), (5, 1), (7, 2), (8, 3)]
+
+    @pytest.mark.skipif(not_postgres, reason="requires postgres")
+    def test_move_from_root_deeper(self, aio_tree_session):
+        async def move(session):
+            await tree_service.move_to_position(
+                -2, new_parent_id=1, to_position=1, db_session=session
+            )
+            return (
+                await subtree_ids(session, limit_depth=1),
+                await subtree_ids(session, 1, limit_depth=2),
+            )
+
+        root_ids, a_ids = aio_tree_session(move)
+        assert root_ids == [(-1, 1), (-3, 2)]
+        assert [i for i, _ in a_ids] == [1, -2, 5, 6, 7, 8]
+
+    @pytest.mark.skipif(not_postgres, reason="requires postgres")
+    @pytest.mark.parametrize(
+        "resource_id, to_position, new_parent_id, exc",
+        [
+            (3, 0, None, ZigguratResourceOutOfBoundaryException),
+            (4, 7, -1, ZigguratResourceOutOfBoundaryException),
+            (1, 1, 6, ZigguratResourceTreePathException),
+            (1, 1, -6, ZigguratResourceTreeMissingException),
+        ],
+    )
+    def test_move_errors(
+        self, aio_tree_session, resource_id, to_position, new_parent_id, exc
+    ):
+        kwargs = {}
+        if new_parent_id is not None:
+            kwargs["new_parent_id"] = new_parent_id
+
+        async def move(session):
+            await tree_service.move_to_position(
+                resource_id, to_position, db_session=session, **kwargs
+            )
+
+        with pytest.raises(exc):
+            aio_tree_session(move)
+
+    @pytest.mark.skipif(not_postgres, reason="requires postgres")
+    @pytest.mark.parametrize(
+        "resource_id, expected_ids, expected_order",
+        [
+            (1, [-1, 2, 4, 3, 10, 11, -2, -3], None),
+            (9, [-1, 1, 5, 6, 7, 8, 2, 4, 3, 10, 11, -2, -3], None),
+            (12, [-1, 1, 5, 6, 7, 9, 8, 2, 4, 3, 10, 11, -2, -3], None),
+            (-1, [-2, -3], [1, 2]),
+        ],
+    )
+    def test_delete_branches(
+        self, aio_tree_session, resource_id, expected_ids, expected_order
+    ):
+        async def delete(session):
+            await tree_service.delete_branch(resource_id, db_session=session)
+            return await subtree_ids(session)
+
+        result = aio_tree_session(delete)
+        assert [i for i, _ in result] == expected_ids
+        if expected_order:
+            assert [o for _, o in result] == expected_order
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+from __future__ import with_statement, unicode_literals
+
+import mock
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from ziggurat_foundations.cache import MemoryCacheBackend, PermissionCache, UserCache
+from ziggurat_foundations.models.services.group_resource_permission import (
+    GroupResourcePermissionService,
+)
+from ziggurat_foundations.models.services.resource import ResourceService
+from ziggurat_foundations.models.services.user import UserService
+from ziggurat_foundations.permissions import ANY_PERMISSION, PermissionIdTuple
+from ziggurat_foundations.tests import BaseTestCase, add_group, add_user
+from ziggurat_foundations.tests.conftest import (
+    Base,
+    GroupPermission,
+    GroupResourcePermission,
+    User,
+    UserGroup,
+    UserResourcePermission,
+)
+
+
+class FakeTimer(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestMemoryCacheBackend(object):
+    def test_lru_eviction(self):
+        backend = MemoryCacheBackend(max_size=2)
+        backend.set("a", 1)
+        backend.set("b", 2)
+        assert backend.get("a") == 1
+        backend.set("c", 3)
+        assert backend.get("b") is None
+        assert backend.get("a") == 1
+        assert backend.get("c") == 3
+        assert len(backend) == 2
+
+    def test_ttl(self):
+        timer = FakeTimer()
+        backend = MemoryCacheBackend(ttl=10, timer=timer)
+        backend.set("a", 1)
+        timer.now = 9
+        assert backend.get("a") == 1
+        timer.now = 10
+        assert backend.get("a") is None
+
+    def test_counters_survive_clear(self):
+        backend = MemoryCacheBackend(max_size=1)
+        assert backend.counter("gen") == 0
+        assert backend.incr("gen") == 1
+        backend.set("a", 1)
+        backend.set("b", 2)
+        backend.clear()
+        assert backend.counter("gen") == 1
+
+
+@pytest.fixture
+def permission_cache(db_session):
+    cache = PermissionCache()
+    cache.register(db_session)
+    yield cache
+    cache.unregister(db_session)
+
+
+@pytest.fixture
+def session_maker(tmp_path):
+    # sessions with separate connections to the same database
+    engine = create_engine("sqlite:///%s" % tmp_path.joinpath("cache.sqlite"))
+    Base.metadata.create_all(engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+class TestPermissionCache(BaseTestCase):
+    def test_perms_for_user_cached(self, db_session, permission_cache):
+        self.set_up_user_group_and_perms(db_session)
+        with mock.patch.object(
+            ResourceService, "perms_for_user", wraps=ResourceService.perms_for_user
+        ) as perms_for_user:
+            first = permission_cache.perms_for_user(self.resource, self.user)
+            second = permission_cache.perms_for_user(self.resource, self.user)
+        assert perms_for_user.call_count == 1
+        assert first == second
+        assert all(isinstance(p, PermissionIdTuple) for p in first)
+        assert sorted(p.perm_name for p in first) == [
+            "foo_perm",
+            "group_perm",
+            "test_perm2",
+        ]
+
+    def test_group_resource_permission_invalidates(self, db_session, permission_cache):
+        self.set_up_user_group_and_perms(db_session)
+        permission_cache.perms_for_user(self.resource, self.user)
+        db_session.add(
+            GroupResourcePermission(
+                perm_name="test_perm",
+                group_id=self.group.id,
+                resource_id=self.resource.resource_id,
+            )
+        )
+        db_session.flush()
+        perms = permission_cache.perms_for_user(self.resource, self.user)
+        assert "test_perm" in [p.perm_name for p in perms]
+
+    def test_bulk_grant_and_revoke_invalidate(self, db_session, permission_cache):
+        self.set_up_user_group_and_perms(db_session)
+        permission_cache.perms_for_user(self.resource, self.user)
+        GroupResourcePermissionService.grant(
+            self.group.id, "test_perm", [1], db_session=db_session
+        )
+        perms = permission_cache.perms_for_user(self.resource, self.user)
+        assert "test_perm" in [p.perm_name for p in perms]
+        GroupResourcePermissionService.revoke(
+            self.group.id, "test_perm", db_session=db_session
+        )
+        perms = permission_cache.perms_for_user(self.resource, self.user)
+        assert "test_perm" not in [p.perm_name for p in perms]
+        # generations are bumped again when transaction ends
+        generation = permission_cache.generation("group", self.group.id)
+        db_session.commit()
+        assert permission_cache.generation("group", self.group.id) > generation
+
+    def test_membership_invalidates(self, db_session, permission_cache):
+        self.set_up_user_group_and_perms(db_session)
+        perms = permission_cache.perms_for_user(self.resource, self.user2)
+        assert perms == []
+        generation = permission_cache.generation("user", self.user2.id)
+        db_session.add(UserGroup(user_id=self.user2.id, group_id=self.group.id))
+        db_session.flush()
+        db_session.expire(self.user2, ["groups"])
+        assert permission_cache.generation("user", self.user2.id) > generation
+        perms = permission_cache.perms_for_user(self.resource, self.user2)
+        assert [p.perm_name for p in perms] == ["group_perm"]
+
+    def test_user_permissions_group_change(self, db_session, permission_cache):
+        self.set_up_user_group_and_perms(db_session)
+        perms = permission_cache.user_permissions(self.user)
+        assert sorted(p.perm_name for p in perms) == [
+            "alter_users",
+            "manage_apps",
+            "root",
+        ]
+        db_session.add(
+            GroupPermission(perm_name="administration", group_id=self.group.id)
+        )
+        db_session.flush()
+        perms = permission_cache.user_permissions(self.user)
+        assert sorted(p.perm_name for p in perms) == [
+            "administration",
+            "alter_users",
+            "manage_apps",
+            "root",
+        ]
+        assert sorted(perms) == sorted(
+            UserService.permissions(self.user, ids_only=True)
+        )
+
+    def test_resource_permissions_for_users(self, db_session, permission_cache):
+        self.set_up_user_group_and_perms(db_session)
+        perms = permission_cache.resource_permissions_for_users(
+            ANY_PERMISSION,
+            resource_ids=[self.resource2.resource_id],
+            db_session=db_session,
+        )
+        assert len(perms) == 2
+        self.resource2.user_permissions[0].perm_name = "test_perm1"
+        db_session.flush()
+        perms = permission_cache.resource_permissions_for_users(
+            ANY_PERMISSION,
+            resource_ids=[self.resource2.resource_id],
+            db_session=db_session,
+        )
+        assert "test_perm1" in [p.perm_name for p in perms]
+
+    def test_concurrent_session_reads_before_commit(self, session_maker):
+        permission_cache = PermissionCache()
+        permission_cache.register(session_maker)
+        session_a = session_maker()
+        self.set_up_user_group_and_perms(session_a)
+        resource_id, user_id = self.resource.resource_id, self.user.id
+        session_a.commit()
+
+        session_b = session_maker()
+        resource = session_b.get(self.resource.__class__, resource_id)
+        user = session_b.get(self.user.__class__, user_id)
+        perms = permission_cache.perms_for_user(resource, user)
+        assert "test_perm2" in [p.perm_name for p in perms]
+
+        perm = session_a.query(UserResourcePermission).filter(
+            UserResourcePermission.perm_name == "test_perm2"
+        )
+        session_a.delete(perm.one())
+        session_a.flush()
+        # session b still reads committed rows and caches them
+        perms = permission_cache.perms_for_user(resource, user)
+        assert "test_perm2" in [p.perm_name for p in perms]
+        session_b.rollback()
+        session_a.commit()
+
+        perms = permission_cache.perms_for_user(resource, user)
+        assert "test_perm2" not in [p.perm_name for p in perms]
+        session_a.close()
+        session_b.close()
+        permission_cache.unregister(session_maker)
+
+    def test_rollback_invalidates(self, db_session, permission_cache):
+        self.set_up_user_group_and_perms(db_session)
+        db_session.commit()
+        db_session.add(
+            UserResourcePermission(
+                perm_name="test_perm",
+                user_id=self.user.id,
+                resource_id=self.resource.resource_id,
+            )
+        )
+        db_session.flush()
+        perms = permission_cache.perms_for_user(self.resource, self.user)
+        assert "test_perm" in [p.perm_name for p in perms]
+        db_session.rollback()
+        perms = permission_cache.perms_for_user(self.resource, self.user)
+        assert "test_perm" not in [p.perm_name for p in perms]
+
+
+@pytest.fixture
+def user_cache(db_session):
+    cache = UserCache()
+    cache.register(db_session)
+    yield cache
+    cache.unregister(db_session)
+
+
+class TestUserCache(BaseTestCase):
+    def set_up(self, db_session):
+        user = add_user(db_session)
+        group = add_group(db_session)
+        db_session.add(UserGroup(user_id=user.id, group_id=group.id))
+        db_session.flush()
+        return user.id, group.id
+
+    def by_id(self, user_cache, user_id, db_session):
+        db_session.expunge_all()
+        with mock.patch.object(UserService, "by_id", wraps=UserService.by_id) as by_id:
+            user = user_cache.by_id(user_id, db_session=db_session)
+        return user, by_id.call_count
+
+    def test_by_id_cached(self, db_session, user_cache):
+        user_id, group_id = self.set_up(db_session)
+        user, calls = self.by_id(user_cache, user_id, db_session)
+        assert calls == 1
+        user, calls = self.by_id(user_cache, str(user_id), db_session)
+        assert calls == 0
+        assert user in db_session
+        assert user.user_name == "username"
+        assert UserService.group_ids(user) == frozenset([group_id])
+        assert [g.id for g in user.groups] == [group_id]
+
+    def test_missing_user(self, db_session, user_cache):
+        assert user_cache.by_id(1, db_session=db_session) is None
+
+    @pytest.mark.parametrize("user_id", ["abc", "", object()])
+    def test_non_integer_user_id(self, db_session, user_cache, user_id):
+        self.set_up(db_session)
+        assert user_cache.by_id(user_id, db_session=db_session) is None
+        assert user_cache.group_ids(user_id, db_session=db_session) == frozenset()
+
+    def test_user_change_invalidates(self, db_session, user_cache):
+        user_id, group_id = self.set_up(db_session)
+        user, calls = self.by_id(user_cache, user_id, db_session)
+        user.email = "new_email"
+        db_session.flush()
+        user, calls = self.by_id(user_cache, user_id, db_session)
+        assert calls == 1
+        assert user.email == "new_email"
+
+    def test_membership_invalidates(self, db_session, user_cache):
+        user_id, group_id = self.set_up(db_session)
+        group2 = add_group(db_session, group_name="group2")
+        self.by_id(user_cache, user_id, db_session)
+        db_session.add(UserGroup(user_id=user_id, group_id=group2.id))
+        db_session.flush()
+        user, calls = self.by_id(user_cache, user_id, db_session)
+        assert calls == 1
+        assert UserService.group_ids(user) == frozenset([group_id, group2.id])
+
+    def test_stamp_change_invalidates(self, db_session):
+        # changes made by sessions the cache is not registered on
+        user_cache = UserCache()
+        user_id, group_id = self.set_up(db_session)
+        user, calls = self.by_id(user_cache, user_id, db_session)
+        UserService.regenerate_security_code(user)
+        db_session.flush()
+        user, calls = self.by_id(user_cache, user_id, db_session)
+        assert calls == 1
+        user, calls = self.by_id(user_cache, user_id, db_session)
+        assert calls == 0
+
+    def test_concurrent_session_reads_before_commit(self, session_maker):
+        user_cache = UserCache(stamp_attr=None)
+        user_cache.register(session_maker)
+        session_a = session_maker()
+        user_id, group_id = self.set_up(session_a)
+        session_a.commit()
+
+        session_b = session_maker()
+        assert user_cache.by_id(user_id, db_session=session_b).email == "email"
+        session_b.rollback()
+        user = session_a.get(User, user_id)
+        user.email = "new_email"
+        session_a.flush()
+        # session b still reads committed row and caches it
+        assert user_cache.by_id(user_id, db_session=session_b).email == "email"
+        session_b.rollback()
+        session_a.commit()
+
+        assert user_cache.by_id(user_id, db_session=session_b).email == "new_email"
+        session_a.close()
+        session_b.close()
+        user_cache.unregister(session_maker)
+
+    def test_group_ids(self, db_session, user_cache):
+        user_id, group_id = self.set_up(db_session)
+        assert user_cache.group_ids(user_id, db_session=db_session) == frozenset(
+            [group_id]
+        )
+        group2 = add_group(db_session, group_name="group2")
+        db_session.add(UserGroup(user_id=user_id, group_id=group2.id))
+        db_session.flush()
+        assert user_cache.group_ids(str(user_id), db_session=db_session) == frozenset(
+            [group_id, group2.id]
+        )
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+from __future__ import with_statement, unicode_literals
+
+import mock
+import sqlalchemy as sa
+
+from ziggurat_foundations.models.services.effective_permission import (
+    EffectivePermissionService,
+)
+from ziggurat_foundations.models.services.group_resource_permission import (
+    GroupResourcePermissionService,
+)
+from ziggurat_foundations.models.services.user_resource_permission import (
+    UserResourcePermissionService,
+)
+from ziggurat_foundations.models.services.user import UserService
+from ziggurat_foundations.tests import BaseTestCase, add_resource, add_user
+from ziggurat_foundations.tests.conftest import (
+    EffectivePermission,
+    Group,
+    GroupResourcePermission,
+    UserGroup,
+)
+
+maintained_service = EffectivePermissionService
+
+
+def effective_rows(db_session, user_id):
+    rows = db_session.query(EffectivePermission).filter(
+        EffectivePermission.user_id == user_id
+    )
+    return sorted((row.resource_id, row.perm_name, row.source) for row in rows)
+
+
+class TestEffectivePermissions(BaseTestCase):
+    def test_rebuild(self, db_session):
+        self.set_up_user_group_and_perms(db_session)
+        EffectivePermissionService.rebuild(db_session=db_session)
+        assert effective_rows(db_session, self.user.id) == [
+            (1, "foo_perm", "user"),
+            (1, "group_perm", "group"),
+            (1, "test_perm2", "user"),
+        ]
+        assert effective_rows(db_session, self.user3.id) == [(2, "test_perm", "user")]
+
+    def test_rebuild_ownership(self, db_session):
+        self.set_up_user_group_and_perms(db_session)
+        self.resource2.owner_user_id = self.user.id
+        self.resource.owner_group_id = self.group2.id
+        db_session.flush()
+        EffectivePermissionService.rebuild(db_session=db_session)
+        assert (
+            2,
+            EffectivePermissionService.ALL_PERMISSIONS_NAME,
+            "owner_user",
+        ) in effective_rows(db_session, self.user.id)
+        assert (
+            1,
+            EffectivePermissionService.ALL_PERMISSIONS_NAME,
+            "owner_group",
+        ) in effective_rows(db_session, self.user4.id)
+
+    def test_overlapping_refresh(self, db_session):
+        self.set_up_user_group_and_perms(db_session)
+        EffectivePermissionService.rebuild(db_session=db_session)
+        expected = effective_rows(db_session, self.user.id)
+        table = EffectivePermission.__table__
+        delete = table.delete
+        # concurrent transaction inserted the rows after our delete ran
+        with mock.patch.object(table, "delete", lambda: delete().where(sa.false())):
+            EffectivePermissionService.refresh_for_users(
+                [self.user.id], db_session=db_session
+            )
+            EffectivePermissionService.refresh_for_resources(
+                [self.resource.resource_id], db_session=db_session
+            )
+        assert effective_rows(db_session, self.user.id) == expected
+
+    def test_incremental_permission_and_membership(self, maintained_session):
+        db_session = maintained_session
+        self.set_up_user_group_and_perms(db_session)
+        assert effective_rows(db_session, self.user2.id) == [(2, "foo_perm", "user")]
+        db_session.add(
+            GroupResourcePermission(
+                perm_name="test_perm", group_id=self.group.id, resource_id=2
+            )
+        )
+        db_session.flush()
+        assert (2, "test_perm", "group") in effective_rows(db_session, self.user.id)
+        db_session.add(UserGroup(user_id=self.user2.id, group_id=self.group.id))
+        db_session.flush()
+        assert effective_rows(db_session, self.user2.id) == [
+            (1, "group_perm", "group"),
+            (2, "foo_perm", "user"),
+            (2, "test_perm", "group"),
+        ]
+        db_session.delete(self.resource2.user_permissions[0])
+        db_session.flush()
+        assert (2, "foo_perm", "user") not in effective_rows(db_session, self.user2.id)
+
+    def test_incremental_ownership(self, maintained_session):
+        db_session = maintained_session
+        user = add_user(db_session)
+        resource = add_resource(db_session, 1, "test_resource")
+        assert effective_rows(db_session, user.id) == []
+        resource.owner_user_id = user.id
+        db_session.flush()
+        assert effective_rows(db_session, user.id) == [
+            (1, EffectivePermissionService.ALL_PERMISSIONS_NAME, "owner_user")
+        ]
+
+    def test_bulk_grant_and_revoke(self, maintained_session):
+        db_session = maintained_session
+        self.set_up_user_group_and_perms(db_session)
+        UserResourcePermissionService.grant(
+            self.user2.id, "test_perm", [1], db_session=db_session
+        )
+        GroupResourcePermissionService.grant(
+            self.group.id, "test_perm", [2], db_session=db_session
+        )
+        assert effective_rows(db_session, self.user2.id) == [
+            (1, "test_perm", "user"),
+            (2, "foo_perm", "user"),
+        ]
+        assert (2, "test_perm", "group") in effective_rows(db_session, self.user.id)
+        UserResourcePermissionService.revoke(
+            self.user2.id, "test_perm", db_session=db_session
+        )
+        GroupResourcePermissionService.revoke(
+            self.group.id, "test_perm", db_session=db_session
+        )
+        assert effective_rows(db_session, self.user2.id) == [(2, "foo_perm", "user")]
+        assert (2, "test_perm", "group") not in effective_rows(db_session, self.user.id)
+
+    def test_deleted_group(self, maintained_session):
+        db_session = maintained_session
+        if db_session.bind.dialect.name == "sqlite":
+            # memberships and permissions are removed by database cascades
+            db_session.execute(sa.text("PRAGMA foreign_keys=ON"))
+        self.set_up_user_group_and_perms(db_session)
+        user_id, group_id = self.user.id, self.group.id
+        # group collections are not loaded
+        db_session.expunge_all()
+        db_session.delete(db_session.get(Group, group_id))
+        db_session.flush()
+        assert effective_rows(db_session, user_id) == [
+            (1, "foo_perm", "user"),
+            (1, "test_perm2", "user"),
+        ]
+        user = UserService.get(user_id, db_session=db_session)
+        resources = UserService.resources_with_perms(
+            user, ["group_perm"], db_session=db_session, use_effective_permissions=True
+        ).all()
+        assert resources == []
+
+    def test_resources_with_perms(self, db_session):
+        self.set_up_user_group_and_perms(db_session)
+        self.resource2.owner_user_id = self.user.id
+        db_session.flush()
+        EffectivePermissionService.rebuild(db_session=db_session)
+        for perms in (["foo_perm"], ["group_perm"], ["missing"], ["test_perm"]):
+            for user in (self.user, self.user2, self.user4):
+                expected = UserService.resources_with_perms(
+                    user, perms, db_session=db_session
+                ).all()
+                resources = UserService.resources_with_perms(
+                    user, perms, db_session=db_session, use_effective_permissions=True
+                ).all()
+                assert resources == expected
+
+    def test_resources_with_perms_filters(self, db_session):
+        self.set_up_user_group_and_perms(db_session)
+        self.resource2.owner_user_id = self.user.id
+        db_session.flush()
+        EffectivePermissionService.rebuild(db_session=db_session)
+        resources = UserService.resources_with_perms(
+            self.user,
+            ["foo_perm"],
+            resource_types=["test_resource_b"],
+            db_session=db_session,
+            use_effective_permissions=True,
+        ).all()
+        assert resources == [self.resource2]
+        resources = UserService.resources_with_perms(
+            self.user,
+            ["foo_perm"],
+            resource_ids=[1],
+            db_session=db_session,
+            use_effective_permissions=True,
+        ).all()
+        assert resources == [self.resource]
@@ -1,9 +1,23 @@
 # -*- coding: utf-8 -*-
 from __future__ import with_statement, unicode_literals
 
+import mock
 import pytest
+import sqlalchemy as sa
 
-from ziggurat_foundations.tests import BaseTestCase, add_user
+from ziggurat_foundations import make_passwordmanager
+from ziggurat_foundations.ext.pyramid.permission_cache import RequestPermissionCache
+from ziggurat_foundations.hashing import HashMigrationQueue
+from ziggurat_foundations.models.services.user_resource_permission import (
+    UserResourcePermissionService,
+)
+from ziggurat_foundations.models.services.resource import ResourceService
+from ziggurat_foundations.models.services.user import UserService
+from ziggurat_foundations.tests import BaseTestCase, add_group, add_user
+from ziggurat_foundations.tests.conftest import UserGroup, UserResourcePermission
+
+# referenced by dotted path from sign in settings
+hash_queue = HashMigrationQueue(lambda: None, interval=3600)
 
 
 class TestExtPyramidLogin(BaseTestCase):
@@ -29,6 +43,90 @@ class TestExtPyramidLogin(BaseTestCase):
         assert result["view"] == "sign_in"
         assert result["username"] == "username1"
 
+    def test_logon_by_email(self, db_session, pyramid_app):
+        add_user(db_session, user_name="username1", email="Email@example.com")
+        params = {"login": "email@EXAMPLE.com", "password": "password"}
+        lookup = UserService.by_user_name_or_email
+        with mock.patch.object(
+            UserService, "by_user_name_or_email", wraps=lookup
+        ) as by_login:
+            result = pyramid_app.post("/sign_in", params=params).json
+        assert by_login.call_count == 1
+        assert result["view"] == "sign_in"
+        assert result["username"] == "username1"
+
+    def test_logon_unknown_user_checks_dummy_hash(self, db_session, pyramid_app):
+        params = {"login": "unknown", "password": "password"}
+        check = UserService.dummy_check_password
+        with mock.patch.object(
+            UserService, "dummy_check_password", wraps=check
+        ) as dummy_check:
+            result = pyramid_app.post("/sign_in", params=params).json
+        assert dummy_check.call_count == 1
+        assert result["view"] == "bad_auth"
+
+    def test_logon_password_too_long(self, db_session, pyramid_app):
+        add_user(db_session, user_name="username1", email="email")
+        params = {"login": "username1", "password": "x" * 5000}
+        with mock.patch.object(UserService, "by_user_name_or_email") as lookup:
+            result = pyramid_app.post("/sign_in", params=params).json
+        assert lookup.call_count == 0
+        assert result["view"] == "bad_auth"
+
+    @pytest.mark.parametrize(
+        "pyramid_app",
+        [
+            {
+                "ziggurat_foundations.sign_in.throttle": "memory",
+                "ziggurat_foundations.sign_in.throttle.user_capacity": "2",
+                "ziggurat_foundations.sign_in.throttle.user_refill_rate": "0",
+            }
+        ],
+        indirect=True,
+    )
+    def test_logon_throttled(self, db_session, pyramid_app):
+        add_user(db_session, user_name="username1", email="email")
+        good = {"login": "username1", "password": "password"}
+        bad = {"login": "USERNAME1", "password": "bad"}
+        assert pyramid_app.post("/sign_in", params=bad).json["view"] == "bad_auth"
+        # successful sign in refills the bucket
+        assert pyramid_app.post("/sign_in", params=good).json["view"] == "sign_in"
+        assert pyramid_app.post("/sign_in", params=bad).json["view"] == "bad_auth"
+        assert pyramid_app.post("/sign_in", params=bad).json["view"] == "bad_auth"
+        with mock.patch.object(UserService, "by_user_name_or_email") as lookup:
+            result = pyramid_app.post("/sign_in", params=good).json
+        assert lookup.call_count == 0
+        assert result["view"] == "throttled"
+        other = {"login": "other", "password": "password"}
+        assert pyramid_app.post("/sign_in", params=other).json["view"] == "bad_auth"
+
+    @pytest.mark.parametrize(
+        "pyramid_app",
+        [
+            {
+                "ziggurat_foundations.sign_in.hash_migration_queue": (
+                    "ziggurat_foundations.tests.test_ext_pyramid:hash_queue"
+                )
+            }
+        ],
+        indirect=True,
+    )
+    def test_logon_queues_hash_migration(self, db_session, pyramid_app):
+        user = add_user(db_session, user_name="username1", email="email")
+        legacy = make_passwordmanager(["bcrypt"]).hash("password")
+        user.user_password = legacy
+        db_session.flush()
+        # empty queue is falsy, it still has to be used
+        assert len(hash_queue) == 0
+        try:
+            params = {"login": "username1", "password": "password"}
+            result = pyramid_app.post("/sign_in", params=params).json
+            assert result["view"] == "sign_in"
+            assert len(hash_queue) == 1
+            assert user.user_password == legacy
+        finally:
+            hash_queue.stop(flush=False)
+
     @pytest.mark.parametrize(
         "username,password", [("username1", "BAD"), ("username", "password")]
     )
@@ -56,3 +154,92 @@ class TestExtPyramidLogin(BaseTestCase):
         result = pyramid_app.post("/", headers=result.headers).json
         assert result["view"] == "index"
         assert result["username"] == "username1"
+
+    def test_group_ids_finder(self, db_session, pyramid_app):
+        user = add_user(db_session, user_name="username1", email="email")
+        group = add_group(db_session)
+        db_session.add(UserGroup(user_id=user.id, group_id=group.id))
+        db_session.flush()
+        result = pyramid_app.post(
+            "/sign_in", params={"login": "username1", "password": "password"}
+        )
+        db_session.expunge_all()
+        with mock.patch.object(UserService, "by_id", wraps=UserService.by_id) as by_id:
+            result = pyramid_app.get("/principals", headers=result.headers).json
+        assert by_id.call_count == 0
+        assert result["user_loaded"] is False
+        assert "group:%s" % group.id in result["principals"]
+        assert "system.Authenticated" in result["principals"]
+
+
+class TestRequestPermissionCache(BaseTestCase):
+    def test_perms_cached(self, db_session):
+        self.set_up_user_group_and_perms(db_session)
+        cache = RequestPermissionCache()
+        with mock.patch.object(
+            ResourceService, "perms_for_user", wraps=ResourceService.perms_for_user
+        ) as perms_for_user:
+            first = cache.perms_for_user(self.resource, self.user)
+            second = cache.perms_for_user(self.resource, self.user)
+            cache.perms_for_user(self.resource, self.user4)
+        assert first == second
+        assert perms_for_user.call_count == 2
+        cache.close()
+
+    def test_invalidated_on_flush(self, db_session):
+        self.set_up_user_group_and_perms(db_session)
+        cache = RequestPermissionCache()
+        perms = cache.direct_perms_for_user(self.resource, self.user)
+        assert sorted(p.perm_name for p in perms) == ["foo_perm", "test_perm2"]
+        self.resource.user_permissions.append(
+            UserResourcePermission(perm_name="test_perm", user_id=self.user.id)
+        )
+        db_session.flush()
+        perms = cache.direct_perms_for_user(self.resource, self.user)
+        assert sorted(p.perm_name for p in perms) == [
+            "foo_perm",
+            "test_perm",
+            "test_perm2",
+        ]
+        cache.close()
+
+    def test_invalidated_on_bulk_grant(self, db_session):
+        self.set_up_user_group_and_perms(db_session)
+        cache = RequestPermissionCache()
+        perms = cache.direct_perms_for_user(self.resource, self.user)
+        assert sorted(p.perm_name for p in perms) == ["foo_perm", "test_perm2"]
+        UserResourcePermissionService.grant(
+            self.user.id, "test_perm", [1], db_session=db_session
+        )
+        perms = cache.direct_perms_for_user(self.resource, self.user)
+        assert sorted(p.perm_name for p in perms) == [
+            "foo_perm",
+            "test_perm",
+            "test_perm2",
+        ]
+        cache.close()
+
+    def test_close_removes_listener(self, db_session):
+        self.set_up_user_group_and_perms(db_session)
+        cache = RequestPermissionCache()
+        cache.group_perms_for_user(self.resource, self.user)
+        cache.close()
+        assert not sa.event.contains(db_session, "after_flush", cache._after_flush)
+        assert (
+            db_session,
+            cache._after_permission_write,
+        ) not in ResourceService._permission_write_listeners
+
+    def test_request_method(self, db_session):
+        from pyramid import testing
+        from pyramid.request import Request, apply_request_extensions
+
+        config = testing.setUp()
+        config.include("ziggurat_foundations.ext.pyramid.permission_cache")
+        config.commit()
+        request = Request.blank("/")
+        request.registry = config.registry
+        apply_request_extensions(request)
+        assert isinstance(request.ziggurat_perms, RequestPermissionCache)
+        assert request.ziggurat_perms is request.ziggurat_perms
+        testing.tearDown()
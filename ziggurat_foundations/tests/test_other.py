@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 from __future__ import with_statement, unicode_literals
 
+import mock
+
+from ziggurat_foundations import import_model_service_mappings
 from ziggurat_foundations.models.services.external_identity import (
     ExternalIdentityService,
 )
@@ -81,3 +84,18 @@ class TestExternalIdentity(BaseTestCase):
 class TestUtils(BaseTestCase):
     def test_permission_to_04_acls(self, db_session):
         pass
+
+
+class TestModelServiceMappings(object):
+    def test_without_asyncio(self):
+        # sqlalchemy without asyncio support fails importing aio services
+        modules = {"ziggurat_foundations.models.services.aio.user": None}
+        with mock.patch.dict("sys.modules", modules):
+            mappings = import_model_service_mappings()
+        services = [s.__name__ for services in mappings.values() for s in services]
+        assert "UserService" in services
+        assert not [name for name in services if name.startswith("Async")]
+
+    def test_with_asyncio(self):
+        mappings = import_model_service_mappings()
+        assert "AsyncUserService" in [s.__name__ for s in mappings["User"]]
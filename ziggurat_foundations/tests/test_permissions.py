@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 from __future__ import with_statement, unicode_literals
 
+import mock
 import pytest
+import sqlalchemy as sa
 
 from ziggurat_foundations.models.services.group_permission import GroupPermissionService
 from ziggurat_foundations.models.services.group_resource_permission import (
@@ -14,13 +16,23 @@ from ziggurat_foundations.models.services.user_resource_permission import (
 
 from ziggurat_foundations.models.services.resource import ResourceService
 
-from ziggurat_foundations.permissions import PermissionTuple, ALL_PERMISSIONS
+from ziggurat_foundations.permissions import (
+    PermissionTuple,
+    ALL_PERMISSIONS,
+    ANY_PERMISSION,
+    PermissionIdTuple,
+    PermissionResolver,
+    permission_to_pyramid_acls,
+    resource_permissions_for_users,
+)
 from ziggurat_foundations.tests import (
     add_user,
     check_one_in_other,
     add_resource,
     add_resource_b,
     add_group,
+    create_default_tree,
+    legacy_resource_permissions_for_users,
     BaseTestCase,
 )
 from ziggurat_foundations.tests.conftest import (
@@ -884,6 +896,435 @@ class TestUserPermissions(BaseTestCase):
         assert perm.user_id == created_user.id
 
 
+class TestResourcePermsForUserBulk(BaseTestCase):
+    def test_matches_perms_for_user(self, db_session):
+        self.set_up_user_group_and_perms(db_session)
+        self.resource.owner_user_id = self.user.id
+        self.resource2.owner_group_id = self.group.id
+        db_session.flush()
+        perms = ResourceService.perms_for_user_bulk(
+            [self.resource, self.resource2.resource_id], self.user
+        )
+        assert list(perms) == [self.resource.resource_id, self.resource2.resource_id]
+        for resource in (self.resource, self.resource2):
+            expected = ResourceService.perms_for_user(resource, self.user)
+            assert len(perms[resource.resource_id]) == len(expected)
+            check_one_in_other(perms[resource.resource_id], expected)
+
+    def test_resource_ids(self, db_session):
+        self.set_up_user_group_and_perms(db_session)
+        perms = ResourceService.perms_for_user_bulk(
+            [self.resource.resource_id, self.resource2.resource_id, 999],
+            self.user3,
+            db_session=db_session,
+        )
+        assert perms == {
+            self.resource.resource_id: [],
+            self.resource2.resource_id: [
+                PermissionTuple(
+                    self.user3, "test_perm", "user", None, self.resource2, False, True
+                )
+            ],
+        }
+
+    def test_generator(self, db_session):
+        self.set_up_user_group_and_perms(db_session)
+        resources = (r for r in [self.resource, self.resource2.resource_id])
+        perms = ResourceService.perms_for_user_bulk(resources, self.user3)
+        assert list(perms) == [self.resource.resource_id, self.resource2.resource_id]
+        assert [p.perm_name for p in perms[self.resource2.resource_id]] == ["test_perm"]
+
+    def test_empty(self, db_session):
+        self.set_up_user_group_and_perms(db_session)
+        assert (
+            ResourceService.perms_for_user_bulk([], self.user, db_session=db_session)
+            == {}
+        )
+
+
+class TestResourceHasPermission(BaseTestCase):
+    @pytest.mark.parametrize(
+        "user_attr,resource_attr,perm_name,expected",
+        [
+            ("user", "resource", "foo_perm", True),
+            ("user", "resource", "group_perm", True),
+            ("user", "resource", "test_perm", False),
+            ("user", "resource2", ANY_PERMISSION, False),
+            ("user2", "resource2", "foo_perm", True),
+            ("user2", "resource", ANY_PERMISSION, False),
+            ("user4", "resource", "group_perm", True),
+            ("user4", "resource", ANY_PERMISSION, True),
+            ("user3", "resource2", "foo_perm", False),
+        ],
+    )
+    def test_has_permission(
+        self, db_session, user_attr, resource_attr, perm_name, expected
+    ):
+        self.set_up_user_group_and_perms(db_session)
+        user = getattr(self, user_attr)
+        resource = getattr(self, resource_attr)
+        result = ResourceService.has_permission(
+            resource.resource_id, user.id, perm_name, db_session=db_session
+        )
+        assert result is expected
+
+    def test_has_permission_owner(self, db_session):
+        self.set_up_user_group_and_perms(db_session)
+        self.resource2.owner_user_id = self.user.id
+        self.resource.owner_group_id = self.group2.id
+        db_session.flush()
+        assert ResourceService.has_permission(
+            self.resource2.resource_id, self.user.id, "foo", db_session=db_session
+        )
+        assert ResourceService.has_permission(
+            self.resource.resource_id, self.user4.id, "foo", db_session=db_session
+        )
+        assert not ResourceService.has_permission(
+            self.resource.resource_id, self.user3.id, "foo", db_session=db_session
+        )
+
+    def test_has_permissions(self, db_session):
+        self.set_up_user_group_and_perms(db_session)
+        self.resource2.owner_group_id = self.group.id
+        db_session.flush()
+        pairs = [
+            (self.resource.resource_id, "foo_perm"),
+            (self.resource.resource_id, "group_perm"),
+            (self.resource.resource_id, "test_perm"),
+            (self.resource2.resource_id, "anything"),
+        ]
+        assert ResourceService.has_permissions(
+            pairs, self.user.id, db_session=db_session
+        ) == [True, True, False, True]
+        assert ResourceService.has_permissions(
+            pairs, self.user4.id, db_session=db_session
+        ) == [False, True, False, False]
+        assert (
+            ResourceService.has_permissions(
+                [(self.resource2.resource_id, ANY_PERMISSION)],
+                self.user3.id,
+                db_session=db_session,
+            )
+            == [True]
+        )
+        assert ResourceService.has_permissions([], self.user.id, db_session) == []
+
+    def test_has_permissions_mixed_pairs(self, db_session):
+        self.set_up_user_group_and_perms(db_session)
+        pairs = (
+            (str(r_id), perm_name)
+            for r_id, perm_name in [
+                (self.resource2.resource_id, ANY_PERMISSION),
+                (self.resource2.resource_id, "foo_perm"),
+                (self.resource.resource_id, ANY_PERMISSION),
+                (self.resource2.resource_id, "test_perm"),
+            ]
+        )
+        assert ResourceService.has_permissions(
+            pairs, self.user2.id, db_session=db_session
+        ) == [True, True, False, False]
+        statement = ResourceService._cached_statement("has_any_permissions", None)
+        ResourceService.has_permissions(
+            [(self.resource.resource_id, ANY_PERMISSION)],
+            self.user.id,
+            db_session=db_session,
+        )
+        assert (
+            ResourceService._cached_statement("has_any_permissions", None) is statement
+        )
+
+
+class TestInheritedPermissions(BaseTestCase):
+    def set_up_tree_perms(self, db_session):
+        create_default_tree(db_session)
+        self.user = add_user(db_session)
+        self.group = add_group(db_session)
+        self.group.users.append(self.user)
+        db_session.flush()
+        db_session.add(
+            GroupResourcePermission(
+                group_id=self.group.id, resource_id=-1, perm_name="test_perm"
+            )
+        )
+        db_session.add(
+            UserResourcePermission(
+                user_id=self.user.id, resource_id=1, perm_name="test_perm"
+            )
+        )
+        db_session.add(
+            UserResourcePermission(
+                user_id=self.user.id, resource_id=9, perm_name="foo_perm"
+            )
+        )
+        ResourceService.get(7, db_session=db_session).owner_group_id = self.group.id
+        db_session.flush()
+
+    def test_union(self, db_session):
+        self.set_up_tree_perms(db_session)
+        resource = ResourceService.get(12, db_session=db_session)
+        perms = ResourceService.inherited_perms_for_user(resource, self.user)
+        result = [
+            (p.resource.resource_id, p.depth, p.type, p.owner)
+            for p in perms
+            if p.perm_name != ALL_PERMISSIONS
+        ]
+        assert sorted(result) == [
+            (-1, 5, "group", False),
+            (1, 4, "user", False),
+            (9, 2, "user", False),
+        ]
+        owned = [p for p in perms if p.perm_name == ALL_PERMISSIONS]
+        assert len(owned) == 1
+        assert owned[0].group == self.group
+        assert owned[0].depth == 3
+        assert [p.depth for p in perms] == sorted(p.depth for p in perms)
+
+    def test_nearest_wins(self, db_session):
+        self.set_up_tree_perms(db_session)
+        resource = ResourceService.get(12, db_session=db_session)
+        perms = ResourceService.inherited_perms_for_user(
+            resource, self.user, nearest_wins=True
+        )
+        result = [(p.resource.resource_id, p.depth, p.perm_name) for p in perms]
+        assert result[0] == (9, 2, "foo_perm")
+        assert result[1][:2] == (7, 3)
+        assert result[2] == (1, 4, "test_perm")
+        assert len(result) == 3
+
+    def test_limit_depth(self, db_session):
+        self.set_up_tree_perms(db_session)
+        resource = ResourceService.get(12, db_session=db_session)
+        perms = ResourceService.inherited_perms_for_user(
+            resource, self.user, limit_depth=2
+        )
+        assert [(p.resource.resource_id, p.depth) for p in perms] == [(9, 2)]
+
+    def test_no_perms(self, db_session):
+        self.set_up_tree_perms(db_session)
+        resource = ResourceService.get(-2, db_session=db_session)
+        assert ResourceService.inherited_perms_for_user(resource, self.user) == []
+
+    @pytest.mark.parametrize("limit_depth", [1000000, 3])
+    def test_without_recursive_cte(self, db_session, limit_depth):
+        self.set_up_tree_perms(db_session)
+        resource = ResourceService.get(12, db_session=db_session)
+        expected = ResourceService.inherited_perms_for_user(
+            resource, self.user, limit_depth=limit_depth
+        )
+        with mock.patch.object(
+            ResourceService, "_supports_recursive_cte", return_value=False
+        ):
+            perms = ResourceService.inherited_perms_for_user(
+                resource, self.user, limit_depth=limit_depth
+            )
+        assert sorted(perms, key=repr) == sorted(expected, key=repr)
+        assert [p.depth for p in perms] == sorted(p.depth for p in perms)
+
+
+class TestResourcesWithPermsPagination(BaseTestCase):
+    def set_up_resources(self, db_session):
+        self.user = add_user(db_session)
+        group = add_group(db_session)
+        group.users.append(self.user)
+        # duplicated names check that resource_id breaks ties
+        for resource_id in range(1, 11):
+            resource = add_resource(
+                db_session, resource_id, "resource_%s" % (resource_id % 4)
+            )
+            if resource_id % 3 == 0:
+                resource.owner_user_id = self.user.id
+            elif resource_id % 3 == 1:
+                resource.user_permissions.append(
+                    UserResourcePermission(perm_name="test_perm", user_id=self.user.id)
+                )
+            else:
+                resource.group_permissions.append(
+                    GroupResourcePermission(perm_name="test_perm", group_id=group.id)
+                )
+        add_resource(db_session, 11, "resource_0")
+        db_session.flush()
+
+    def test_pages(self, db_session):
+        self.set_up_resources(db_session)
+        expected = sorted(
+            UserService.resources_with_perms(
+                self.user, ["test_perm"], db_session=db_session
+            ).all(),
+            key=lambda r: (r.resource_name, r.resource_id),
+        )
+        assert len(expected) == 10
+        found = []
+        after = None
+        while True:
+            page = UserService.resources_with_perms_page(
+                self.user, ["test_perm"], limit=3, after=after, db_session=db_session
+            )
+            if not page:
+                break
+            assert len(page) <= 3
+            found.extend(page)
+            after = (page[-1].resource_name, page[-1].resource_id)
+        assert found == expected
+
+    def test_page_limits_every_branch(self, db_session):
+        self.set_up_resources(db_session)
+        statements = []
+
+        def before_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        sa.event.listen(db_session.bind, "before_cursor_execute", before_execute)
+        try:
+            page = UserService.resources_with_perms_page(
+                self.user, ["test_perm"], limit=2, db_session=db_session
+            )
+        finally:
+            sa.event.remove(db_session.bind, "before_cursor_execute", before_execute)
+        assert [r.resource_id for r in page] == [4, 8]
+        # both union branches and the page itself
+        assert statements[-1].count("LIMIT") == 3
+
+    def test_page_filters(self, db_session):
+        self.set_up_resources(db_session)
+        page = UserService.resources_with_perms_page(
+            self.user,
+            ["test_perm"],
+            after=("resource_1", 5),
+            resource_ids=[1, 2, 5, 9],
+            db_session=db_session,
+        )
+        assert [r.resource_id for r in page] == [9, 2]
+
+    def test_iter(self, db_session):
+        self.set_up_resources(db_session)
+        resources = UserService.iter_resources_with_perms(
+            self.user, ["test_perm"], batch_size=2, db_session=db_session
+        )
+        assert [(r.resource_name, r.resource_id) for r in resources] == [
+            ("resource_0", 4),
+            ("resource_0", 8),
+            ("resource_1", 1),
+            ("resource_1", 5),
+            ("resource_1", 9),
+            ("resource_2", 2),
+            ("resource_2", 6),
+            ("resource_2", 10),
+            ("resource_3", 3),
+            ("resource_3", 7),
+        ]
+
+
+class TestPermissionResolver(BaseTestCase):
+    @pytest.mark.parametrize(
+        "perm_names,kwargs",
+        [
+            (ANY_PERMISSION, {}),
+            (["group_perm"], {}),
+            (["foo_perm", "test_perm"], {"resource_types": ["test_resource_b"]}),
+            (ANY_PERMISSION, {"user_ids": "user"}),
+            (ANY_PERMISSION, {"user_ids": "user", "group_ids": "group2"}),
+            (ANY_PERMISSION, {"limit_group_permissions": True}),
+            (ANY_PERMISSION, {"skip_group_perms": True}),
+            (ANY_PERMISSION, {"skip_user_perms": True, "group_ids": "group2"}),
+            ([ANY_PERMISSION], {"resource_ids": "resource"}),
+        ],
+    )
+    def test_matches_resource_permissions_for_users(
+        self, db_session, perm_names, kwargs
+    ):
+        self.set_up_user_group_and_perms(db_session)
+        lookup = {
+            "user_ids": lambda: [self.user.id],
+            "group_ids": lambda: [self.group2.id],
+            "resource_ids": lambda: [self.resource.resource_id],
+        }
+        kwargs = dict(
+            (k, lookup[k]() if isinstance(v, str) else v) for k, v in kwargs.items()
+        )
+        expected = legacy_resource_permissions_for_users(
+            UserService.models_proxy, perm_names, db_session=db_session, **kwargs
+        )
+        resolver = PermissionResolver.for_models_proxy(UserService.models_proxy)
+        perms = resolver.resource_permissions_for_users(
+            perm_names, db_session=db_session, **kwargs
+        )
+        public = resource_permissions_for_users(
+            UserService.models_proxy, perm_names, db_session=db_session, **kwargs
+        )
+        assert len(perms) == len(expected)
+        assert len(public) == len(expected)
+        check_one_in_other(public, list(expected))
+        check_one_in_other(perms, expected)
+
+    def test_for_models_proxy_is_shared(self, db_session):
+        resolver = PermissionResolver.for_models_proxy(UserService.models_proxy)
+        assert resolver is PermissionResolver.for_models_proxy(UserService.models_proxy)
+        statement = resolver.statement(filter_perms=True, filter_resources=True)
+        assert statement is resolver.statement(filter_perms=True, filter_resources=True)
+
+
+def permission_ids(perm):
+    return PermissionIdTuple(
+        perm.user.id if perm.user else None,
+        perm.perm_name,
+        perm.type,
+        perm.group.id if perm.group else None,
+        perm.resource.resource_id if perm.resource else None,
+        perm.owner,
+        perm.allowed,
+    )
+
+
+class TestPermissionIds(BaseTestCase):
+    @pytest.mark.parametrize(
+        "kwargs",
+        [
+            {},
+            {"limit_group_permissions": True},
+            {"skip_group_perms": True},
+            {"resource_types": ["test_resource"]},
+        ],
+    )
+    def test_resource_permissions_for_users(self, db_session, kwargs):
+        self.set_up_user_group_and_perms(db_session)
+        expected = resource_permissions_for_users(
+            UserService.models_proxy, ANY_PERMISSION, db_session=db_session, **kwargs
+        )
+        perms = resource_permissions_for_users(
+            UserService.models_proxy,
+            ANY_PERMISSION,
+            db_session=db_session,
+            ids_only=True,
+            **kwargs
+        )
+        assert all(isinstance(p, PermissionIdTuple) for p in perms)
+        assert sorted(perms, key=repr) == sorted(
+            [permission_ids(p) for p in expected], key=repr
+        )
+
+    def test_perms_for_user(self, db_session):
+        self.set_up_user_group_and_perms(db_session)
+        self.resource.owner_user_id = self.user.id
+        self.resource.owner_group_id = self.group.id
+        db_session.flush()
+        expected = ResourceService.perms_for_user(self.resource, self.user)
+        perms = ResourceService.perms_for_user(self.resource, self.user, ids_only=True)
+        assert sorted(perms, key=repr) == sorted(
+            [permission_ids(p) for p in expected], key=repr
+        )
+        assert sorted(permission_to_pyramid_acls(perms), key=repr) == sorted(
+            permission_to_pyramid_acls(expected), key=repr
+        )
+
+    def test_user_permissions(self, db_session):
+        self.set_up_user_group_and_perms(db_session)
+        expected = UserService.permissions(self.user, db_session=db_session)
+        perms = UserService.permissions(self.user, db_session=db_session, ids_only=True)
+        assert sorted(perms, key=repr) == sorted(
+            [permission_ids(p) for p in expected], key=repr
+        )
+
+
 class TestGroupPermission(BaseTestCase):
     def test_repr(self, db_session):
         group_permission = GroupPermission(group_id=1, perm_name="perm")
@@ -1039,3 +1480,62 @@ class TestUserPermission(BaseTestCase):
         )
 
         assert user_permission is None
+
+
+class TestBulkGrantRevoke(BaseTestCase):
+    def set_up_resources(self, db_session):
+        resources = [add_resource(db_session, i, "resource_%s" % i) for i in (1, 2, 3)]
+        resources.append(add_resource_b(db_session, 4, "resource_4"))
+        return resources
+
+    def test_group_grant_and_revoke(self, db_session):
+        self.set_up_resources(db_session)
+        group = add_group(db_session)
+        perm = GroupResourcePermission(resource_id=2, perm_name="foo_perm")
+        group.resource_permissions.append(perm)
+        db_session.flush()
+        grant = GroupResourcePermissionService.grant
+        assert grant(group.id, "foo_perm", [1, 2, 3], db_session=db_session) == 2
+        assert grant(group.id, "foo_perm", [1, 2, 3], db_session=db_session) == 0
+        assert grant(group.id, "foo_perm", [], db_session=db_session) == 0
+        query = db_session.query(GroupResourcePermission.resource_id)
+        query = query.filter(GroupResourcePermission.group_id == group.id)
+        assert sorted(r for r, in query) == [1, 2, 3]
+
+        deleted = GroupResourcePermissionService.revoke(
+            group.id, "foo_perm", resource_ids=[1, 4], db_session=db_session
+        )
+        assert deleted == 1
+        assert sorted(r for r, in query) == [2, 3]
+
+    def test_user_grant_by_type_and_revoke_everywhere(self, db_session):
+        self.set_up_resources(db_session)
+        user = add_user(db_session)
+        grant = UserResourcePermissionService.grant
+        revoke = UserResourcePermissionService.revoke
+        types = ["test_resource"]
+        assert grant(user.id, "test_perm", None, types, db_session) == 3
+        assert grant(user.id, "test_perm", db_session=db_session) == 1
+        resource = ResourceService.get(4, db_session=db_session)
+        perms = ResourceService.perms_for_user(resource, user)
+        assert [p.perm_name for p in perms] == ["test_perm"]
+        types = ["test_resource_b"]
+        assert revoke(user.id, "test_perm", None, types, db_session) == 1
+        assert revoke(user.id, "test_perm", db_session=db_session) == 3
+        assert db_session.query(UserResourcePermission).count() == 0
+
+    def test_grant_validates_per_resource_type(self, db_session, monkeypatch):
+        self.set_up_resources(db_session)
+        user = add_user(db_session)
+        monkeypatch.setattr(
+            ResourceTestobjB, "__possible_permissions__", ["test_perm"], raising=False
+        )
+        checked = ResourceService.validate_perm_name("test_perm", db_session=db_session)
+        assert sorted(checked) == ["test_resource", "test_resource_b"]
+        grant = UserResourcePermissionService.grant
+        with pytest.raises(AssertionError):
+            grant(user.id, "foo_perm", [1, 4], db_session=db_session)
+        assert db_session.query(UserResourcePermission).count() == 0
+        assert grant(user.id, "foo_perm", [1, 2], db_session=db_session) == 2
+        with pytest.raises(AssertionError):
+            grant(user.id, "wrong_perm", [1], db_session=db_session)
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+from __future__ import with_statement, unicode_literals
+
+import pytest
+import sqlalchemy as sa
+
+from ziggurat_foundations.exc import ZigguratResourceTreePathException
+from ziggurat_foundations.models.services.resource_tree import ResourceTreeService
+from ziggurat_foundations.models.services.resource_tree_closure import (
+    ResourceTreeServiceClosure,
+)
+from ziggurat_foundations.tests import add_resource, BaseTestCase, create_default_tree
+from ziggurat_foundations.tests.conftest import (
+    ResourceClosure,
+    ResourceTestObj,
+    child_ids,
+)
+
+tree_service = ResourceTreeService(ResourceTreeServiceClosure)
+maintained_service = ResourceTreeServiceClosure
+
+
+def closure_rows(db_session):
+    rows = db_session.query(ResourceClosure)
+    return sorted((row.ancestor_id, row.descendant_id, row.depth) for row in rows)
+
+
+class TestClosureTree(BaseTestCase):
+    def test_insert(self, maintained_session):
+        db_session = maintained_session
+        root = add_resource(db_session, -1, "root", ordering=1)
+        # child and grandchild inserted in single flush
+        db_session.add(ResourceTestObj(resource_id=2, resource_name="b", parent_id=1))
+        db_session.add(
+            ResourceTestObj(
+                resource_id=1, resource_name="a", parent_id=root.resource_id
+            )
+        )
+        db_session.flush()
+        assert closure_rows(db_session) == [
+            (-1, -1, 0),
+            (-1, 1, 1),
+            (-1, 2, 2),
+            (1, 1, 0),
+            (1, 2, 1),
+            (2, 2, 0),
+        ]
+
+    def test_rebuild(self, maintained_session):
+        db_session = maintained_session
+        create_default_tree(db_session)
+        maintained = closure_rows(db_session)
+        db_session.query(ResourceClosure).delete()
+        ResourceTreeServiceClosure.rebuild(db_session=db_session)
+        assert closure_rows(db_session) == maintained
+        assert len(maintained) == 15 + 12 + 7 + 2 + 1
+
+    def test_root_nesting(self, maintained_session):
+        db_session = maintained_session
+        root = create_default_tree(db_session)[0]
+        result = tree_service.from_resource_deeper(
+            root.resource_id, db_session=db_session
+        )
+        tree_struct = tree_service.build_subtree_strut(result)["children"][-1]
+        assert child_ids(tree_struct) == [1, 2, 3, 10, 11]
+        assert child_ids(tree_struct["children"][1]) == [5, 6, 7, 8]
+        assert child_ids(tree_struct["children"][2]) == [4]
+        assert child_ids(tree_struct["children"][1]["children"][7]) == [9]
+
+    def test_full_nesting_with_limit(self, maintained_session):
+        db_session = maintained_session
+        create_default_tree(db_session)
+        result = tree_service.from_parent_deeper(
+            None, limit_depth=2, db_session=db_session
+        )
+        tree_struct = tree_service.build_subtree_strut(result)
+        assert child_ids(tree_struct) == [-1, -2, -3]
+        assert child_ids(tree_struct["children"][-1]) == [1, 2, 3, 10, 11]
+        assert child_ids(tree_struct["children"][-1]["children"][1]) == []
+
+        result = tree_service.from_parent_deeper(
+            1, limit_depth=2, db_session=db_session
+        )
+        assert [(r.Resource.resource_id, r.depth) for r in result] == [
+            (5, 1),
+            (6, 1),
+            (7, 1),
+            (8, 1),
+            (9, 2),
+        ]
+
+    def test_going_up_hierarchy(self, maintained_session):
+        db_session = maintained_session
+        create_default_tree(db_session)
+        result = tree_service.path_upper(9, db_session=db_session)
+        assert [r.resource_id for r in result] == [9, 7, 1, -1]
+        result = tree_service.path_upper(9, limit_depth=2, db_session=db_session)
+        assert [r.resource_id for r in result] == [9, 7]
+
+    def test_move_on_different_branch(self, maintained_session):
+        db_session = maintained_session
+        create_default_tree(db_session)
+        tree_service.move_to_position(
+            7, new_parent_id=2, to_position=1, db_session=db_session
+        )
+        result = tree_service.path_upper(12, db_session=db_session)
+        assert [r.resource_id for r in result] == [12, 9, 7, 2, -1]
+        result = tree_service.from_resource_deeper(1, db_session=db_session)
+        tree_struct = tree_service.build_subtree_strut(result)["children"][1]
+        assert child_ids(tree_struct) == [5, 6, 8]
+        assert [n["node"].ordering for n in tree_struct["children"].values()] == [
+            1,
+            2,
+            3,
+        ]
+        result = tree_service.from_resource_deeper(2, db_session=db_session)
+        tree_struct = tree_service.build_subtree_strut(result)["children"][2]
+        assert child_ids(tree_struct) == [7, 4]
+        maintained = closure_rows(db_session)
+        ResourceTreeServiceClosure.rebuild(db_session=db_session)
+        assert closure_rows(db_session) == maintained
+
+    def test_move_to_root(self, maintained_session):
+        db_session = maintained_session
+        create_default_tree(db_session)
+        tree_service.move_to_position(
+            7, new_parent_id=None, to_position=1, db_session=db_session
+        )
+        result = tree_service.path_upper(12, db_session=db_session)
+        assert [r.resource_id for r in result] == [12, 9, 7]
+        result = tree_service.from_parent_deeper(
+            None, limit_depth=1, db_session=db_session
+        )
+        assert [r.Resource.resource_id for r in result] == [7, -1, -2, -3]
+
+    def test_move_inside_itself(self, maintained_session):
+        db_session = maintained_session
+        create_default_tree(db_session)
+        with pytest.raises(ZigguratResourceTreePathException):
+            tree_service.move_to_position(
+                1, to_position=1, new_parent_id=9, db_session=db_session
+            )
+
+    def test_delete_branch(self, maintained_session):
+        db_session = maintained_session
+        create_default_tree(db_session)
+        tree_service.delete_branch(1, db_session=db_session)
+        db_session.expire_all()
+        result = tree_service.from_resource_deeper(-1, db_session=db_session)
+        tree_struct = tree_service.build_subtree_strut(result)["children"][-1]
+        assert child_ids(tree_struct) == [2, 3, 10, 11]
+        assert [n["node"].ordering for n in tree_struct["children"].values()] == [
+            1,
+            2,
+            3,
+            4,
+        ]
+        remaining = set(r[1] for r in closure_rows(db_session))
+        assert remaining == set([-1, -2, -3, 2, 3, 4, 10, 11])
+
+    def test_closure_deletes_use_derived_tables(self, maintained_session):
+        # MySQL refuses DELETE reading the deleted table in plain subquery,
+        # subtree ids are never bound one parameter per node
+        db_session = maintained_session
+        create_default_tree(db_session)
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, *args):
+            if statement.startswith("DELETE FROM"):
+                statements.append((statement, parameters))
+
+        engine = db_session.get_bind()
+        sa.event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            tree_service.move_to_position(
+                7, new_parent_id=2, to_position=1, db_session=db_session
+            )
+            tree_service.delete_branch(2, db_session=db_session)
+        finally:
+            sa.event.remove(engine, "before_cursor_execute", before_cursor_execute)
+        assert len(statements) == 4
+        for statement, parameters in statements:
+            assert len(parameters) <= 3
+            if statement.startswith("DELETE FROM resources_closure"):
+                # every read of the table goes through derived table
+                reads = statement.count("FROM resources_closure") - 1
+                assert reads == statement.count("FROM (SELECT DISTINCT")
+        maintained = closure_rows(db_session)
+        ResourceTreeServiceClosure.rebuild(db_session=db_session)
+        assert closure_rows(db_session) == maintained
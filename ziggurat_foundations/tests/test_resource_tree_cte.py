@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+from __future__ import with_statement, unicode_literals
+
+import pytest
+from sqlalchemy.dialects import mysql, postgresql
+
+from ziggurat_foundations.exc import (
+    ZigguratResourceOutOfBoundaryException,
+    ZigguratResourceTreePathException,
+)
+from ziggurat_foundations.models.services import BaseService
+from ziggurat_foundations.models.services.resource_tree import ResourceTreeService
+from ziggurat_foundations.models.services.resource_tree_cte import (
+    ResourceTreeServiceCTE,
+)
+from ziggurat_foundations.tests import BaseTestCase, create_default_tree
+from ziggurat_foundations.tests.conftest import Resource, child_ids
+
+tree_service = ResourceTreeService(ResourceTreeServiceCTE)
+
+
+class TestCTETree(BaseTestCase):
+    def test_root_nesting(self, db_session):
+        root = create_default_tree(db_session)[0]
+        result = tree_service.from_resource_deeper(
+            root.resource_id, db_session=db_session
+        )
+        rows = result.all()
+        assert [r.Resource.resource_id for r in rows] == [
+            -1,
+            1,
+            5,
+            6,
+            7,
+            9,
+            12,
+            8,
+            2,
+            4,
+            3,
+            10,
+            11,
+        ]
+        assert rows[5].depth == 4
+        assert rows[5].path == "-1/1/7/9"
+        assert rows[5].sorting == "0000001/0000001/0000003/0000001"
+        tree_struct = tree_service.build_subtree_strut(rows)["children"][-1]
+        assert child_ids(tree_struct) == [1, 2, 3, 10, 11]
+        assert child_ids(tree_struct["children"][1]) == [5, 6, 7, 8]
+
+    def test_full_nesting(self, db_session):
+        create_default_tree(db_session)
+        result = tree_service.from_parent_deeper(db_session=db_session)
+        tree_struct = tree_service.build_subtree_strut(result)
+        assert child_ids(tree_struct) == [-1, -2, -3]
+        assert child_ids(tree_struct["children"][-1]) == [1, 2, 3, 10, 11]
+
+    def test_branch_data_with_limit(self, db_session):
+        create_default_tree(db_session)
+        result = tree_service.from_resource_deeper(
+            1, limit_depth=2, db_session=db_session
+        )
+        assert [r.Resource.resource_id for r in result] == [1, 5, 6, 7, 8]
+        result = tree_service.from_parent_deeper(
+            1, limit_depth=2, db_session=db_session
+        )
+        assert [(r.Resource.resource_id, r.depth) for r in result] == [
+            (5, 1),
+            (6, 1),
+            (7, 1),
+            (9, 2),
+            (8, 1),
+        ]
+
+    def test_going_up_hierarchy(self, db_session):
+        create_default_tree(db_session)
+        result = tree_service.path_upper(9, db_session=db_session)
+        assert [r.resource_id for r in result] == [9, 7, 1, -1]
+        result = tree_service.path_upper(9, limit_depth=2, db_session=db_session)
+        assert [r.resource_id for r in result] == [9, 7]
+
+    def test_statements_are_reused(self, db_session):
+        create_default_tree(db_session)
+        key = (ResourceTreeServiceCTE, Resource, "from_resource_deeper")
+        tree_service.from_resource_deeper(1, db_session=db_session).all()
+        statement = BaseService._statements[key][1]
+        result = tree_service.from_resource_deeper(-1, db_session=db_session)
+        assert len(result.all()) == 13
+        assert BaseService._statements[key][1] is statement
+
+    def test_move_on_different_branch(self, db_session):
+        create_default_tree(db_session)
+        tree_service.move_to_position(
+            7, new_parent_id=2, to_position=1, db_session=db_session
+        )
+        result = tree_service.path_upper(12, db_session=db_session)
+        assert [r.resource_id for r in result] == [12, 9, 7, 2, -1]
+        result = tree_service.from_resource_deeper(
+            1, limit_depth=2, db_session=db_session
+        )
+        tree_struct = tree_service.build_subtree_strut(result)["children"][1]
+        assert child_ids(tree_struct) == [5, 6, 8]
+        assert [n["node"].ordering for n in tree_struct["children"].values()] == [
+            1,
+            2,
+            3,
+        ]
+
+    def test_move_inside_itself(self, db_session):
+        create_default_tree(db_session)
+        with pytest.raises(ZigguratResourceTreePathException):
+            tree_service.move_to_position(
+                1, to_position=1, new_parent_id=9, db_session=db_session
+            )
+
+    def test_move_after_last_on_same_branch(self, db_session):
+        create_default_tree(db_session)
+        with pytest.raises(ZigguratResourceOutOfBoundaryException):
+            tree_service.move_to_position(3, to_position=6, db_session=db_session)
+
+    def test_delete_branch(self, db_session):
+        create_default_tree(db_session)
+        tree_service.delete_branch(1, db_session=db_session)
+        db_session.expire_all()
+        result = tree_service.from_parent_deeper(
+            -1, limit_depth=1, db_session=db_session
+        )
+        assert [(r.Resource.resource_id, r.Resource.ordering) for r in result] == [
+            (2, 1),
+            (3, 2),
+            (10, 3),
+            (11, 4),
+        ]
+        result = tree_service.from_parent_deeper(db_session=db_session)
+        assert [r.Resource.resource_id for r in result] == [
+            -1,
+            2,
+            4,
+            3,
+            10,
+            11,
+            -2,
+            -3,
+        ]
+
+    @pytest.mark.parametrize(
+        "dialect, padding",
+        [
+            (postgresql.dialect(), "lpad(CAST(res_u.ordering AS VARCHAR), 7, '0')"),
+            (mysql.dialect(), "lpad(CAST(res_u.ordering AS CHAR), 7, '0')"),
+        ],
+    )
+    def test_compiles_for_dialect(self, dialect, padding):
+        statement = ResourceTreeServiceCTE._cached_statement(
+            "from_resource_deeper_test",
+            lambda: ResourceTreeServiceCTE._subtree_statement(True),
+        )
+        assert padding in str(statement.compile(dialect=dialect))
+
+    def test_delete_branch_reads_derived_table(self):
+        # MySQL refuses DELETE with subquery reading the same table
+        statement = ResourceTreeServiceCTE._delete_branch_statement()
+        compiled = str(statement.compile(dialect=mysql.dialect()))
+        assert "IN (SELECT branch.resource_id \nFROM (SELECT DISTINCT" in compiled
+        # subtree is never bound one parameter per node
+        assert compiled.count("%s") == 4
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+from __future__ import with_statement, unicode_literals
+
+import pytest
+import sqlalchemy as sa
+
+from ziggurat_foundations.exc import (
+    ZigguratResourceOutOfBoundaryException,
+    ZigguratResourceTreePathException,
+)
+from ziggurat_foundations.models.services.resource_tree import ResourceTreeService
+from ziggurat_foundations.models.services.resource_tree_gap import (
+    ResourceTreeServiceGapOrdering,
+)
+from ziggurat_foundations.tests import add_resource, BaseTestCase, create_default_tree
+from ziggurat_foundations.tests.conftest import Resource, not_postgres
+
+tree_service = ResourceTreeService(ResourceTreeServiceGapOrdering)
+
+
+def children(db_session, parent_id):
+    statement = sa.select(Resource.resource_id, Resource.ordering)
+    statement = statement.where(Resource.parent_id == parent_id)
+    statement = statement.order_by(Resource.ordering, Resource.resource_id)
+    return db_session.execute(statement).all()
+
+
+def child_ids(db_session, parent_id):
+    return [row.resource_id for row in children(db_session, parent_id)]
+
+
+class TestGapOrdering(BaseTestCase):
+    def test_move_on_same_branch(self, db_session):
+        create_default_tree(db_session)
+        assert child_ids(db_session, -1) == [1, 2, 3, 10, 11]
+        # dense legacy ordering gets renumbered on first move
+        tree_service.move_to_position(11, to_position=2, db_session=db_session)
+        assert child_ids(db_session, -1) == [1, 11, 2, 3, 10]
+        before = dict(children(db_session, -1))
+        gap = ResourceTreeServiceGapOrdering.gap
+        assert [before[i] for i in (1, 2, 3, 10)] == [gap, gap * 2, gap * 3, gap * 4]
+
+        tree_service.move_to_position(1, to_position=4, db_session=db_session)
+        assert child_ids(db_session, -1) == [11, 2, 3, 1, 10]
+        tree_service.move_to_position(10, to_position=1, db_session=db_session)
+        assert child_ids(db_session, -1) == [10, 11, 2, 3, 1]
+        tree_service.move_to_position(11, to_position=5, db_session=db_session)
+        assert child_ids(db_session, -1) == [10, 2, 3, 1, 11]
+        after = dict(children(db_session, -1))
+        # only moved nodes were written
+        assert sorted(i for i in before if before[i] != after[i]) == [1, 10, 11]
+
+    def test_move_between_branches(self, db_session):
+        create_default_tree(db_session)
+        tree_service.move_to_position(
+            5, to_position=2, new_parent_id=2, db_session=db_session
+        )
+        assert child_ids(db_session, 1) == [6, 7, 8]
+        assert child_ids(db_session, 2) == [4, 5]
+        tree_service.move_to_position(
+            6, to_position=1, new_parent_id=None, db_session=db_session
+        )
+        assert child_ids(db_session, None) == [6, -1, -2, -3]
+        with pytest.raises(ZigguratResourceTreePathException):
+            tree_service.move_to_position(
+                1, to_position=1, new_parent_id=9, db_session=db_session
+            )
+        with pytest.raises(ZigguratResourceOutOfBoundaryException):
+            tree_service.move_to_position(
+                7, to_position=4, new_parent_id=2, db_session=db_session
+            )
+
+    def test_set_position_and_delete(self, db_session):
+        create_default_tree(db_session)
+        add_resource(db_session, 20, "new", parent_id=1, ordering=0)
+        tree_service.set_position(20, to_position=3, db_session=db_session)
+        assert child_ids(db_session, 1) == [5, 6, 20, 7, 8]
+        add_resource(db_session, 21, "last", parent_id=1, ordering=0)
+        tree_service.set_position(21, to_position=6, db_session=db_session)
+        assert child_ids(db_session, 1) == [5, 6, 20, 7, 8, 21]
+        orderings = dict(children(db_session, 1))
+        tree_service.delete_branch(7, db_session=db_session)
+        remaining = dict(children(db_session, 1))
+        assert list(remaining) == [5, 6, 20, 8, 21]
+        assert all(remaining[i] == orderings[i] for i in remaining)
+        tree_service.move_to_position(21, to_position=4, db_session=db_session)
+        assert child_ids(db_session, 1) == [5, 6, 20, 21, 8]
+
+    def test_rebalance_when_gap_is_exhausted(self, db_session):
+        root = add_resource(db_session, 1, "root")
+        for i in range(2, 5):
+            add_resource(db_session, i, "child %s" % i, parent_id=1, ordering=0)
+            tree_service.set_position(i, to_position=i - 1, db_session=db_session)
+        for i in range(5, 20):
+            # keeps inserting right after first child until values run out
+            add_resource(db_session, i, "child %s" % i, parent_id=1, ordering=0)
+            tree_service.set_position(i, to_position=2, db_session=db_session)
+        assert child_ids(db_session, root.resource_id) == [2] + list(
+            range(19, 4, -1)
+        ) + [3, 4]
+        orderings = [o for _, o in children(db_session, root.resource_id)]
+        assert len(set(orderings)) == len(orderings)
+
+    @pytest.mark.skipif(not_postgres, reason="requires postgres")
+    def test_subtree_sorting(self, db_session):
+        root = create_default_tree(db_session)[0]
+        tree_service.move_to_position(3, to_position=1, db_session=db_session)
+        result = tree_service.from_resource_deeper(
+            root.resource_id, limit_depth=2, db_session=db_session
+        )
+        tree = tree_service.build_subtree_strut(result)["children"][root.resource_id]
+        assert list(tree["children"]) == [3, 1, 2, 10, 11]
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+from __future__ import with_statement, unicode_literals
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.ext.declarative import declarative_base
+
+from ziggurat_foundations.exc import ZigguratResourceTreePathException
+from ziggurat_foundations.models.resource_tree_path import ResourceTreePathMixin
+from ziggurat_foundations.models.services.resource_tree_path import (
+    ResourceTreeServiceMaterializedPath,
+)
+from ziggurat_foundations.tests import BaseTestCase, create_default_tree
+from ziggurat_foundations.tests.conftest import child_ids
+
+PathBase = declarative_base()
+
+
+class PathResource(ResourceTreePathMixin, PathBase):
+    __tablename__ = "path_resources"
+    resource_id = sa.Column(sa.Integer(), primary_key=True, autoincrement=False)
+    parent_id = sa.Column(
+        sa.Integer(), sa.ForeignKey("path_resources.resource_id", ondelete="CASCADE")
+    )
+    ordering = sa.Column(sa.Integer(), default=0, nullable=False)
+    resource_name = sa.Column(sa.Unicode(100), nullable=False)
+
+
+class PathTreeService(ResourceTreeServiceMaterializedPath):
+    model = PathResource
+
+
+tree_service = PathTreeService
+maintained_service = PathTreeService
+
+
+@pytest.fixture
+def db_session(db_session):
+    """
+    default session with tables of path test model created
+    """
+    bind = db_session.get_bind()
+    PathBase.metadata.drop_all(bind)
+    PathBase.metadata.create_all(bind)
+    return db_session
+
+
+def add_node(db_session, resource_id, resource_name="node", parent_id=None, ordering=1):
+    node = PathResource(
+        resource_id=resource_id,
+        resource_name=resource_name,
+        parent_id=parent_id,
+        ordering=ordering,
+    )
+    db_session.add(node)
+    db_session.flush()
+    return node
+
+
+def stored_paths(db_session):
+    statement = sa.select(PathResource.resource_id, PathResource.tree_path)
+    return dict(db_session.execute(statement).all())
+
+
+class TestMaterializedPath(BaseTestCase):
+    def test_path_encoding(self):
+        tree_path = tree_service.path_segment(1, -1) + tree_service.path_segment(
+            2048, 7
+        )
+        assert len(tree_path) == 32
+        assert tree_service.path_ids(tree_path) == [-1, 7]
+        assert tree_service.max_depth() == 32
+
+    def test_insert_and_rebuild(self, maintained_session):
+        db_session = maintained_session
+        create_default_tree(db_session, add=add_node)
+        maintained = stored_paths(db_session)
+        assert maintained[12].startswith(maintained[9])
+        assert tree_service.path_ids(maintained[12]) == [-1, 1, 7, 9, 12]
+        db_session.execute(sa.update(PathResource).values(tree_path=None))
+        tree_service.rebuild(db_session=db_session)
+        assert stored_paths(db_session) == maintained
+        assert db_session.get(PathResource, 12).tree_path == maintained[12]
+
+    def test_root_nesting(self, maintained_session):
+        db_session = maintained_session
+        root = create_default_tree(db_session, add=add_node)[0]
+        result = tree_service.from_resource_deeper(
+            root.resource_id, db_session=db_session
+        )
+        rows = result.all()
+        assert [r[0].resource_id for r in rows] == [
+            -1,
+            1,
+            5,
+            6,
+            7,
+            9,
+            12,
+            8,
+            2,
+            4,
+            3,
+            10,
+            11,
+        ]
+        assert [r.depth for r in rows[:7]] == [1, 2, 3, 3, 3, 4, 5]
+        tree_struct = tree_service.build_subtree_strut(rows)["children"][-1]
+        assert child_ids(tree_struct) == [1, 2, 3, 10, 11]
+        assert child_ids(tree_struct["children"][1]) == [5, 6, 7, 8]
+
+    def test_branch_data_with_limit(self, maintained_session):
+        db_session = maintained_session
+        create_default_tree(db_session, add=add_node)
+        result = tree_service.from_resource_deeper(
+            1, limit_depth=2, db_session=db_session
+        )
+        assert [r[0].resource_id for r in result] == [1, 5, 6, 7, 8]
+        result = tree_service.from_parent_deeper(
+            1, limit_depth=2, db_session=db_session
+        )
+        assert [(r[0].resource_id, r.depth) for r in result] == [
+            (5, 1),
+            (6, 1),
+            (7, 1),
+            (9, 2),
+            (8, 1),
+        ]
+        result = tree_service.from_parent_deeper(
+            None, limit_depth=1, db_session=db_session
+        )
+        assert [r[0].resource_id for r in result] == [-1, -2, -3]
+
+    def test_going_up_hierarchy(self, maintained_session):
+        db_session = maintained_session
+        create_default_tree(db_session, add=add_node)
+        result = tree_service.path_upper(9, db_session=db_session)
+        assert [r.resource_id for r in result] == [9, 7, 1, -1]
+        result = tree_service.path_upper(9, limit_depth=2, db_session=db_session)
+        assert [r.resource_id for r in result] == [9, 7]
+
+    def test_move_on_different_branch(self, maintained_session):
+        db_session = maintained_session
+        create_default_tree(db_session, add=add_node)
+        tree_service.move_to_position(
+            7, new_parent_id=2, to_position=1, db_session=db_session
+        )
+        result = tree_service.path_upper(12, db_session=db_session)
+        assert [r.resource_id for r in result] == [12, 9, 7, 2, -1]
+        result = tree_service.from_resource_deeper(2, db_session=db_session)
+        assert [r[0].resource_id for r in result] == [2, 7, 9, 12, 4]
+        maintained = stored_paths(db_session)
+        tree_service.rebuild(db_session=db_session)
+        assert stored_paths(db_session) == maintained
+
+    def test_move_on_same_branch(self, maintained_session):
+        db_session = maintained_session
+        create_default_tree(db_session, add=add_node)
+        tree_service.move_to_position(11, to_position=1, db_session=db_session)
+        tree_service.move_to_position(1, to_position=4, db_session=db_session)
+        result = tree_service.from_parent_deeper(
+            -1, limit_depth=1, db_session=db_session
+        )
+        assert [r[0].resource_id for r in result] == [11, 2, 3, 1, 10]
+        result = tree_service.from_resource_deeper(1, db_session=db_session)
+        assert [r[0].resource_id for r in result] == [1, 5, 6, 7, 9, 12, 8]
+        maintained = stored_paths(db_session)
+        tree_service.rebuild(db_session=db_session)
+        assert stored_paths(db_session) == maintained
+
+    def test_set_position(self, maintained_session):
+        db_session = maintained_session
+        create_default_tree(db_session, add=add_node)
+        add_node(db_session, 13, "new", parent_id=-1, ordering=None)
+        tree_service.set_position(13, to_position=2, db_session=db_session)
+        result = tree_service.from_parent_deeper(
+            -1, limit_depth=1, db_session=db_session
+        )
+        assert [r[0].resource_id for r in result] == [1, 13, 2, 3, 10, 11]
+
+    def test_move_inside_itself(self, maintained_session):
+        db_session = maintained_session
+        create_default_tree(db_session, add=add_node)
+        with pytest.raises(ZigguratResourceTreePathException):
+            tree_service.move_to_position(
+                1, to_position=1, new_parent_id=9, db_session=db_session
+            )
+
+    def test_delete_branch(self, maintained_session):
+        db_session = maintained_session
+        create_default_tree(db_session, add=add_node)
+        tree_service.delete_branch(1, db_session=db_session)
+        assert sorted(stored_paths(db_session)) == [-3, -2, -1, 2, 3, 4, 10, 11]
+
+    def test_depth_limit(self, maintained_session):
+        db_session = maintained_session
+        for resource_id in range(1, tree_service.max_depth() + 1):
+            add_node(db_session, resource_id, parent_id=resource_id - 1 or None)
+        with pytest.raises(ZigguratResourceTreePathException) as exc:
+            add_node(db_session, 100, parent_id=tree_service.max_depth())
+        assert str(exc.value) == (
+            "Resource tree is limited to 32 levels by tree_path column"
+        )
+
+    def test_depth_limit_on_move(self, maintained_session):
+        db_session = maintained_session
+        for resource_id in range(1, tree_service.max_depth() + 1):
+            add_node(db_session, resource_id, parent_id=resource_id - 1 or None)
+        add_node(db_session, 100)
+        add_node(db_session, 101, parent_id=100)
+        with pytest.raises(ZigguratResourceTreePathException):
+            tree_service.move_to_position(
+                100, new_parent_id=31, to_position=2, db_session=db_session
+            )
+
+    def test_missing_paths(self, db_session):
+        # resources inserted without listener have no paths
+        create_default_tree(db_session, add=add_node)
+        with pytest.raises(ZigguratResourceTreePathException) as exc:
+            tree_service.delete_branch(1, db_session=db_session)
+        assert "Resource 1 has no tree_path" in str(exc.value)
+        with pytest.raises(ZigguratResourceTreePathException):
+            tree_service.move_to_position(
+                5, new_parent_id=2, to_position=1, db_session=db_session
+            )
+        with pytest.raises(ZigguratResourceTreePathException):
+            tree_service.update_path(1, db_session=db_session)
+        tree_service.rebuild(db_session=db_session)
+        tree_service.delete_branch(1, db_session=db_session)
+        assert sorted(stored_paths(db_session)) == [-3, -2, -1, 2, 3, 4, 10, 11]
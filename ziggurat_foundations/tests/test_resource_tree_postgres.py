@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 from __future__ import with_statement, unicode_literals
 
+import collections
 import pprint
 
 import pytest
+import sqlalchemy as sa
 
 from ziggurat_foundations.models.services.resource import ResourceService
 from ziggurat_foundations.models.services.resource_tree import ResourceTreeService
@@ -23,6 +25,53 @@ class TestResources(BaseTestCase):
         assert resource.resource_id == 1
         assert resource.resource_name == "root"
 
+    def test_delete_branch_sql_uses_model_table(self):
+        class CustomResource(object):
+            __table__ = sa.table("custom_resources")
+
+        class CustomTreeService(ResourceTreeServicePostgreSQL):
+            model = CustomResource
+
+        raw_q = CustomTreeService._delete_branch_sql()
+        assert "DELETE FROM custom_resources " in raw_q
+        assert " resources " not in raw_q
+
+    def test_build_subtree_strut_from_rows(self, db_session):
+        create_default_tree(db_session)
+        Row = collections.namedtuple("Row", ["Resource", "depth"])
+        ids = [1, 5, 6, 7, 9, 12, 8]
+        rows = [Row(ResourceService.get(i, db_session=db_session), None) for i in ids]
+        tree = tree_service.build_subtree_strut(rows)
+        assert list(tree["children"].keys()) == [1]
+        tree_struct = tree["children"][1]
+        assert list(tree_struct["children"].keys()) == [5, 6, 7, 8]
+        l_ac_nodes = tree_struct["children"][7]["children"]
+        assert list(l_ac_nodes.keys()) == [9]
+        assert list(l_ac_nodes[9]["children"].keys()) == [12]
+
+    def test_iter_subtree_strut_streams_branches(self, db_session):
+        create_default_tree(db_session)
+        ids = [-1, 1, 5, 6, 7, 9, 12, 8, 2, 4, 3, 10, 11, -2, -3]
+        consumed = []
+
+        def resources():
+            for i in ids:
+                consumed.append(i)
+                yield ResourceService.get(i, db_session=db_session)
+
+        branches = tree_service.iter_subtree_strut(resources())
+        tree_struct = next(branches)
+        # branch is returned once first node of next branch is read
+        assert consumed == ids[:-1]
+        assert tree_struct["node"].resource_id == -1
+        assert list(tree_struct["children"].keys()) == [1, 2, 3, 10, 11]
+        assert list(tree_struct["children"][2]["children"].keys()) == [4]
+        assert [b["node"].resource_id for b in branches] == [-2, -3]
+
+    def test_build_subtree_strut_empty(self):
+        tree = tree_service.build_subtree_strut([])
+        assert tree == {"node": None, "children": {}}
+
     @pytest.mark.skipif(not_postgres, reason="requires postgres")
     def test_root_nesting(self, db_session):
         root = create_default_tree(db_session)[0]
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+from __future__ import with_statement, unicode_literals
+
+from ziggurat_foundations.throttle import LoginThrottle, MemoryThrottleBackend
+
+
+class FakeTimer(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestMemoryThrottleBackend(object):
+    def test_consume_and_refill(self):
+        timer = FakeTimer()
+        backend = MemoryThrottleBackend(timer=timer)
+        assert [backend.consume("key", 3, 0.5) for _ in range(4)] == [
+            True,
+            True,
+            True,
+            False,
+        ]
+        timer.now = 1.0
+        assert backend.consume("key", 3, 0.5) is False
+        timer.now = 2.0
+        assert backend.consume("key", 3, 0.5) is True
+        assert backend.consume("key", 3, 0.5) is False
+        # refill never exceeds capacity
+        timer.now = 100.0
+        assert [backend.consume("key", 3, 0.5) for _ in range(4)] == [
+            True,
+            True,
+            True,
+            False,
+        ]
+        backend.reset("key")
+        assert backend.consume("key", 3, 0.5) is True
+
+    def test_max_keys(self):
+        backend = MemoryThrottleBackend(max_keys=2)
+        for key in ("a", "b", "c"):
+            assert backend.consume(key, 1, 0)
+        assert len(backend) == 2
+        assert backend.consume("a", 1, 0) is True
+        assert backend.consume("c", 1, 0) is False
+
+
+class TestLoginThrottle(object):
+    def test_user_name_limit(self):
+        throttle = LoginThrottle(user_capacity=2, user_refill_rate=0)
+        assert throttle.allow("User", "127.0.0.1")
+        assert throttle.allow("user", "127.0.0.2")
+        assert not throttle.allow("USER", "127.0.0.3")
+        assert throttle.allow("other", "127.0.0.1")
+        throttle.succeeded("user")
+        assert throttle.allow("user", "127.0.0.1")
+
+    def test_address_limit(self):
+        throttle = LoginThrottle(ip_capacity=2, ip_refill_rate=0)
+        assert throttle.allow("user1", "127.0.0.1")
+        assert throttle.allow("user2", "127.0.0.1")
+        assert not throttle.allow("user3", "127.0.0.1")
+        assert throttle.allow("user3", "127.0.0.2")
+        # rejected by address limit, user name bucket is untouched
+        throttle = LoginThrottle(user_capacity=1, ip_capacity=0, ip_refill_rate=0)
+        assert not throttle.allow("user", "127.0.0.1")
+        assert throttle.allow("user")
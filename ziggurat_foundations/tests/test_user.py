@@ -1,11 +1,39 @@
 # -*- coding: utf-8 -*-
 from __future__ import with_statement, unicode_literals
 
+import asyncio
+
+import mock
+import pytest
 import six
+import sqlalchemy as sa
+from sqlalchemy.orm import sessionmaker
 
+from ziggurat_foundations import make_passwordmanager
+from ziggurat_foundations.hashing import HashMigrationQueue, PasswordHasher
+from ziggurat_foundations.models.services.resource import ResourceService
 from ziggurat_foundations.models.services.user import UserService
-from ziggurat_foundations.tests import BaseTestCase, add_user
-from ziggurat_foundations.tests.conftest import User
+from ziggurat_foundations.permissions import ALL_PERMISSIONS
+from ziggurat_foundations.tests import (
+    BaseTestCase,
+    add_group,
+    add_resource,
+    add_user,
+)
+from ziggurat_foundations.tests.conftest import (
+    Base,
+    GroupResourcePermission,
+    User,
+    UserGroup,
+)
+
+
+@pytest.fixture
+def file_session_factory(tmp_path):
+    engine = sa.create_engine("sqlite:///%s" % tmp_path.joinpath("users.sqlite"))
+    Base.metadata.create_all(engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
 
 
 class TestUser(BaseTestCase):
@@ -43,6 +71,48 @@ class TestUser(BaseTestCase):
         user = add_user(db_session)
         assert UserService.check_password(user, "wrong_password") is False
 
+    def test_check_password_hasher(self, db_session):
+        user = add_user(db_session)
+        hasher = PasswordHasher(max_workers=2)
+        try:
+            assert UserService.check_password(user, "password", hasher=hasher) is True
+            assert UserService.check_password(user, "wrong", hasher=hasher) is False
+            UserService.set_password(user, "new_password", hasher=hasher)
+            assert UserService.check_password(user, "new_password") is True
+        finally:
+            hasher.shutdown()
+
+    def test_password_hasher_async(self, db_session):
+        user = add_user(db_session)
+        hasher = PasswordHasher(max_workers=2)
+
+        async def change_password():
+            await UserService.set_password_async(user, "new_password", hasher)
+            return await asyncio.gather(
+                UserService.check_password_async(user, "password", hasher),
+                UserService.check_password_async(user, "new_password", hasher),
+            )
+
+        try:
+            assert asyncio.run(change_password()) == [False, True]
+        finally:
+            hasher.shutdown()
+
+    def test_password_hasher_processes(self, db_session):
+        user = add_user(db_session)
+        hasher = PasswordHasher(max_workers=1, use_processes=True)
+        try:
+            assert UserService.check_password(user, "password", hasher=hasher) is True
+            legacy = make_passwordmanager(["md5_crypt"]).hash("password")
+            user.user_password = legacy
+            user.passwordmanager = make_passwordmanager(["sha256_crypt", "md5_crypt"])
+            assert UserService.check_password(user, "password", hasher=hasher) is True
+            assert user.user_password != legacy
+            assert user.user_password.startswith("$5$")
+        finally:
+            del user.passwordmanager
+            hasher.shutdown()
+
     def test_by_user_name_existing(self, db_session):
         created_user = add_user(db_session)
         queried_user = UserService.by_user_name("username", db_session=db_session)
@@ -158,6 +228,93 @@ class TestUser(BaseTestCase):
 
         assert queried_user is None
 
+    def test_by_user_name_or_email(self, db_session):
+        user = add_user(db_session, user_name="username", email="Email@example.com")
+        other = add_user(db_session, user_name="email@example.com", email="other")
+        db_session.expire_all()
+        found = UserService.by_user_name_or_email("USERNAME", db_session=db_session)
+        assert found is user
+        assert "groups" not in sa.inspect(found).dict
+        found = UserService.by_user_name_or_email("other", db_session=db_session)
+        assert found is other
+        # user name match wins over email of another user
+        found = UserService.by_user_name_or_email(
+            "EMAIL@example.com", db_session=db_session
+        )
+        assert found is other
+        assert UserService.by_user_name_or_email("none", db_session=db_session) is None
+        assert UserService.by_user_name_or_email(None, db_session=db_session) is None
+
+    def test_bulk_create(self, db_session):
+        add_user(db_session)
+        rows = [
+            {"user_name": "bulk%s" % i, "email": "bulk%s@example.com" % i}
+            for i in range(5)
+        ]
+        for i, row in enumerate(rows[:3]):
+            row["password"] = "password%s" % i
+        hasher = PasswordHasher(max_workers=2)
+        try:
+            ids = UserService.bulk_create(
+                rows, hasher=hasher, batch_size=2, db_session=db_session
+            )
+        finally:
+            hasher.shutdown()
+        assert "password" in rows[0]
+        assert len(ids) == 5
+        users = [UserService.get(user_id, db_session=db_session) for user_id in ids]
+        assert [u.user_name for u in users] == ["bulk%s" % i for i in range(5)]
+        assert UserService.check_password(users[1], "password1") is True
+        assert UserService.check_password(users[1], "password0") is False
+        assert users[4].user_password is None
+        assert len(set(u.security_code for u in users)) == 5
+        assert all(len(u.security_code) == 64 for u in users)
+        assert users[0].status == 1
+
+    @pytest.mark.parametrize("inline_hashes, pools", [(32, 0), (2, 1)])
+    def test_bulk_create_without_hasher(self, db_session, inline_hashes, pools):
+        rows = [
+            {"user_name": "bulk%s" % i, "email": "bulk%s" % i, "password": "pass"}
+            for i in range(3)
+        ]
+        with mock.patch.object(
+            UserService, "bulk_create_inline_hashes", inline_hashes
+        ), mock.patch(
+            "ziggurat_foundations.models.services.user.PasswordHasher",
+            wraps=PasswordHasher,
+        ) as hasher_cls:
+            ids = UserService.bulk_create(rows, db_session=db_session)
+        assert hasher_cls.call_count == pools
+        for user_id in ids:
+            user = UserService.get(user_id, db_session=db_session)
+            assert UserService.check_password(user, "pass") is True
+        assert UserService.bulk_create([], db_session=db_session) == []
+
+    def test_bulk_create_mismatched_rows(self, db_session):
+        rows = [
+            {"user_name": "bulk1", "email": "bulk1", "password": "pass"},
+            {"user_name": "bulk2", "email": "bulk2", "status": 1},
+        ]
+        with pytest.raises(ValueError) as exc:
+            UserService.bulk_create(rows, db_session=db_session)
+        assert "row 1" in str(exc.value)
+        assert db_session.query(User).count() == 0
+
+    def test_lookup_statements_are_cached(self, db_session):
+        created_user = add_user(db_session)
+        other_user = add_user(db_session, user_name="other", email="other")
+        statement = UserService._cached_statement(
+            "by_user_name", UserService._by_user_name_statement
+        )
+        assert UserService.by_user_name("USERNAME", db_session=db_session) is (
+            created_user
+        )
+        assert UserService.by_user_name("other", db_session=db_session) is other_user
+        assert UserService.by_id(other_user.id, db_session=db_session) is other_user
+        assert statement is UserService._cached_statement(
+            "by_user_name", UserService._by_user_name_statement
+        )
+
     def test_by_mail_and_username(self, db_session):
         created_user = add_user(db_session)
         queried_user = UserService.by_email_and_username(
@@ -230,3 +387,158 @@ class TestUser(BaseTestCase):
 
         assert old_code != new_code
         assert len(new_code) == 64
+
+
+class TestUserGroupIds(BaseTestCase):
+    def set_up_memberships(self, db_session):
+        user = add_user(db_session)
+        groups = [add_group(db_session, group_name="group_%s" % i) for i in range(3)]
+        groups[0].users.append(user)
+        groups[2].users.append(user)
+        db_session.flush()
+        db_session.expire_all()
+        return user, groups
+
+    def test_group_ids_without_loading_groups(self, db_session):
+        user, groups = self.set_up_memberships(db_session)
+        assert UserService.group_ids(user) == frozenset([groups[0].id, groups[2].id])
+        assert "groups" not in sa.inspect(user).dict
+
+    def test_group_ids_uses_loaded_groups(self, db_session):
+        user, groups = self.set_up_memberships(db_session)
+        assert len(user.groups) == 2
+        user.groups.append(groups[1])
+        assert len(UserService.group_ids(user)) == 3
+
+    def test_group_ids_cache_invalidation(self, db_session):
+        user, groups = self.set_up_memberships(db_session)
+        UserService.group_ids(user)
+        db_session.add(UserGroup(user_id=user.id, group_id=groups[1].id))
+        db_session.flush()
+        assert len(UserService.group_ids(user)) == 3
+        groups[0].users.remove(user)
+        assert "groups" not in sa.inspect(user).dict
+        assert UserService.group_ids(user) == frozenset([groups[1].id, groups[2].id])
+        db_session.execute(UserGroup.__table__.delete())
+        assert len(UserService.group_ids(user)) == 2
+        db_session.expire(user)
+        assert UserService.group_ids(user) == frozenset()
+
+    def test_groups_dict(self, db_session):
+        user, groups = self.set_up_memberships(db_session)
+        groups_dict = UserService.groups_dict(user, [groups[2].id])
+        assert groups_dict == {groups[2].id: groups[2]}
+        assert "groups" not in sa.inspect(user).dict
+        assert UserService.groups_dict(user, []) == {}
+
+    def test_perms_for_user_does_not_load_groups(self, db_session):
+        user, groups = self.set_up_memberships(db_session)
+        resource = add_resource(db_session, 1, "test_resource")
+        resource.owner_group_id = groups[2].id
+        resource.group_permissions.append(
+            GroupResourcePermission(perm_name="test_perm", group_id=groups[0].id)
+        )
+        db_session.flush()
+        perms = ResourceService.perms_for_user(resource, user)
+        assert [(p.perm_name, p.group.id) for p in perms] == [
+            ("test_perm", groups[0].id),
+            (ALL_PERMISSIONS, groups[2].id),
+        ]
+        assert "groups" not in sa.inspect(user).dict
+
+
+class TestHashMigrationQueue(BaseTestCase):
+    legacy_manager = make_passwordmanager(["md5_crypt"])
+    manager = make_passwordmanager(["sha256_crypt", "md5_crypt"])
+
+    def set_up_users(self, db_session):
+        users = [
+            add_user(db_session, user_name="user%s" % i, email="email%s" % i)
+            for i in range(3)
+        ]
+        for user in users:
+            user.user_password = self.legacy_manager.hash("password")
+        db_session.commit()
+        for user in users:
+            user.passwordmanager = self.manager
+        return users
+
+    def stored_hashes(self, session_factory):
+        db_session = session_factory()
+        try:
+            query = db_session.query(User.id, User.user_password).order_by(User.id)
+            return dict(query.all())
+        finally:
+            db_session.close()
+
+    def test_check_password_queues_migration(self, file_session_factory):
+        db_session = file_session_factory()
+        users = self.set_up_users(db_session)
+        legacy_hashes = self.stored_hashes(file_session_factory)
+        queue = HashMigrationQueue(file_session_factory, interval=60)
+        try:
+            for user in users:
+                assert UserService.check_password(
+                    user, "password", migration_queue=queue
+                )
+                assert user.user_password == legacy_hashes[user.id]
+            assert not UserService.check_password(
+                users[0], "wrong", migration_queue=queue
+            )
+            assert UserService.check_password(
+                users[0], "password", migration_queue=queue
+            )
+            assert len(queue) == 3
+            assert queue.flush() == 3
+        finally:
+            queue.stop()
+        db_session.close()
+        hashes = self.stored_hashes(file_session_factory)
+        for user in users:
+            assert hashes[user.id] != legacy_hashes[user.id]
+            assert hashes[user.id].startswith("$5$")
+            assert self.manager.verify("password", hashes[user.id])
+
+    def test_stale_hash_is_not_overwritten(self, file_session_factory):
+        db_session = file_session_factory()
+        users = self.set_up_users(db_session)
+        queue = HashMigrationQueue(file_session_factory, interval=60)
+        try:
+            UserService.check_password(users[0], "password", migration_queue=queue)
+            UserService.set_password(users[0], "changed")
+            db_session.commit()
+            new_hash = users[0].user_password
+            queue.flush()
+        finally:
+            queue.stop()
+        db_session.close()
+        assert self.stored_hashes(file_session_factory)[users[0].id] == new_hash
+
+    def test_background_flush(self, file_session_factory):
+        db_session = file_session_factory()
+        users = self.set_up_users(db_session)
+        hasher = PasswordHasher(max_workers=2)
+        queue = HashMigrationQueue(
+            file_session_factory, hasher=hasher, batch_size=2, interval=60
+        )
+        try:
+
+            async def sign_in():
+                return await asyncio.gather(
+                    *[
+                        UserService.check_password_async(
+                            user, "password", hasher, migration_queue=queue
+                        )
+                        for user in users
+                    ]
+                )
+
+            assert asyncio.run(sign_in()) == [True, True, True]
+            queue.stop(timeout=10)
+            assert len(queue) == 0
+        finally:
+            hasher.shutdown()
+        db_session.close()
+        hashes = self.stored_hashes(file_session_factory)
+        assert all(h.startswith("$5$") for h in hashes.values())
+        assert not queue.enqueue(users[0], "password")
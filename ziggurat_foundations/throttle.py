@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Token bucket rate limiting of sign-in attempts.
+"""
+from __future__ import unicode_literals
+
+import threading
+import time
+from collections import OrderedDict
+
+__all__ = ["ThrottleBackend", "MemoryThrottleBackend", "LoginThrottle"]
+
+
+class ThrottleBackend(object):
+    """
+    Interface for token bucket storage used by :class:`LoginThrottle`,
+    implementations shared between processes (for example redis scripts)
+    need to refill and consume tokens atomically.
+    """
+
+    def consume(self, key, capacity, refill_rate, tokens=1):
+        """
+        refills the bucket stored under key by elapsed time and takes tokens
+        from it
+
+        :param key:
+        :param capacity: maximum number of tokens in bucket, new buckets
+            start full
+        :param refill_rate: number of tokens added per second
+        :param tokens: number of tokens to take
+        :return: True if bucket had enough tokens
+        """
+        raise NotImplementedError()
+
+    def reset(self, key):
+        """
+        refills the bucket stored under key
+
+        :param key:
+        """
+        raise NotImplementedError()
+
+
+class MemoryThrottleBackend(ThrottleBackend):
+    """
+    Thread safe in-process backend, least recently used buckets are
+    dropped (which refills them) once ``max_keys`` is exceeded
+
+    :param max_keys: maximum number of tracked buckets
+    :param timer: callable returning current time in seconds
+    """
+
+    def __init__(self, max_keys=100000, timer=time.monotonic):
+        self.max_keys = max_keys
+        self.timer = timer
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def consume(self, key, capacity, refill_rate, tokens=1):
+        now = self.timer()
+        with self._lock:
+            available, updated = self._buckets.get(key, (capacity, now))
+            available = min(capacity, available + (now - updated) * refill_rate)
+            allowed = available >= tokens
+            if allowed:
+                available -= tokens
+            self._buckets[key] = (available, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return allowed
+
+    def reset(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+
+class LoginThrottle(object):
+    """
+    Limits sign-in attempts per user name and per client address with
+    token buckets, checked before any database or password hashing work
+
+    :param backend: ThrottleBackend instance, defaults to
+        MemoryThrottleBackend
+    :param user_capacity: burst of attempts allowed for single user name
+    :param user_refill_rate: attempts per second regained for user name
+    :param ip_capacity: burst of attempts allowed for single address
+    :param ip_refill_rate: attempts per second regained for address
+    """
+
+    def __init__(
+        self,
+        backend=None,
+        user_capacity=5,
+        user_refill_rate=1 / 60.0,
+        ip_capacity=30,
+        ip_refill_rate=1.0,
+    ):
+        self.backend = backend if backend is not None else MemoryThrottleBackend()
+        self.user_capacity = user_capacity
+        self.user_refill_rate = user_refill_rate
+        self.ip_capacity = ip_capacity
+        self.ip_refill_rate = ip_refill_rate
+
+    def allow(self, user_name, client_addr=None):
+        """
+        takes one token from address bucket and then from user name bucket
+
+        :param user_name:
+        :param client_addr:
+        :return: True if attempt may proceed
+        """
+        if client_addr and not self.backend.consume(
+            ("ip", client_addr), self.ip_capacity, self.ip_refill_rate
+        ):
+            return False
+        return self.backend.consume(
+            ("user", (user_name or "").lower()),
+            self.user_capacity,
+            self.user_refill_rate,
+        )
+
+    def succeeded(self, user_name):
+        """
+        refills user name bucket after successful sign-in
+
+        :param user_name:
+        """
+        self.backend.reset(("user", (user_name or "").lower()))